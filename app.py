@@ -1,20 +1,35 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import io
+import json
 import os
+import zipfile
 import logging
 import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from pathlib import Path
 from datetime import timedelta
 import threading
-import colorsys
-from PIL import Image as PILImage
+import time
+from model_registry import ModelRegistry, file_fingerprint
+from user_store import UserStore
+from password_hashing import PasswordHasher, HashingBusyError
+from finetune import FinetuneQueue, FinetuneScheduler
+from upload_store import UploadStore, downscale_upload
+from static_assets import AssetManifest
+from fallback import heuristic_predict, channel_means, classify_means, ERROR_RESULT as FALLBACK_ERROR_RESULT
 
 # Variables globales para TensorFlow/modelo
 load_model = None
 image = None
 model = None
 np = None
+# Callable compilado (tf.function) asociado al modelo publicado; ver inference.py
+predict_fn = None
+# Contador de modelos publicados en este proceso (forma parte de la identidad del modelo)
+model_version = 0
+load_image_array = None
 
 # Configurar TensorFlow para uso mínimo de memoria ANTES de importar
 import os as _os
@@ -22,36 +37,24 @@ _os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # Silenciar logs de TF
 _os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'  # Deshabilitar oneDNN
 _os.environ['TF_FORCE_GPU_ALLOW_GROWTH'] = 'false'  # No reservar toda la GPU
 _os.environ['CUDA_VISIBLE_DEVICES'] = '-1'  # Force CPU usage
-_os.environ['OMP_NUM_THREADS'] = '1'  # Limit OpenMP threads
-_os.environ['TF_NUM_INTEROP_THREADS'] = '1'
-_os.environ['TF_NUM_INTRAOP_THREADS'] = '1'
 
-# Intentar importar TensorFlow y NumPy (opcional)
-try:
-    import numpy as np
-    
-    # Configurar TensorFlow para memoria limitada
-    import tensorflow as tf
-    tf.config.set_soft_device_placement(True)
-    # Limitar memoria de TensorFlow a ~400MB
-    gpus = tf.config.list_physical_devices('GPU')
-    if gpus:
-        for gpu in gpus:
-            tf.config.experimental.set_memory_growth(gpu, True)
-    
-    from tensorflow.keras.models import load_model as tf_load_model
-    from tensorflow.keras.preprocessing import image as tf_image
-    
-    # Si la importación tiene éxito, asignamos las funciones
-    load_model = tf_load_model
-    image = tf_image
-    
-    # NO cargar el modelo en import (esperar a background loader)
-    print("[INFO] TensorFlow configurado con límites de memoria")
-    logging.info('TensorFlow configurado con límites de memoria')
-except ImportError as e:
-    print("[INFO] TensorFlow/NumPy no disponible, funcionando en modo simulación:", e)
-    logging.warning('TensorFlow/NumPy no disponible en import inicial: %s', e)
+# Backend de inferencia: 'keras' (modelo .h5 con TensorFlow), 'tflite'
+# (modelo cuantizado con el intérprete ligero, sin importar TensorFlow completo)
+# o 'remote' (servidor de modelo compartido por socket Unix, ver model_server.py).
+# 'none' desactiva el modelo y sirve siempre el fallback heurístico (benchmarks).
+INFERENCE_BACKEND = _os.environ.get('INFERENCE_BACKEND', 'keras').strip().lower()
+
+# Hilos de OpenMP/TF y tamaño de batch: perfil calibrado para este backend y los
+# CPUs disponibles (inference_threads.json, ver thread_tuning.py); sin perfil,
+# 1 hilo y batch 8. OMP_NUM_THREADS, TF_NUM_*_THREADS, TFLITE_NUM_THREADS y
+# BATCH_MAX_SIZE en el entorno tienen prioridad.
+from thread_tuning import load_tuning
+inference_tuning = load_tuning(INFERENCE_BACKEND)
+inference_tuning.apply_env()
+
+# TensorFlow y NumPy NO se importan aquí: importar app.py debe ser rápido para que
+# gunicorn arranque y sirva login/health checks de inmediato. El warm-up en segundo
+# plano (start_background_warmup) los importa y carga el modelo al arrancar el worker.
 
 # =========================
 # CONFIGURACIÓN FLASK
@@ -61,7 +64,7 @@ UPLOAD_FOLDER = 'static/uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # Logging básico a archivo para diagnóstico
 logging.basicConfig(
-    filename=os.path.join(os.path.dirname(__file__), 'app.log'),
+    filename=os.environ.get('APP_LOG_PATH', os.path.join(os.path.dirname(__file__), 'app.log')),
     level=logging.INFO,
     format='%(asctime)s [PID:%(process)d] %(levelname)s: %(message)s'
 )
@@ -75,44 +78,51 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # =========================
 # BASE DE DATOS DE USUARIOS (SQLite)
 # =========================
-DB_PATH = Path(__file__).parent / 'users.db'
+DB_PATH = Path(os.environ.get('USERS_DB_PATH', Path(__file__).parent / 'users.db'))
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Conexiones reutilizadas por hilo, journal WAL y busy_timeout (ver user_store.py)
+user_store = UserStore(
+    DB_PATH,
+    journal_mode=os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    busy_timeout_ms=int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+)
 
 def init_db():
     # Crear tabla de usuarios si no existe y añadir usuario admin por defecto
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
+    user_store.init_schema()
 
     # Asegurar usuario admin por defecto (solo creación inicial)
     try:
-        cur.execute('SELECT id FROM users WHERE username = ?', ('admin',))
-        if cur.fetchone() is None:
-            hashed = generate_password_hash('admin123')
-            cur.execute('INSERT INTO users (username, password) VALUES (?, ?)', ('admin', hashed))
-            conn.commit()
+        if user_store.get_password_hash('admin') is None:
+            user_store.create_user('admin', generate_password_hash('admin123'))
     except sqlite3.Error:
         pass
-    finally:
-        conn.close()
 
 # Inicializar DB al importar
 init_db()
+
+# Hash de contraseñas en un pool acotado fuera del hilo de la petición (ver password_hashing.py).
+# PASSWORD_HASH_METHOD: 'scrypt' (por defecto de werkzeug), 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', ...
+password_hasher = PasswordHasher(
+    method=os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'),
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '1')),
+    max_queue=int(os.environ.get('PASSWORD_HASH_QUEUE', '16')),
+    timeout=float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10')),
+)
 # =========================
 # CONFIGURACIÓN DEL MODELO
 # =========================
 MODEL_PATH = 'garbage_model.h5'
+# Modelo TFLite exportado por train.py (--tflite): garbage_model_fp16.tflite o garbage_model_int8.tflite
+TFLITE_MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH', 'garbage_model_int8.tflite')
+# Socket del servidor de modelo compartido (INFERENCE_BACKEND=remote)
+MODEL_SERVER_SOCKET = os.environ.get('MODEL_SERVER_SOCKET', '/tmp/garbage_model.sock')
+if INFERENCE_BACKEND == 'tflite':
+    ACTIVE_MODEL_PATH = TFLITE_MODEL_PATH
+elif INFERENCE_BACKEND == 'remote':
+    ACTIVE_MODEL_PATH = f'unix:{MODEL_SERVER_SOCKET}'
+else:
+    ACTIVE_MODEL_PATH = MODEL_PATH
 
 # Debes usar las mismas clases detectadas en el entrenamiento
 CLASS_NAMES = ['cardboard', 'glass', 'metal', 'paper', 'plastic', 'trash']
@@ -184,6 +194,265 @@ INFO_RESIDUOS = {
     }
 }
 
+# =========================
+# MICRO-BATCHING DE INFERENCIA
+# =========================
+# Las peticiones concurrentes se agrupan en un solo forward pass (ver batching.py).
+# Ajustables por entorno: tamaño máximo de batch y espera máxima en milisegundos.
+BATCH_MAX_SIZE = inference_tuning.batch_max_size
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '10'))
+# Compilar el grafo de inferencia con XLA (opcional; puede mejorar latencia en CPU)
+INFERENCE_XLA = os.environ.get('INFERENCE_XLA', '0').lower() in ('1', 'true', 'yes')
+# Cada cuántos segundos se comprueba si el fichero del modelo cambió (0 = desactivado)
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '10'))
+
+
+def _make_batcher(version_predict_fn):
+    """Planificador de micro-batching de una versión de modelo (ver model_registry.py).
+    Con el backend remote el servidor de modelo ya agrupa las peticiones de todos los
+    workers: agrupar también aquí sumaría BATCH_MAX_WAIT_MS a su espera en cada petición.
+    """
+    from batching import MicroBatcher, PassThroughBatcher
+    if INFERENCE_BACKEND == 'remote':
+        return PassThroughBatcher(version_predict_fn)
+    return MicroBatcher(version_predict_fn, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+
+
+def model_ready():
+    """True si este proceso tiene un modelo publicado listo para inferir."""
+    return model is not None and np is not None
+
+
+def predict_probabilities(img_array):
+    """Encola un tensor preprocesado (1,128,128,3) y devuelve su vector de probabilidades."""
+    with model_registry.acquire() as mv:
+        return mv.batcher.submit(img_array[0])
+
+
+# =========================
+# CACHÉ DE PREDICCIONES
+# =========================
+# Clave: hash de los bytes subidos + identidad del modelo (ver prediction_cache.py)
+from prediction_cache import PredictionCache, make_key as make_cache_key
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get('PREDICTION_CACHE_ENTRIES', '1024')),
+    max_bytes=int(os.environ.get('PREDICTION_CACHE_MAX_BYTES', str(1024 * 1024))),
+    ttl_seconds=float(os.environ.get('PREDICTION_CACHE_TTL', '3600')),
+)
+
+
+def current_model_id():
+    """Identidad del modelo que atendería una predicción ahora mismo ('fallback' si no hay modelo)."""
+    if not model_ready():
+        return 'fallback'
+    return f'{ACTIVE_MODEL_PATH}#{model_version}'
+
+
+def cached_prediction(data, compute):
+    """Devuelve (label, confidence) desde la caché o llamando a `compute()` y guardándolo."""
+    key = make_cache_key(data, current_model_id())
+    hit = prediction_cache.get(key)
+    if hit is not None:
+        logging.info('Prediction cache hit (%s) [PID=%d]', key[:16], os.getpid())
+        return hit
+    value = compute()
+    prediction_cache.put(key, value)
+    return value
+
+
+# =========================
+# MÉTRICAS (PROMETHEUS)
+# =========================
+# Histogramas por etapa, contadores por origen/etiqueta y gauges del modelo (ver metrics.py).
+# Se exponen en /metrics; si METRICS_TOKEN está definido se exige "Authorization: Bearer <token>".
+import metrics as metrics_lib
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+metrics_registry = metrics_lib.MetricsRegistry()
+REQUEST_SECONDS = metrics_registry.histogram(
+    'garbage_http_request_duration_seconds', 'Duración total de la petición', ('endpoint', 'method', 'status'))
+STAGE_SECONDS = metrics_registry.histogram(
+    'garbage_prediction_stage_duration_seconds',
+    'Duración de cada etapa de la predicción (read, downscale, persist, lazy_load, preprocess, inference, fallback, render)',
+    ('route', 'stage'))
+PREDICTIONS_TOTAL = metrics_registry.counter(
+    'garbage_predictions_total', 'Predicciones servidas por origen y etiqueta', ('route', 'source', 'label'))
+PREDICTION_ERRORS_TOTAL = metrics_registry.counter(
+    'garbage_prediction_errors_total', 'Predicciones fallidas por origen', ('route', 'source'))
+MODEL_LOADED = metrics_registry.gauge('garbage_model_loaded', '1 si este proceso tiene el modelo cargado')
+MODEL_VERSION = metrics_registry.gauge('garbage_model_version', 'Versión del modelo publicada en este proceso')
+MODEL_LOADING = metrics_registry.gauge('garbage_model_loading', '1 mientras se carga o recarga el modelo')
+BATCH_QUEUE_DEPTH = metrics_registry.gauge('garbage_batch_queue_depth', 'Peticiones esperando al micro-batcher')
+CACHE_LOOKUPS = metrics_registry.gauge(
+    'garbage_prediction_cache_lookups_total', 'Consultas a la caché de predicciones', ('result',), kind='counter')
+CACHE_ENTRIES = metrics_registry.gauge('garbage_prediction_cache_entries', 'Entradas en la caché de predicciones')
+MODEL_LOADED.set_function(lambda: 1 if model_ready() else 0)
+MODEL_VERSION.set_function(lambda: model_version)
+MODEL_LOADING.set_function(lambda: 1 if model_registry.status()['loading'] else 0)
+CACHE_ENTRIES.set_function(lambda: prediction_cache.stats()['entries'])
+CACHE_LOOKUPS.set_function(lambda: {('hit',): prediction_cache.hits, ('miss',): prediction_cache.misses})
+
+
+PASSWORD_HASH_SECONDS = metrics_registry.histogram(
+    'garbage_password_hash_duration_seconds', 'Duración de cada hash/verificación de contraseña', ('op',))
+PASSWORD_HASH_QUEUE = metrics_registry.gauge(
+    'garbage_password_hash_queue_depth', 'Operaciones de contraseña esperando un hilo del pool')
+PASSWORD_HASH_REJECTED = metrics_registry.gauge(
+    'garbage_password_hash_rejected_total', 'Operaciones rechazadas por cola llena', kind='counter')
+password_hasher.timer = lambda op, seconds: PASSWORD_HASH_SECONDS.observe(seconds, op=op)
+PASSWORD_HASH_QUEUE.set_function(lambda: password_hasher.stats()['queue_depth'])
+PASSWORD_HASH_REJECTED.set_function(lambda: password_hasher.stats()['rejected'])
+
+
+def _batch_queue_depth():
+    mv = model_registry.active
+    return mv.batcher.stats()['queue_depth'] if mv is not None and mv.batcher is not None else 0
+
+
+BATCH_QUEUE_DEPTH.set_function(_batch_queue_depth)
+
+
+def stage_timer(route, stage):
+    """Context manager que registra la duración de una etapa de la predicción."""
+    return STAGE_SECONDS.time(route=route, stage=stage)
+
+
+def count_prediction(route, source, label):
+    PREDICTIONS_TOTAL.inc(route=route, source=source, label=label)
+
+
+# =========================
+# RECURSOS ESTÁTICOS
+# =========================
+# Las plantillas piden las imágenes de static/ a través de asset_url/asset_image_set/
+# asset_picture, que devuelven las variantes de static/dist/ (AVIF/WebP + fallback,
+# nombre con huella de contenido; ver static_assets.py). Como la URL cambia con el
+# contenido, static/dist/ se sirve como inmutable durante un año. El resto de static/
+# (URLs sin huella) usa un max-age corto y se revalida con ETag.
+STATIC_ASSETS = os.environ.get('STATIC_ASSETS', '1').lower() in ('1', 'true', 'yes')
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.environ.get('STATIC_MAX_AGE', '3600'))
+asset_manifest = AssetManifest(app.static_folder, url_for=lambda filename: url_for('static', filename=filename),
+                               enabled=STATIC_ASSETS)
+app.jinja_env.globals.update(asset_manifest.template_helpers())
+
+
+@app.after_request
+def _static_cache_headers(response):
+    if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith('dist/'):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+# =========================
+# PERSISTENCIA DE SUBIDAS
+# =========================
+# La predicción decodifica directamente desde memoria; guardar el original es
+# opcional (SAVE_UPLOADS). Las subidas van a un almacén direccionado por
+# contenido (upload_store.py): sin colisiones de nombre, sin duplicados, con
+# miniatura para index.html y retención por antigüedad/tamaño en segundo plano.
+SAVE_UPLOADS = os.environ.get('SAVE_UPLOADS', '1').lower() in ('1', 'true', 'yes')
+UPLOAD_STORE_DIR = os.environ.get('UPLOAD_STORE_DIR', os.path.join(UPLOAD_FOLDER, 'store'))
+UPLOAD_STORE_MAX_MB = float(os.environ.get('UPLOAD_STORE_MAX_MB', '500'))
+UPLOAD_STORE_MAX_AGE_HOURS = float(os.environ.get('UPLOAD_STORE_MAX_AGE_HOURS', '72'))
+UPLOAD_SWEEP_INTERVAL = float(os.environ.get('UPLOAD_SWEEP_INTERVAL', '300'))  # 0 = sin retención periódica
+UPLOAD_THUMB_SIZE = int(os.environ.get('UPLOAD_THUMB_SIZE', '256'))
+upload_store = UploadStore(
+    root=UPLOAD_STORE_DIR,
+    static_root=app.static_folder,
+    max_bytes=UPLOAD_STORE_MAX_MB * 1024 * 1024,
+    max_age_s=UPLOAD_STORE_MAX_AGE_HOURS * 3600,
+    thumb_size=UPLOAD_THUMB_SIZE,
+)
+
+UPLOAD_STORE_BYTES = metrics_registry.gauge('garbage_upload_store_bytes', 'Bytes ocupados por el almacén de subidas')
+UPLOAD_STORE_FILES = metrics_registry.gauge(
+    'garbage_upload_store_files', 'Ficheros en el almacén de subidas', ('kind',))
+UPLOAD_STORE_EVICTED = metrics_registry.gauge(
+    'garbage_upload_store_evicted_files_total', 'Ficheros desalojados por la retención', kind='counter')
+UPLOAD_STORE_EVICTED_BYTES = metrics_registry.gauge(
+    'garbage_upload_store_evicted_bytes_total', 'Bytes desalojados por la retención', kind='counter')
+UPLOAD_STORE_BYTES.set_function(lambda: upload_store.stats()['usage']['bytes'])
+UPLOAD_STORE_FILES.set_function(lambda: {('original',): upload_store.stats()['usage']['originals'],
+                                         ('thumbnail',): upload_store.stats()['usage']['thumbnails']})
+UPLOAD_STORE_EVICTED.set_function(lambda: upload_store.stats()['evicted_since_start']['files'])
+UPLOAD_STORE_EVICTED_BYTES.set_function(lambda: upload_store.stats()['evicted_since_start']['bytes'])
+
+
+@app.before_request
+def _ensure_upload_sweeper():
+    # Un hilo de retención por proceso (tras el fork de gunicorn el del padre no existe)
+    if SAVE_UPLOADS:
+        upload_store.start_sweeper(UPLOAD_SWEEP_INTERVAL)
+
+
+# Lado mayor (px) de las imágenes que se clasifican y guardan. index.html reduce las
+# fotos en el navegador a este tamaño antes de subirlas; las subidas mayores (clientes
+# de la API, navegadores sin canvas) se reducen aquí con decodificación en draft mode.
+UPLOAD_MAX_SIDE = int(os.environ.get('UPLOAD_MAX_SIDE', '1024'))  # 0 = sin límite
+UPLOAD_CLIENT_QUALITY = float(os.environ.get('UPLOAD_CLIENT_QUALITY', '0.85'))
+app.jinja_env.globals.update(upload_max_side=UPLOAD_MAX_SIDE, upload_client_quality=UPLOAD_CLIENT_QUALITY)
+UPLOADS_DOWNSCALED = metrics_registry.counter(
+    'garbage_uploads_downscaled_total', 'Subidas reducidas en el servidor por superar UPLOAD_MAX_SIDE', ('route',))
+UPLOAD_BYTES = metrics_registry.histogram(
+    'garbage_upload_bytes', 'Tamaño de las subidas recibidas', ('route',),
+    buckets=(16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6))
+
+
+def read_upload(route, file):
+    """Lee la subida a memoria y la reduce si supera UPLOAD_MAX_SIDE. Devuelve los bytes."""
+    with stage_timer(route, 'read'):
+        data = file.read()
+    return shrink_upload(route, file.filename, data)
+
+
+def shrink_upload(route, filename, data):
+    """Guarda de tamaño para bytes ya leídos (también la usa asgi_api.py)."""
+    UPLOAD_BYTES.observe(len(data), route=route)
+    with stage_timer(route, 'downscale'):
+        reduced, original_size = downscale_upload(data, UPLOAD_MAX_SIDE)
+    if original_size is not None:
+        UPLOADS_DOWNSCALED.inc(route=route)
+        logging.info('Subida %s reducida en el servidor: %dx%d, %d -> %d bytes [PID=%d]', filename,
+                     original_size[0], original_size[1], len(data), len(reduced), os.getpid())
+    return reduced
+
+
+def persist_upload(filename, data, thumbnail=True):
+    """Guarda la subida en el almacén (el original en segundo plano).
+    Devuelve la URL de la miniatura para la página de resultado, o None si la
+    persistencia está desactivada o no se pudo generar.
+    """
+    if not SAVE_UPLOADS:
+        return None
+    stored = upload_store.put(data, filename, thumbnail=thumbnail)
+    return url_for('static', filename=stored.thumbnail) if stored.thumbnail else None
+
+
+def lazy_load_model():
+    """Si el modelo no está cargado en este proceso, intenta cargarlo ahora.
+    Devuelve True si se acaba de cargar.
+    """
+    if model is not None or INFERENCE_BACKEND == 'none':
+        return False
+    if _warmup_state['status'] in ('starting', 'importing', 'loading'):
+        # El warm-up de arranque sigue en curso: no bloquear la petición, usar fallback
+        return False
+    logging.info('Lazy loading model on first prediction (PID=%d)', os.getpid())
+    try:
+        ok, msg = reload_model_from_disk()
+        if ok:
+            logging.info('Lazy load successful: %s', msg)
+        else:
+            logging.warning('Lazy load failed: %s', msg)
+        return ok
+    except Exception as e:
+        logging.error('Error during lazy load: %s', e)
+        return False
+
+
 # =========================
 # RUTA PRINCIPAL
 # =========================
@@ -207,112 +476,81 @@ def upload():
     if not file:
         return render_template('index.html', prediction="No se subió ninguna imagen.")
     
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(filepath)
+    # Leer la subida una sola vez a memoria (reducida si es muy grande); el guardado en disco va en segundo plano
+    data = read_upload('predict', file)
+    with stage_timer('predict', 'persist'):
+        thumb_url = persist_upload(file.filename, data)
 
     # Lazy loading: Si el modelo no está cargado, intentar cargarlo ahora
-    global model
-    if model is None and load_model is not None and image is not None and np is not None:
-        logging.info('Lazy loading model on first prediction (PID=%d)', os.getpid())
-        try:
-            ok, msg = reload_model_from_disk()
-            if ok:
-                logging.info('Lazy load successful: %s', msg)
-                flash('Modelo cargado automáticamente (primera predicción).', 'info')
-            else:
-                logging.warning('Lazy load failed: %s', msg)
-        except Exception as e:
-            logging.error('Error during lazy load: %s', e)
-    
+    with stage_timer('predict', 'lazy_load'):
+        loaded_now = lazy_load_model()
+    if loaded_now:
+        flash('Modelo cargado automáticamente (primera predicción).', 'info')
+
     # Si después del lazy loading el modelo aún no está disponible, usar fallback
-    if model is None or load_model is None or image is None or np is None:
+    if not model_ready():
         logging.info('Predict requested but model not loaded in this process (PID=%d)', os.getpid())
         # Intentar una predicción heurística ligera y rápida (fallback)
         try:
-            def heuristic_predict(img_path):
-                """Heurística rápida basada en brillo / color para fallback.
-                Devuelve (label, confidence).
-                """
-                try:
-                    im = PILImage.open(img_path).convert('RGB')
-                    # reducir tamaño para rapidez
-                    im = im.resize((64, 64))
-                    pixels = list(im.getdata())
-                    # medias
-                    r_mean = sum([p[0] for p in pixels]) / len(pixels)
-                    g_mean = sum([p[1] for p in pixels]) / len(pixels)
-                    b_mean = sum([p[2] for p in pixels]) / len(pixels)
-                    # brillo aproximado
-                    brightness = 0.2126 * r_mean + 0.7152 * g_mean + 0.0722 * b_mean
-                    # saturación aproximada usando HSV de promedio RGB
-                    rn, gn, bn = r_mean/255.0, g_mean/255.0, b_mean/255.0
-                    h, s, v = colorsys.rgb_to_hsv(rn, gn, bn)
-
-                    # reglas heurísticas (muy simples)
-                    if brightness < 60:
-                        return 'trash', 45.0
-                    if s < 0.15 and brightness > 200:
-                        return 'paper', 65.0
-                    # verde dominante -> vidrio
-                    if g_mean >= r_mean and g_mean >= b_mean and g_mean > 110:
-                        return 'glass', 60.0
-                    # rojo dominante -> metal (heurística)
-                    if r_mean > g_mean and r_mean > b_mean and r_mean > 130:
-                        return 'metal', 55.0
-                    # brillo medio y saturación alta -> plástico
-                    if brightness > 120 and s > 0.25:
-                        return 'plastic', 58.0
-                    # por defecto: cartón
-                    return 'cardboard', 50.0
-                except Exception as e:
-                    logging.warning('Heuristic predict failed for %s: %s', img_path, e)
-                    return 'trash', 40.0
-
-            fallback_label, fallback_conf = heuristic_predict(filepath)
+            def heuristic_predict_timed():
+                with stage_timer('predict', 'fallback'):
+                    return heuristic_predict(io.BytesIO(data))
+
+            # Los fallos de decodificación salen de compute() para no quedar en la caché
+            try:
+                fallback_label, fallback_conf = cached_prediction(data, heuristic_predict_timed)
+            except Exception as e:
+                logging.warning('Heuristic predict failed for %s: %s', file.filename, e)
+                PREDICTION_ERRORS_TOTAL.inc(route='predict', source='fallback')
+                fallback_label, fallback_conf = FALLBACK_ERROR_RESULT
+            count_prediction('predict', 'fallback', fallback_label)
             result = fallback_label
             confidence = fallback_conf
-            logging.info('Fallback heuristic prediction for %s -> %s (%.2f%%) [PID=%d]', filepath, result, confidence, os.getpid())
+            logging.info('Fallback heuristic prediction for %s -> %s (%.2f%%) [PID=%d]', file.filename, result, confidence, os.getpid())
             # marcar que es aproximada
             result = f"{result} (aprox.)"
             flash('Se devolvió una predicción aproximada (fallback) porque el modelo no está cargado en este proceso.', 'warning')
         except Exception as e:
-            logging.error('Error generando fallback heurístico para %s: %s', filepath, e)
+            logging.error('Error generando fallback heurístico para %s: %s', file.filename, e)
             result = 'error'
             confidence = 0.0
 
     # Si no tenemos TensorFlow o el modelo, avisamos claramente y NO devolvemos una
     # predicción simulada (evita confundir a usuarios remotos).
     prediction_override = None
-    if model is None or image is None or np is None:
+    if not model_ready():
         # No devolvemos una etiqueta ficticia; mostramos mensaje claro en la UI
         prediction_override = ('Modelo no cargado en este proceso. Inicia sesión como admin y pulsa "Recargar modelo" o reinicia la aplicación.')
         # Avisar al usuario/admin para recargar modelo (si no está cargado en este proceso)
         flash('Modelo no cargado en el servidor; por favor recarga o reinicia la app (admin).', 'error')
-        logging.warning('Modelo no cargado (predicción no disponible) para %s (PID=%d)', filepath, os.getpid())
+        logging.warning('Modelo no cargado (predicción no disponible) para %s (PID=%d)', file.filename, os.getpid())
     else:
         try:
-            # Preprocesar imagen
-            img = image.load_img(filepath, target_size=(128, 128))
-            img_array = image.img_to_array(img)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = img_array / 255.0
-
-            # Predicción real
-            predictions = model.predict(img_array)
-            class_index = np.argmax(predictions)
-            result = CLASS_NAMES[class_index]
-            confidence = predictions[0][class_index] * 100
-            logging.info('Predicción real para %s -> %s (%.2f%%) [PID=%d]', filepath, result, confidence, os.getpid())
+            def model_predict():
+                # Preprocesar imagen (decodificar + redimensionar + normalizar)
+                with stage_timer('predict', 'preprocess'):
+                    img_array = load_image_array(io.BytesIO(data))
+
+                # Predicción real (agrupada con otras peticiones concurrentes)
+                with stage_timer('predict', 'inference'):
+                    probs = predict_probabilities(img_array)
+                class_index = int(np.argmax(probs))
+                return CLASS_NAMES[class_index], float(probs[class_index]) * 100
+
+            result, confidence = cached_prediction(data, model_predict)
+            count_prediction('predict', 'model', result)
+            logging.info('Predicción real para %s -> %s (%.2f%%) [PID=%d]', file.filename, result, confidence, os.getpid())
         except Exception as e:
+            PREDICTION_ERRORS_TOTAL.inc(route='predict', source='model')
             print("[ERROR] Error al procesar imagen:", e)
-            logging.error('Error procesando imagen %s: %s', filepath, e)
+            logging.error('Error procesando imagen %s: %s', file.filename, e)
             result = 'error'
             confidence = 0.0
 
     info = INFO_RESIDUOS.get(result, None) if (model is not None and result is not None) else None
 
     # Source: whether this came from the real model or from the fallback heuristic
-    source = 'model' if (model is not None and image is not None and np is not None) else 'fallback'
+    source = 'model' if model_ready() else 'fallback'
 
     # Si definimos un override de mensaje (ej. modelo no cargado), usarlo para la UI
     if prediction_override is not None:
@@ -320,13 +558,14 @@ def upload():
     else:
         prediction_text = f"Predicción: {result} ({confidence:.2f}% confianza)"
 
-    return render_template(
-        'index.html',
-        prediction=prediction_text,
-        img_path=filepath,
-        info=info,
-        source=source
-    )
+    with stage_timer('predict', 'render'):
+        return render_template(
+            'index.html',
+            prediction=prediction_text,
+            img_path=thumb_url,
+            info=info,
+            source=source
+        )
 
 
 
@@ -364,13 +603,18 @@ def login():
             flash('Por favor ingresa usuario y contraseña.', 'error')
             return render_template('login.html')
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT password FROM users WHERE username = ?', (username,))
-        row = cur.fetchone()
-        conn.close()
-
-        if row and check_password_hash(row['password'], password):
+        stored_hash = user_store.get_password_hash(username)
+        try:
+            # Si el hash usa parámetros antiguos, se recalcula en segundo plano y se guarda
+            valid = bool(stored_hash) and password_hasher.verify_and_update(
+                stored_hash, password,
+                on_rehash=lambda old_hash, new_hash: user_store.update_password_hash(username, new_hash, old_hash))
+        except HashingBusyError:
+            logging.warning('Login rechazado: cola de contraseñas llena [PID=%d]', os.getpid())
+            flash('Servidor ocupado, inténtalo de nuevo en unos segundos.', 'error')
+            return render_template('login.html'), 503
+
+        if valid:
             session['user'] = username
             # Mantener la sesión incluso si el usuario cierra el navegador
             session.permanent = True
@@ -398,21 +642,17 @@ def register():
             flash('Las contraseñas no coinciden.', 'error')
             return render_template('register.html')
 
-        conn = get_db_connection()
-        cur = conn.cursor()
         try:
-            hashed = generate_password_hash(password)
-            cur.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, hashed))
-            conn.commit()
+            user_store.create_user(username, password_hasher.hash(password))
+        except HashingBusyError:
+            flash('Servidor ocupado, inténtalo de nuevo en unos segundos.', 'error')
+            return render_template('register.html'), 503
         except sqlite3.IntegrityError:
             flash('El usuario ya existe.', 'error')
-            conn.close()
             return render_template('register.html')
         except sqlite3.Error:
             flash('Error al crear usuario.', 'error')
-            conn.close()
             return render_template('register.html')
-        conn.close()
         flash('Registro exitoso. Ya puedes iniciar sesión.', 'success')
         return redirect(url_for('login'))
 
@@ -429,8 +669,6 @@ def logout():
 @app.route('/users', methods=['GET', 'POST'])
 @admin_required
 def users():
-    conn = get_db_connection()
-    cur = conn.cursor()
     if request.method == 'POST':
         # Crear nuevo usuario desde formulario admin
         username = request.form.get('username')
@@ -439,18 +677,16 @@ def users():
             flash('Usuario y contraseña requeridos.', 'error')
         else:
             try:
-                hashed = generate_password_hash(password)
-                cur.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, hashed))
-                conn.commit()
+                user_store.create_user(username, password_hasher.hash(password))
                 flash(f'Usuario "{username}" creado.', 'success')
+            except HashingBusyError:
+                flash('Servidor ocupado, inténtalo de nuevo en unos segundos.', 'error')
             except sqlite3.IntegrityError:
                 flash('El usuario ya existe.', 'error')
             except sqlite3.Error:
                 flash('Error al crear usuario.', 'error')
 
-    cur.execute('SELECT id, username FROM users ORDER BY username')
-    rows = cur.fetchall()
-    conn.close()
+    rows = user_store.list_users()
     return render_template('users.html', users=rows, user=session.get('user'))
 
 
@@ -458,75 +694,251 @@ def users():
 @app.route('/users/delete/<int:user_id>', methods=['POST'])
 @admin_required
 def delete_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-    row = cur.fetchone()
-    if not row:
+    username = user_store.get_username(user_id)
+    if not username:
         flash('Usuario no encontrado.', 'error')
-        conn.close()
         return redirect(url_for('users'))
 
-    username = row['username']
     # No permitir eliminar admin
     if username == 'admin':
         flash('No se puede eliminar el usuario admin.', 'error')
-        conn.close()
         return redirect(url_for('users'))
 
     # Evitar que el admin se elimine a sí mismo accidentalmente
     if username == session.get('user'):
         flash('No puedes eliminar la sesión actualmente iniciada.', 'error')
-        conn.close()
         return redirect(url_for('users'))
 
     try:
-        cur.execute('DELETE FROM users WHERE id = ?', (user_id,))
-        conn.commit()
+        user_store.delete_user(user_id)
         flash(f'Usuario "{username}" eliminado.', 'success')
     except sqlite3.Error:
         flash('Error al eliminar usuario.', 'error')
-    finally:
-        conn.close()
 
     return redirect(url_for('users'))
 
 
-def reload_model_from_disk():
-    """Intenta recargar el modelo desde disco y actualiza la variable global `model`.
+def _import_backend():
+    """Importa (si faltan) NumPy, el preprocesado y, con backend keras, TensorFlow/Keras.
     Devuelve (ok: bool, message: str).
     """
-    global model, load_model, image, np
-    # Si las funciones de TF no están disponibles en este proceso, intentar importarlas dinámicamente
-    if load_model is None or image is None or np is None:
-        try:
-            import numpy as _np
+    global load_model, image, np, load_image_array
+    if INFERENCE_BACKEND == 'none':
+        return False, 'Modelo desactivado (INFERENCE_BACKEND=none): solo fallback heurístico'
+    try:
+        import numpy as _np
+        from inference import load_image_array as _load_image_array
+        np = _np
+        load_image_array = _load_image_array
+        # Con TFLite o servidor remoto no se importa TensorFlow: ahorra la mayor parte de la memoria
+        if INFERENCE_BACKEND not in ('tflite', 'remote') and (load_model is None or image is None):
+            started = time.perf_counter()
+            import tensorflow as tf
+            inference_tuning.configure_tensorflow(tf)
+            tf.config.set_soft_device_placement(True)
+            gpus = tf.config.list_physical_devices('GPU')
+            if gpus:
+                for gpu in gpus:
+                    tf.config.experimental.set_memory_growth(gpu, True)
             from tensorflow.keras.models import load_model as _tf_load_model
             from tensorflow.keras.preprocessing import image as _tf_image
-            # asignar a variables globales
-            np = _np
             load_model = _tf_load_model
             image = _tf_image
-        except Exception as e:
-            logging.error('Error importando TensorFlow/NumPy en reload_model_from_disk: %s', e)
-            return False, f'TensorFlow/NumPy no disponible o error al importarlos: {e}'
-
-    try:
-        new_model = load_model(MODEL_PATH)
-        model = new_model
-        logging.info('Modelo recargado desde %s', MODEL_PATH)
-        return True, f'Modelo recargado desde {MODEL_PATH}'
+            logging.info('TensorFlow importado en %.2fs (PID=%d)', time.perf_counter() - started, os.getpid())
+        return True, ''
     except Exception as e:
-        logging.error('Error recargando el modelo desde %s: %s', MODEL_PATH, e)
-        return False, f'Error recargando el modelo: {e}'
+        logging.error('Error importando TensorFlow/NumPy en reload_model_from_disk: %s', e)
+        return False, f'TensorFlow/NumPy no disponible o error al importarlos: {e}'
+
+
+def _load_keras_model():
+    """Carga el .h5 y devuelve (model, predict_fn) compilado y calentado."""
+    from inference import build_inference_fn, warm_up
+    new_model = load_model(MODEL_PATH, compile=False)
+    # Compilar y calentar ANTES de publicar: el primer usuario no paga el trazado
+    new_predict_fn = build_inference_fn(new_model, jit_compile=INFERENCE_XLA)
+    warm_up(new_predict_fn, batch_sizes=sorted({1, BATCH_MAX_SIZE}))
+    return new_model, new_predict_fn
+
+
+def _load_tflite_model():
+    """Carga el modelo .tflite con el intérprete ligero (sin TensorFlow completo)."""
+    from inference import TFLiteModel, warm_up
+    new_model = TFLiteModel(TFLITE_MODEL_PATH, num_threads=inference_tuning.tflite_threads)
+    warm_up(new_model.predict, batch_sizes=(1,), rounds=1)
+    return new_model, new_model.predict
+
+
+def _connect_model_server():
+    """Conecta con el servidor de modelo compartido (model_server.py) en lugar de cargar TF."""
+    from model_server import ModelServerClient
+    client = ModelServerClient(MODEL_SERVER_SOCKET)
+    status = client.ping()
+    logging.info('Conectado al servidor de modelo %s (%s)', MODEL_SERVER_SOCKET, status.get('model_path'))
+    return client, client.predict
+
+
+def _load_active_backend():
+    # Se ejecuta en el hilo de recarga: si aún faltan TF/NumPy se importan aquí, no en la petición
+    ok, msg = _import_backend()
+    if not ok:
+        raise RuntimeError(msg)
+    if INFERENCE_BACKEND == 'tflite':
+        return _load_tflite_model()
+    if INFERENCE_BACKEND == 'remote':
+        return _connect_model_server()
+    return _load_keras_model()
+
+
+def _model_fingerprint():
+    if INFERENCE_BACKEND == 'remote':
+        return None  # el servidor de modelo gestiona su propio fichero
+    return file_fingerprint(ACTIVE_MODEL_PATH)
+
+
+def _on_model_published(mv):
+    """Callback del registro tras un cambio de versión: actualiza globals e invalida la caché."""
+    global model, predict_fn, model_version
+    model, predict_fn, model_version = mv.model, mv.predict_fn, mv.version
+    prediction_cache.clear()
+
+
+model_registry = ModelRegistry(
+    loader=_load_active_backend,
+    fingerprint_fn=_model_fingerprint,
+    batcher_factory=_make_batcher,
+    on_publish=_on_model_published,
+)
+
+
+@app.before_request
+def _ensure_model_watcher():
+    # Un watcher por proceso (tras el fork de gunicorn el hilo del padre no existe)
+    model_registry.start_watcher(MODEL_WATCH_INTERVAL)
+
+
+def reload_model_from_disk(reason='manual'):
+    """Carga y calienta el modelo en este hilo y lo publica de forma atómica en el registro.
+    Devuelve (ok: bool, message: str).
+    """
+    ok, msg = _import_backend()
+    if not ok:
+        return ok, msg
+    ok, msg = model_registry.reload(reason)
+    if ok:
+        logging.info('Modelo recargado desde %s', ACTIVE_MODEL_PATH)
+    return ok, msg
+
+
+def reload_model_in_background(reason='manual'):
+    """Lanza la recarga sin bloquear la petición. Devuelve (started: bool, message: str).
+    La importación de TF/NumPy (si el warm-up no la hizo) ocurre en el hilo de recarga.
+    """
+    if INFERENCE_BACKEND == 'none':
+        return False, 'Modelo desactivado (INFERENCE_BACKEND=none): solo fallback heurístico'
+    if model_registry.reload_async(reason):
+        return True, 'Recarga del modelo iniciada en segundo plano; consulta /model_status.'
+    return False, 'Ya hay una recarga del modelo en curso.'
+
+
+# =========================
+# WARM-UP EN SEGUNDO PLANO Y HEALTH CHECKS
+# =========================
+WARMUP_ON_BOOT = os.environ.get('WARMUP_ON_BOOT', '1').lower() in ('1', 'true', 'yes')
+_process_started = time.time()
+_warmup_state = {'status': 'not_started', 'pid': None, 'started_at': None, 'finished_at': None, 'message': None}
+_warmup_lock = threading.Lock()
+
+
+def _background_warmup():
+    logging.info('Background model loader thread started (PID=%s)', os.getpid())
+    _warmup_state['status'] = 'importing'
+    ok, msg = _import_backend()
+    if ok:
+        _warmup_state['status'] = 'loading'
+        ok, msg = reload_model_from_disk('warmup')
+    _warmup_state.update(status='ready' if ok else 'failed', finished_at=time.time(), message=msg)
+    if ok:
+        logging.info('Background loader: %s', msg)
+    else:
+        logging.warning('Background loader failed: %s', msg)
+
+
+def start_background_warmup():
+    """Importa TF/NumPy y carga el modelo en un hilo de fondo (una vez por proceso).
+    Lo llama el hook post_worker_init de gunicorn.conf.py y, por si acaso, la primera petición.
+    """
+    with _warmup_lock:
+        if _warmup_state['pid'] == os.getpid():
+            return False
+        _warmup_state.update(status='starting', pid=os.getpid(), started_at=time.time(), finished_at=None, message=None)
+    threading.Thread(target=_background_warmup, name='model-warmup', daemon=True).start()
+    return True
+
+
+@app.before_request
+def _ensure_warmup_started():
+    if WARMUP_ON_BOOT:
+        start_background_warmup()
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: el proceso responde (no depende de TensorFlow ni del modelo)."""
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'uptime_s': round(time.time() - _process_started, 1)})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 solo cuando el modelo está cargado en este proceso; 503 mientras tanto."""
+    ready = model_ready()
+    started_at, finished_at = _warmup_state['started_at'], _warmup_state['finished_at']
+    body = {
+        'ready': ready,
+        'pid': os.getpid(),
+        'warmup': _warmup_state['status'],
+        'warmup_s': round((finished_at or time.time()) - started_at, 2) if started_at else None,
+        'message': _warmup_state['message'],
+        'model_version': model_version,
+    }
+    return jsonify(body), (200 if ready else 503)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Etiquetar por endpoint (no por URL) para acotar la cardinalidad
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown',
+                                method=request.method, status=response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas de este proceso en formato de texto Prometheus."""
+    if METRICS_TOKEN and request.headers.get('Authorization', '') != f'Bearer {METRICS_TOKEN}':
+        return Response('forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics_registry.render(), content_type=metrics_lib.CONTENT_TYPE)
 
 
 @app.route('/reload_model', methods=['POST'])
 @admin_required
 def reload_model():
-    ok, msg = reload_model_from_disk()
+    # Actualizar el mtime del fichero para que los watchers de los demás workers también recarguen
+    if INFERENCE_BACKEND != 'remote':
+        try:
+            os.utime(ACTIVE_MODEL_PATH)
+        except OSError as e:
+            logging.warning('No se pudo actualizar mtime de %s: %s', ACTIVE_MODEL_PATH, e)
+    ok, msg = reload_model_in_background('admin')
     if ok:
-        flash(msg, 'success')
+        flash(msg, 'info')
     else:
         flash(msg, 'error')
     return redirect(url_for('index'))
@@ -538,17 +950,44 @@ def model_status():
     """Devuelve el estado del modelo cargado (solo admin)."""
     return jsonify({
         'loaded': model is not None,
-        'model_path': MODEL_PATH,
-        'class_names': CLASS_NAMES
+        'model_path': ACTIVE_MODEL_PATH,
+        'backend': INFERENCE_BACKEND,
+        'class_names': CLASS_NAMES,
+        'model_version': model_version,
+        'registry': model_registry.status(),
+        'batching': model_registry.active.batcher.stats() if model_registry.active else None,
+        'prediction_cache': prediction_cache.stats(),
+        'threads': inference_tuning.describe()
+    })
+
+
+@app.route('/auth_status', methods=['GET'])
+@admin_required
+def auth_status():
+    """Estado del pool de hash de contraseñas (cola, tiempos, rechazos) y de users.db."""
+    return jsonify({
+        'pid': os.getpid(),
+        'password_hashing': password_hasher.stats(),
+        'user_store': user_store.stats(),
     })
 
 
+@app.route('/upload_store_status', methods=['GET'])
+@admin_required
+def upload_store_status():
+    """Uso de disco del almacén de subidas y desalojos; ?sweep=1 fuerza una pasada de retención."""
+    if request.args.get('sweep') == '1':
+        upload_store.sweep()
+    return jsonify(dict(upload_store.stats(), pid=os.getpid(), enabled=SAVE_UPLOADS,
+                        sweep_interval_s=UPLOAD_SWEEP_INTERVAL))
+
+
 @app.route('/public_model_status', methods=['GET'])
 def public_model_status():
     """Estado público del modelo (para la UI)."""
     return jsonify({
         'loaded': model is not None,
-        'model_path': MODEL_PATH if model is not None else None
+        'model_path': ACTIVE_MODEL_PATH if model is not None else None
     })
 
 
@@ -564,7 +1003,8 @@ def whoami():
     return jsonify({
         'pid': pid,
         'model_loaded': model is not None,
-        'model_path': MODEL_PATH if model is not None else None
+        'model_version': model_version,
+        'model_path': ACTIVE_MODEL_PATH if model is not None else None
     })
 
 
@@ -577,62 +1017,359 @@ def predict_json():
     if not file:
         return jsonify({'error': 'No file uploaded.'}), 400
 
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(filepath)
+    # Leer la subida una sola vez a memoria (reducida si es muy grande); el guardado en disco va en segundo plano
+    data = read_upload('predict_json', file)
+    body, status = predict_upload('predict_json', file.filename, data)
+    return jsonify(body), status
+
+
+def predict_upload(route, filename, data):
+    """Núcleo de /predict.json, compartido con la API asyncio (asgi_api.py).
+    Bloqueante (decodificación + inferencia). Devuelve (cuerpo JSON, código HTTP).
+    """
+    with stage_timer(route, 'persist'):
+        persist_upload(filename, data, thumbnail=False)
+    with stage_timer(route, 'lazy_load'):
+        lazy_load_model()
 
     # Si el modelo está disponible, usarlo; si no, devolver fallback heurístico rápido
-    if model is None or image is None or np is None:
-        # Heurística rápida (misma que la usada en la UI fallback)
-        try:
-            from PIL import Image as PILImage
-            import colorsys
-            im = PILImage.open(filepath).convert('RGB')
-            im = im.resize((64,64))
-            pixels = list(im.getdata())
-            r_mean = sum([p[0] for p in pixels]) / len(pixels)
-            g_mean = sum([p[1] for p in pixels]) / len(pixels)
-            b_mean = sum([p[2] for p in pixels]) / len(pixels)
-            rn, gn, bn = r_mean/255.0, g_mean/255.0, b_mean/255.0
-            h, s, v = colorsys.rgb_to_hsv(rn, gn, bn)
-
-            if (0.2126 * r_mean + 0.7152 * g_mean + 0.0722 * b_mean) < 60:
-                label = 'trash'; conf = 45.0
-            elif s < 0.15 and (r_mean+g_mean+b_mean)/3 > 200:
-                label = 'paper'; conf = 65.0
-            elif g_mean >= r_mean and g_mean >= b_mean and g_mean > 110:
-                label = 'glass'; conf = 60.0
-            elif r_mean > g_mean and r_mean > b_mean and r_mean > 130:
-                label = 'metal'; conf = 55.0
-            elif (0.2126 * r_mean + 0.7152 * g_mean + 0.0722 * b_mean) > 120 and s > 0.25:
-                label = 'plastic'; conf = 58.0
-            else:
-                label = 'cardboard'; conf = 50.0
+    if not model_ready():
+        # Heurística rápida (mismo motor que la UI fallback, ver fallback.py)
+        def fallback_predict():
+            with stage_timer(route, 'fallback'):
+                return heuristic_predict(io.BytesIO(data))
 
-            logging.info('Predict.json fallback for %s -> %s (%.2f%%) [PID=%d]', filepath, label, conf, os.getpid())
+        try:
+            label, conf = cached_prediction(data, fallback_predict)
+            count_prediction(route, 'fallback', label)
+            logging.info('Predict.json fallback for %s -> %s (%.2f%%) [PID=%d]', filename, label, conf, os.getpid())
             info = INFO_RESIDUOS.get(label, None)
-            return jsonify({'source': 'fallback', 'label': label, 'confidence': conf, 'info': info})
+            return {'source': 'fallback', 'label': label, 'confidence': conf, 'info': info}, 200
         except Exception as e:
-            logging.error('Error in predict.json fallback for %s: %s', filepath, e)
-            return jsonify({'error': 'Fallback prediction failed.'}), 500
+            logging.error('Error in predict.json fallback for %s: %s', filename, e)
+            PREDICTION_ERRORS_TOTAL.inc(route=route, source='fallback')
+            return {'error': 'Fallback prediction failed.'}, 500
 
     # Modelo disponible: hacer la predicción real
+    def model_predict():
+        with stage_timer(route, 'preprocess'):
+            img_array = load_image_array(io.BytesIO(data))
+        with stage_timer(route, 'inference'):
+            probs = predict_probabilities(img_array)
+        class_index = int(np.argmax(probs))
+        return CLASS_NAMES[class_index], float(probs[class_index]) * 100.0
+
     try:
-        img = image.load_img(filepath, target_size=(128,128))
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)/255.0
-        predictions = model.predict(img_array)
-        class_index = int(np.argmax(predictions))
-        label = CLASS_NAMES[class_index]
-        confidence = float(predictions[0][class_index]) * 100.0
-        logging.info('Predict.json real for %s -> %s (%.2f%%) [PID=%d]', filepath, label, confidence, os.getpid())
+        label, confidence = cached_prediction(data, model_predict)
+        count_prediction(route, 'model', label)
+        logging.info('Predict.json real for %s -> %s (%.2f%%) [PID=%d]', filename, label, confidence, os.getpid())
         info = INFO_RESIDUOS.get(label, None)
-        return jsonify({'source': 'model', 'label': label, 'confidence': confidence, 'info': info})
+        return {'source': 'model', 'label': label, 'confidence': confidence, 'info': info}, 200
+    except Exception as e:
+        logging.error('Error processing image in predict.json for %s: %s', filename, e)
+        PREDICTION_ERRORS_TOTAL.inc(route=route, source='model')
+        return {'error': 'Error processing image.'}, 500
+
+
+# =========================
+# CLASIFICACIÓN MASIVA (NDJSON)
+# =========================
+# Límites para proteger al worker de subidas enormes / zip bombs: tamaño por imagen
+# (declarado en el zip o de la parte multipart) y presupuesto total por petición.
+# Las imágenes se leen de una en una al procesar cada batch, no todas al principio.
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', '500'))
+BULK_MAX_FILE_BYTES = int(os.environ.get('BULK_MAX_FILE_BYTES', str(20 * 1024 * 1024)))
+BULK_MAX_TOTAL_BYTES = int(os.environ.get('BULK_MAX_TOTAL_BYTES', str(200 * 1024 * 1024)))
+BULK_DECODE_WORKERS = int(os.environ.get('BULK_DECODE_WORKERS', '4'))
+_decode_pool = ThreadPoolExecutor(max_workers=BULK_DECODE_WORKERS, thread_name_prefix='bulk-decode')
+_BULK_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif')
+
+
+def _stream_size(stream):
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def _read_bulk_uploads():
+    """Lista de (filename, read, error) a partir de varios campos `file`/`files` y/o archivos .zip.
+    `read()` devuelve los bytes de la imagen y se llama al procesar su batch. Devuelve también
+    los ZipFile abiertos, que hay que cerrar al terminar la respuesta.
+    """
+    items, archives, budget = [], [], BULK_MAX_TOTAL_BYTES
+
+    def add(name, size, read):
+        nonlocal budget
+        if size > BULK_MAX_FILE_BYTES:
+            items.append((name, None, 'File too large.'))
+        elif size > budget:
+            items.append((name, None, 'Upload size limit exceeded.'))
+        else:
+            budget -= size
+            items.append((name, read, None))
+
+    for storage in request.files.getlist('file') + request.files.getlist('files'):
+        if len(items) >= BULK_MAX_FILES:
+            break
+        name = storage.filename or 'upload'
+        if not name.lower().endswith('.zip'):
+            add(name, _stream_size(storage.stream), storage.read)
+            continue
+        try:
+            zf = zipfile.ZipFile(storage.stream)
+        except zipfile.BadZipFile:
+            items.append((name, None, 'Invalid zip archive.'))
+            continue
+        archives.append(zf)
+        for entry in zf.infolist():
+            if entry.is_dir() or not entry.filename.lower().endswith(_BULK_IMAGE_EXTENSIONS):
+                continue
+            if len(items) >= BULK_MAX_FILES:
+                break
+            # ZipExtFile no entrega más de file_size bytes: el tamaño declarado acota la lectura
+            add(entry.filename, entry.file_size, lambda zf=zf, entry=entry: zf.read(entry))
+    return items, archives
+
+
+def _load_bulk_chunk(chunk):
+    """Lee y reduce (UPLOAD_MAX_SIDE) las imágenes de un batch: (filename, data, error)."""
+    loaded = []
+    for name, read, error in chunk:
+        if error is None:
+            try:
+                with stage_timer('predict_batch', 'read'):
+                    data = read()
+                loaded.append((name, shrink_upload('predict_batch', name, data), None))
+                continue
+            except Exception as e:
+                logging.warning('Bulk predict: no se pudo leer %s: %s', name, e)
+                error = 'Error processing image.'
+        loaded.append((name, None, error))
+    return loaded
+
+
+def _safe_decode(fn, data):
+    """Ejecuta fn(BytesIO(data)) devolviendo (resultado, None) o (None, error)."""
+    try:
+        return fn(io.BytesIO(data)), None
     except Exception as e:
-        logging.error('Error processing image in predict.json for %s: %s', filepath, e)
-        return jsonify({'error': 'Error processing image.'}), 500
+        return None, e
+
+
+def _classify_chunk(offset, chunk):
+    """Clasifica un grupo de como máximo BATCH_MAX_SIZE imágenes. Devuelve las líneas NDJSON (dicts)."""
+    use_model = model_ready()
+    source = 'model' if use_model else 'fallback'
+    model_id = current_model_id()
+    lines = [{'index': offset + i, 'filename': name} for i, (name, _, _) in enumerate(chunk)]
+
+    # Consultar la caché antes de decodificar; solo los fallos se decodifican en paralelo
+    pending = []
+    for i, (name, data, error) in enumerate(chunk):
+        if error is not None:
+            lines[i]['error'] = error
+            continue
+        key = make_cache_key(data, model_id)
+        hit = prediction_cache.get(key)
+        if hit is not None:
+            lines[i].update(source=source, label=hit[0], confidence=hit[1])
+        else:
+            pending.append((i, data, key))
+
+    if pending:
+        decode_fn = load_image_array if use_model else channel_means
+        with stage_timer('predict_batch', 'preprocess'):
+            decoded = list(_decode_pool.map(lambda item: _safe_decode(decode_fn, item[1]), pending))
+        valid = []
+        for (i, _, key), (value, error) in zip(pending, decoded):
+            if error is not None:
+                logging.warning('Bulk predict: no se pudo decodificar %s: %s', chunk[i][0], error)
+                lines[i]['error'] = 'Error processing image.'
+            else:
+                valid.append((i, key, value))
+
+        if valid:
+            try:
+                if use_model:
+                    batch = np.concatenate([value for _, _, value in valid], axis=0)
+                    with stage_timer('predict_batch', 'inference'), model_registry.acquire() as mv:
+                        probs = mv.batcher.submit(batch)
+                    results = []
+                    for row in probs:
+                        class_index = int(np.argmax(row))
+                        results.append((CLASS_NAMES[class_index], float(row[class_index]) * 100.0))
+                else:
+                    with stage_timer('predict_batch', 'fallback'):
+                        results = classify_means([value for _, _, value in valid])
+                for (i, key, _), result in zip(valid, results):
+                    prediction_cache.put(key, result)
+                    lines[i].update(source=source, label=result[0], confidence=result[1])
+            except Exception as e:
+                logging.error('Bulk predict: error en batch de inferencia: %s', e)
+                PREDICTION_ERRORS_TOTAL.inc(amount=len(valid), route='predict_batch', source=source)
+                for i, _, _ in valid:
+                    lines[i]['error'] = 'Error processing image.'
+
+    for line in lines:
+        if 'label' in line:
+            line['info'] = INFO_RESIDUOS.get(line['label'], None)
+            count_prediction('predict_batch', source, line['label'])
+    return lines
+
+
+@app.route('/predict_batch.ndjson', methods=['POST'])
+def predict_batch_ndjson():
+    """Clasificación masiva: varias imágenes (`files`/`file`) o archivos .zip en una sola petición.
+    Devuelve NDJSON, una línea por imagen, emitida en cuanto termina cada batch del modelo:
+    { index, filename, source, label, confidence, info } o { index, filename, error }.
+    """
+    items, archives = _read_bulk_uploads()
+    if not items:
+        for zf in archives:
+            zf.close()
+        return jsonify({'error': 'No files uploaded.'}), 400
+    lazy_load_model()
+    logging.info('Predict batch: %d imágenes [PID=%d]', len(items), os.getpid())
+
+    chunk_size = max(1, BATCH_MAX_SIZE)
+
+    def generate():
+        try:
+            for offset in range(0, len(items), chunk_size):
+                chunk = _load_bulk_chunk(items[offset:offset + chunk_size])
+                for line in _classify_chunk(offset, chunk):
+                    yield json.dumps(line, ensure_ascii=False) + '\n'
+        finally:
+            for zf in archives:
+                zf.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 # Ruta para recolectar ejemplos etiquetados y guardarlos en dataset/<clase>
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset')
+# Mantenimiento del dataset en segundo plano (shards, índice de hashes): un hilo, en orden
+_dataset_jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dataset-jobs')
+
+# Shards memory-mapped del dataset (dataset_shards.py): si ya existen, cada imagen
+# recolectada se añade en segundo plano (solo se decodifica lo nuevo).
+DATASET_SHARDS_DIR = os.environ.get('DATASET_SHARDS_DIR', os.path.join(os.path.dirname(__file__), 'dataset_shards'))
+
+
+def _update_shards(dataset_dir):
+    try:
+        from dataset_shards import update_shards
+        update_shards(dataset_dir, DATASET_SHARDS_DIR, workers=1)
+    except Exception as e:
+        logging.warning('No se pudieron actualizar los shards del dataset: %s', e)
+
+
+def schedule_shards_update(dataset_dir):
+    """Encola la actualización incremental de los shards (no bloquea la petición)."""
+    if os.path.exists(os.path.join(DATASET_SHARDS_DIR, 'index.json')):
+        _dataset_jobs.submit(_update_shards, dataset_dir)
+
+
+# Índice de hashes (sha256 + dHash) de dataset/ (image_index.py): duplicados exactos se
+# rechazan; casi duplicados se marcan ('flag'), se rechazan ('reject') o se ignoran ('allow').
+DATASET_INDEX_PATH = os.environ.get('DATASET_INDEX_PATH', os.path.join(os.path.dirname(__file__), 'dataset_index.db'))
+COLLECT_NEAR_DUPLICATES = os.environ.get('COLLECT_NEAR_DUPLICATES', 'flag').lower()
+COLLECT_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Segundos que /collect espera a la primera actualización del índice en este proceso
+COLLECT_INDEX_WAIT = float(os.environ.get('COLLECT_INDEX_WAIT', '5'))
+_dataset_index = None
+_dataset_index_update = None
+_dataset_index_lock = threading.Lock()
+
+
+def _build_dataset_index(index):
+    try:
+        stats = index.update(DATASET_DIR)
+        logging.info('Índice de hashes de dataset/ actualizado: %s [PID=%d]', stats, os.getpid())
+    except Exception as e:
+        logging.warning('No se pudo construir el índice de hashes de dataset/: %s', e)
+
+
+def get_dataset_index():
+    """Índice compartido (import diferido: NumPy no se carga al arrancar la app).
+    En el primer uso de cada proceso se actualiza en segundo plano con dataset/, para
+    recoger también las imágenes que llegaron por otra vía (copiadas, restauradas...);
+    update() es incremental y solo vuelve a leer los ficheros nuevos o modificados.
+    """
+    global _dataset_index, _dataset_index_update
+    with _dataset_index_lock:
+        if _dataset_index is None:
+            from image_index import ImageIndex
+            index = ImageIndex(DATASET_INDEX_PATH)
+            index.init_schema()
+            _dataset_index_update = _dataset_jobs.submit(_build_dataset_index, index)
+            _dataset_index = index
+        return _dataset_index
+
+
+def dataset_index_ready(timeout=0.0):
+    """True si ya terminó la actualización inicial del índice (espera como máximo `timeout` s)."""
+    update = _dataset_index_update
+    if update is None:
+        return False
+    try:
+        update.result(timeout)
+        return True
+    except FutureTimeoutError:
+        return False
+
+
+# =========================
+# FINE-TUNING INCREMENTAL (cola alimentada por /collect, ver finetune.py)
+# =========================
+FINETUNE_DB_PATH = os.environ.get('FINETUNE_DB_PATH', os.path.join(os.path.dirname(__file__), 'finetune.db'))
+# Cada cuánto se comprueba la cola (0 = solo a mano desde /finetune) y mínimo de muestras nuevas
+FINETUNE_INTERVAL = float(os.environ.get('FINETUNE_INTERVAL', '900'))
+FINETUNE_MIN_SAMPLES = int(os.environ.get('FINETUNE_MIN_SAMPLES', '20'))
+finetune_queue = FinetuneQueue(FINETUNE_DB_PATH)
+finetune_queue.init_schema()
+finetune_scheduler = FinetuneScheduler(
+    finetune_queue,
+    interval=FINETUNE_INTERVAL,
+    min_samples=FINETUNE_MIN_SAMPLES,
+    job_args=['--model', os.path.abspath(MODEL_PATH),
+              '--data_dir', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset')]
+             + (['--tflite'] if INFERENCE_BACKEND == 'tflite' else []),
+    log_dir=os.environ.get('FINETUNE_LOG_DIR', os.path.join(os.path.dirname(__file__), 'finetune_logs')),
+)
+
+
+@app.before_request
+def _ensure_finetune_scheduler():
+    finetune_scheduler.start()
+
+
+@app.route('/finetune', methods=['GET'])
+@admin_required
+def finetune_page():
+    """Estado de la cola de fine-tuning: muestras pendientes y trabajos (duración, delta de accuracy)."""
+    return render_template('finetune.html', status=finetune_queue.status(), min_samples=FINETUNE_MIN_SAMPLES,
+                           interval=FINETUNE_INTERVAL, user=session.get('user'))
+
+
+@app.route('/finetune/run', methods=['POST'])
+@admin_required
+def finetune_run():
+    job_id = finetune_scheduler.trigger('admin')
+    if job_id is None:
+        flash('No hay muestras pendientes o ya hay un trabajo en curso.', 'error')
+    else:
+        flash(f'Trabajo de fine-tuning {job_id} lanzado en segundo plano.', 'success')
+    return redirect(url_for('finetune_page'))
+
+
+@app.route('/finetune_status', methods=['GET'])
+@admin_required
+def finetune_status():
+    return jsonify(finetune_queue.status())
+
+
 @app.route('/collect', methods=['GET', 'POST'])
 @admin_required
 def collect():
@@ -645,24 +1382,59 @@ def collect():
         if not clase or not file:
             flash('Selecciona una clase y un archivo.', 'error')
             return redirect(url_for('collect'))
+        if clase not in CLASS_NAMES:
+            flash(f'Clase desconocida: {clase}', 'error')
+            return redirect(url_for('collect'))
+        ext = os.path.splitext(file.filename or '')[1].lower()
+        if ext not in COLLECT_EXTENSIONS:
+            flash(f'Formato no admitido ({", ".join(COLLECT_EXTENSIONS)}).', 'error')
+            return redirect(url_for('collect'))
 
-        # Asegurar que la carpeta de la clase existe
-        dataset_dir = os.path.join(os.path.dirname(__file__), 'dataset')
-        target_dir = os.path.join(dataset_dir, clase)
-        os.makedirs(target_dir, exist_ok=True)
-
-        # Guardar con nombre único
-        filename = file.filename
-        base, ext = os.path.splitext(filename)
-        i = 1
-        dest_name = filename
-        while os.path.exists(os.path.join(target_dir, dest_name)):
-            dest_name = f"{base}_{i}{ext}"
-            i += 1
+        from image_index import content_addressed_name, content_hash, dhash
+        data = file.read()
+        try:
+            phash = dhash(data)
+        except Exception:
+            flash('El archivo no es una imagen válida.', 'error')
+            return redirect(url_for('collect'))
+        sha256 = content_hash(data)
+
+        index = get_dataset_index()
+        if not dataset_index_ready(COLLECT_INDEX_WAIT):
+            flash('El índice de dataset/ aún se está actualizando: la comprobación de duplicados '
+                  'puede no ver todas las imágenes.', 'warning')
+        duplicates = index.find_duplicates(sha256, phash)
+        if duplicates['exact']:
+            flash(f'Imagen duplicada: ya existe como dataset/{duplicates["exact"]}', 'error')
+            return redirect(url_for('collect'))
+        near = duplicates['near'] if COLLECT_NEAR_DUPLICATES != 'allow' else []
+        if near and COLLECT_NEAR_DUPLICATES == 'reject':
+            path, label, distance = near[0]
+            flash(f'Imagen casi idéntica a dataset/{path} ({label}, distancia {distance}); no se guarda.', 'error')
+            return redirect(url_for('collect'))
 
+        # Nombre direccionado por contenido: único sin sondear el directorio
+        dest_name = content_addressed_name(clase, sha256, ext)
+        target_dir = os.path.join(DATASET_DIR, clase)
+        os.makedirs(target_dir, exist_ok=True)
         dest_path = os.path.join(target_dir, dest_name)
-        file.save(dest_path)
-        flash(f'Imagen guardada en dataset/{clase}/{dest_name}', 'success')
+        tmp_path = os.path.join(target_dir, f'.{dest_name}.tmp')
+        with open(tmp_path, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, dest_path)
+        rel_path = f'{clase}/{dest_name}'
+        st = os.stat(dest_path)
+        index.add(rel_path, clase, sha256, phash, st.st_size, st.st_mtime_ns)
+
+        schedule_shards_update(DATASET_DIR)
+        try:
+            finetune_queue.record_sample(rel_path, clase)
+        except sqlite3.Error as e:
+            logging.warning('No se pudo registrar la muestra para fine-tuning: %s', e)
+        flash(f'Imagen guardada en dataset/{rel_path}', 'success')
+        if near:
+            path, label, distance = near[0]
+            flash(f'Aviso: es casi idéntica a dataset/{path} ({label}, distancia {distance}).', 'warning')
         return redirect(url_for('collect'))
 
     # GET: mostrar formulario
@@ -690,11 +1462,11 @@ def pagina3():
 # =========================
 # EJECUTAR SERVIDOR
 # =========================
-# NO cargar el modelo automáticamente en startup para evitar worker timeout.
-# El modelo se cargará bajo demanda (lazy loading) en la primera predicción
-# o manualmente via /reload_model (admin only).
-print("[INFO] Modelo NO cargado al inicio (lazy loading habilitado)")
-logging.info("Modelo NO cargado al inicio - se cargará bajo demanda o via /reload_model")
+# NO cargar el modelo en el import para evitar worker timeout: el warm-up en segundo
+# plano arranca con el worker (gunicorn.conf.py) o con la primera petición; si falla,
+# se reintenta bajo demanda (lazy loading) o manualmente via /reload_model (admin only).
+print("[INFO] Modelo NO cargado en el import (warm-up en segundo plano)")
+logging.info("Modelo NO cargado en el import - warm-up en segundo plano / lazy loading / /reload_model")
 
 if __name__ == '__main__':
     # Allow configuring host/port via environment variables. Many PaaS
@@ -706,15 +1478,8 @@ if __name__ == '__main__':
 
     # Start model loading in background so startup isn't blocked by TensorFlow
     # initialization (helps prevent platform timeouts / 502 on first deploy).
-    def _bg_load():
-        logging.info('Background model loader thread started (PID=%s)', os.getpid())
-        ok, msg = reload_model_from_disk()
-        if ok:
-            logging.info('Background loader: %s', msg)
-        else:
-            logging.warning('Background loader failed: %s', msg)
-
-    t = threading.Thread(target=_bg_load, daemon=True)
-    t.start()
+    # Con el reloader de debug solo el proceso hijo (WERKZEUG_RUN_MAIN) carga el modelo.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_warmup()
 
     app.run(debug=debug, host=host, port=port)
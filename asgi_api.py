@@ -0,0 +1,216 @@
+"""
+asgi_api.py
+Variante asyncio (ASGI) de la API de predicción, para servir con uvicorn.
+
+Con gunicorn `--workers 1 --threads 2` cada petición ocupa un hilo desde que
+llega hasta que termina de subirse: dos clientes móviles lentos bloquean la
+inferencia de todos. Aquí la subida se lee en el bucle de eventos (un cliente
+lento solo cuesta una corrutina en espera) y se parsea de forma incremental con
+el MultipartDecoder sans-IO de werkzeug. Solo cuando el cuerpo está completo,
+la decodificación y la inferencia pasan a un ThreadPoolExecutor acotado
+(ASYNC_PREDICT_WORKERS). Con más de ASYNC_MAX_PENDING predicciones en espera se
+responde 503 en lugar de encolar sin límite.
+
+El modelo, CLASS_NAMES, INFO_RESIDUOS, la caché de predicciones, las métricas y
+el almacén de subidas son los de app.py (se importa el módulo y se usa
+`predict_upload()`, el mismo núcleo que /predict.json en Flask).
+
+Rutas: POST /predict.json (misma petición y respuesta que en Flask), GET /healthz,
+GET /readyz, GET /metrics. Las páginas HTML siguen en la app Flask.
+
+Uso:
+    uvicorn asgi_api:app --host 0.0.0.0 --port 8001 --workers 1
+    python bench_async_api.py --slow_clients 32       # comparación con gunicorn con hilos
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+import app as flask_app
+
+ROUTE = 'predict_async'
+ASYNC_PREDICT_WORKERS = int(os.environ.get('ASYNC_PREDICT_WORKERS', str(min(4, os.cpu_count() or 1))))
+ASYNC_MAX_PENDING = int(os.environ.get('ASYNC_MAX_PENDING', '64'))
+ASYNC_MAX_UPLOAD_BYTES = int(float(os.environ.get('ASYNC_MAX_UPLOAD_MB', '20')) * 1024 * 1024)
+
+_executor = ThreadPoolExecutor(max_workers=ASYNC_PREDICT_WORKERS, thread_name_prefix='async-predict')
+_state = {'inflight': 0, 'rejected': 0}
+
+ASYNC_INFLIGHT = flask_app.metrics_registry.gauge(
+    'garbage_async_predictions_inflight', 'Predicciones de la API asyncio en el executor o esperándolo')
+ASYNC_REJECTED = flask_app.metrics_registry.gauge(
+    'garbage_async_predictions_rejected_total', 'Predicciones rechazadas (503) por ASYNC_MAX_PENDING', kind='counter')
+ASYNC_INFLIGHT.set_function(lambda: _state['inflight'])
+ASYNC_REJECTED.set_function(lambda: _state['rejected'])
+
+
+class UploadError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# =========================
+# LECTURA DE LA SUBIDA
+# =========================
+async def read_file_field(scope, receive, field='file', max_bytes=ASYNC_MAX_UPLOAD_BYTES):
+    """Lee el cuerpo multipart según llega y devuelve (filename, bytes) del primer fichero `field`."""
+    headers = dict(scope['headers'])
+    mimetype, options = parse_options_header(headers.get(b'content-type', b'').decode('latin-1'))
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        raise UploadError(400, 'Expected multipart/form-data.')
+    if int(headers.get(b'content-length', b'0') or 0) > max_bytes:
+        raise UploadError(413, 'Upload too large.')
+
+    decoder = MultipartDecoder(options['boundary'].encode('latin-1'))
+    filename, chunks, size = None, [], 0
+    collecting = finished = False
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError as e:
+            raise UploadError(400, f'Malformed multipart body: {e}')
+        if isinstance(event, NeedData):
+            if finished:
+                break
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            decoder.receive_data(message.get('body', b''))
+            if not message.get('more_body', False):
+                decoder.receive_data(None)
+                finished = True
+        elif isinstance(event, File):
+            collecting = event.name == field and filename is None
+            if collecting:
+                filename = event.filename or 'upload'
+        elif isinstance(event, Field):
+            collecting = False
+        elif isinstance(event, Data) and collecting:
+            size += len(event.data)
+            if size > max_bytes:
+                raise UploadError(413, 'Upload too large.')
+            chunks.append(event.data)
+        elif isinstance(event, Epilogue):
+            break
+    if filename is None:
+        raise UploadError(400, 'No file uploaded.')
+    return filename, b''.join(chunks)
+
+
+# =========================
+# RUTAS
+# =========================
+def _predict_blocking(filename, data):
+    data = flask_app.shrink_upload(ROUTE, filename, data)
+    return flask_app.predict_upload(ROUTE, filename, data)
+
+
+async def predict_json(scope, receive):
+    started = time.perf_counter()
+    try:
+        filename, data = await read_file_field(scope, receive)
+    except UploadError as e:
+        return e.status, {'error': str(e)}
+    flask_app.STAGE_SECONDS.observe(time.perf_counter() - started, route=ROUTE, stage='read')
+
+    if _state['inflight'] >= ASYNC_MAX_PENDING:
+        _state['rejected'] += 1
+        return 503, {'error': 'Server busy, retry later.'}
+    _state['inflight'] += 1
+    try:
+        body, status = await asyncio.get_running_loop().run_in_executor(_executor, _predict_blocking, filename, data)
+    finally:
+        _state['inflight'] -= 1
+    return status, body
+
+
+async def healthz(scope, receive):
+    return 200, {'status': 'ok', 'pid': os.getpid(), 'server': 'asgi', 'inflight': _state['inflight']}
+
+
+async def readyz(scope, receive):
+    ready = flask_app.model_ready()
+    return (200 if ready else 503), {'ready': ready, 'pid': os.getpid(), 'warmup': flask_app._warmup_state['status'],
+                                     'model_version': flask_app.model_version}
+
+
+async def metrics(scope, receive):
+    token = flask_app.METRICS_TOKEN
+    if token and dict(scope['headers']).get(b'authorization', b'').decode('latin-1') != f'Bearer {token}':
+        return 403, 'forbidden\n'
+    return 200, flask_app.metrics_registry.render()
+
+
+ROUTES = {
+    ('POST', '/predict.json'): ('predict_json', predict_json),
+    ('GET', '/healthz'): ('healthz', healthz),
+    ('GET', '/readyz'): ('readyz', readyz),
+    ('GET', '/metrics'): ('metrics_endpoint', metrics),
+}
+
+
+# =========================
+# APLICACIÓN ASGI
+# =========================
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Lo mismo que hacen los hooks before_request de la app Flask en cada worker
+            if flask_app.WARMUP_ON_BOOT:
+                flask_app.start_background_warmup()
+            flask_app.model_registry.start_watcher(flask_app.MODEL_WATCH_INTERVAL)
+            if flask_app.SAVE_UPLOADS:
+                flask_app.upload_store.start_sweeper(flask_app.UPLOAD_SWEEP_INTERVAL)
+            logging.info('API asyncio lista: %d hilos de predicción, máx. %d pendientes [PID=%d]',
+                         ASYNC_PREDICT_WORKERS, ASYNC_MAX_PENDING, os.getpid())
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    started = time.perf_counter()
+    endpoint, handler = ROUTES.get((scope['method'], scope['path']), (None, None))
+    if handler is None:
+        allowed = any(path == scope['path'] for _, path in ROUTES)
+        status, body = (405, {'error': 'Method not allowed.'}) if allowed else (404, {'error': 'Not found.'})
+    else:
+        try:
+            status, body = await handler(scope, receive)
+        except ClientDisconnected:
+            return
+        except Exception as e:
+            logging.exception('Error en la API asyncio (%s): %s', scope['path'], e)
+            status, body = 500, {'error': 'Internal error.'}
+
+    if isinstance(body, str):
+        payload, content_type = body.encode('utf-8'), flask_app.metrics_lib.CONTENT_TYPE.encode('latin-1')
+    else:
+        payload, content_type = json.dumps(body).encode('utf-8'), b'application/json'
+    headers = [(b'content-type', content_type), (b'content-length', str(len(payload)).encode())]
+    if status == 503 and endpoint == 'predict_json':
+        headers.append((b'retry-after', b'1'))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload})
+    flask_app.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=f'{endpoint or "unknown"}_async',
+                                      method=scope['method'], status=status)
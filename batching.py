@@ -0,0 +1,243 @@
+"""
+batching.py
+Planificador de micro-batching para la inferencia del modelo.
+
+Las peticiones encolan su tensor ya preprocesado (1x128x128x3) y un único hilo
+de inferencia agrupa hasta `max_batch_size` imágenes o espera como máximo
+`max_wait_ms` desde la primera, ejecuta UNA pasada del modelo y reparte cada
+fila de resultados a la petición que la esperaba.
+
+Uso:
+    batcher = MicroBatcher(lambda batch: model.predict(batch, verbose=0),
+                           max_batch_size=8, max_wait_ms=10)
+    probs = batcher.submit(img_array[0])   # (128,128,3) -> vector de probabilidades (1D)
+    rows = batcher.submit(img_array)       # (N,128,128,3) -> (N,num_classes)
+    batcher.stats()                        # -> dict con tamaños de batch y esperas
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class _PendingRequest:
+    """Petición encolada: tensor de entrada + evento para devolver el resultado."""
+
+    __slots__ = ('array', 'single', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, array, single):
+        self.array = array
+        self.single = single
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Agrupa peticiones concurrentes en batches para una sola llamada al modelo.
+
+    `predict_fn` recibe un array (N,128,128,3) y devuelve (N,num_classes).
+    Se invoca siempre desde el mismo hilo de inferencia.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10.0,
+                 stats_window=1000, name='inference-batcher'):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        # Petición que no cupo en el batch anterior (solo la usa el hilo de inferencia)
+        self._carry = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Estadísticas (protegidas por self._lock)
+        self._batches = 0
+        self._requests = 0
+        self._rows = 0
+        self._errors = 0
+        self._batch_sizes = collections.Counter()
+        self._waits = collections.deque(maxlen=stats_window)
+        self._run_times = collections.deque(maxlen=stats_window)
+
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+        logging.info('MicroBatcher iniciado (max_batch_size=%d, max_wait_ms=%.1f)',
+                     self.max_batch_size, self.max_wait * 1000.0)
+
+    def submit(self, array, timeout=None):
+        """Encola una imagen (H,W,C) o un batch (N,H,W,C) y bloquea hasta tener la predicción.
+        Devuelve el vector de probabilidades (imagen) o una matriz (N,num_classes) (batch).
+        """
+        if self._closed:
+            raise RuntimeError('MicroBatcher cerrado')
+        array = np.asarray(array, dtype=np.float32)
+        single = array.ndim == 3
+        if single:
+            array = array[np.newaxis, ...]
+        req = _PendingRequest(array, single)
+        self._queue.put(req)
+        if not req.done.wait(timeout):
+            raise TimeoutError('Tiempo de espera agotado esperando la inferencia')
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def close(self):
+        """Detiene el hilo de inferencia (las peticiones pendientes se procesan antes)."""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _collect(self):
+        """Bloquea hasta la primera petición y agrupa las que lleguen dentro del plazo
+        sin pasar de max_batch_size filas (una petición mayor que el límite va sola).
+        """
+        first, self._carry = self._carry, None
+        if first is None:
+            first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = first.array.shape[0]
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Reencolar la señal de cierre para salir después de este batch
+                self._queue.put(None)
+                break
+            if size + item.array.shape[0] > self.max_batch_size:
+                # No cabe: abre el siguiente batch
+                self._carry = item
+                break
+            batch.append(item)
+            size += item.array.shape[0]
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            inputs = np.concatenate([req.array for req in batch], axis=0)
+            outputs = np.asarray(self.predict_fn(inputs))
+            error = None
+        except Exception as e:
+            logging.error('Error en batch de inferencia (%d peticiones): %s', len(batch), e)
+            outputs = None
+            error = e
+        finished = time.perf_counter()
+
+        offset = 0
+        for req in batch:
+            n = req.array.shape[0]
+            if error is None:
+                req.result = outputs[offset] if req.single else outputs[offset:offset + n]
+            else:
+                req.error = error
+            offset += n
+
+        with self._lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._rows += offset
+            self._batch_sizes[offset] += 1
+            self._run_times.append(finished - started)
+            for req in batch:
+                self._waits.append(started - req.enqueued_at)
+            if error is not None:
+                self._errors += 1
+
+        for req in batch:
+            req.done.set()
+
+    def stats(self):
+        """Resumen de tamaños de batch, espera en cola y tiempo de inferencia (ms)."""
+        with self._lock:
+            waits = sorted(self._waits)
+            run_times = sorted(self._run_times)
+            batches = self._batches
+            requests = self._requests
+            rows = self._rows
+            sizes = dict(sorted(self._batch_sizes.items()))
+            errors = self._errors
+
+        def _pct(values, p):
+            if not values:
+                return 0.0
+            idx = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+            return round(values[idx] * 1000.0, 3)
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': batches,
+            'requests': requests,
+            'errors': errors,
+            'queue_depth': self._queue.qsize(),
+            'rows': rows,
+            'avg_batch_size': round(rows / batches, 3) if batches else 0.0,
+            'batch_size_histogram': sizes,
+            'queue_wait_ms': {'p50': _pct(waits, 50), 'p95': _pct(waits, 95),
+                              'p99': _pct(waits, 99), 'max': _pct(waits, 100)},
+            'inference_ms': {'p50': _pct(run_times, 50), 'p95': _pct(run_times, 95),
+                             'max': _pct(run_times, 100)},
+        }
+
+
+class PassThroughBatcher:
+    """Misma interfaz que MicroBatcher sin agrupar ni hilo propio: cada submit llama
+    directamente a `predict_fn`. Para backends que ya agrupan al otro lado (servidor de
+    modelo), donde un segundo batcher solo añadiría su espera máxima a cada petición.
+    """
+
+    def __init__(self, predict_fn):
+        self.predict_fn = predict_fn
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._rows = 0
+        self._errors = 0
+
+    def submit(self, array, timeout=None):
+        array = np.asarray(array, dtype=np.float32)
+        single = array.ndim == 3
+        if single:
+            array = array[np.newaxis, ...]
+        try:
+            outputs = np.asarray(self.predict_fn(array))
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        with self._lock:
+            self._calls += 1
+            self._rows += array.shape[0]
+        return outputs[0] if single else outputs
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            calls, rows, errors = self._calls, self._rows, self._errors
+        return {
+            'passthrough': True,
+            'requests': calls,
+            'rows': rows,
+            'errors': errors,
+            'queue_depth': 0,
+        }
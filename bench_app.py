@@ -0,0 +1,384 @@
+"""
+bench_app.py
+Benchmark reproducible de carga y latencia de la app Flask.
+
+Ejecuta la app real con dos drivers:
+  - client:   Flask test client en proceso (sin red; mide el coste de la app)
+  - gunicorn: gunicorn local con N workers/hilos, peticiones HTTP reales
+
+contra los endpoints /predict.json, /predict, /login (POST, hash de contraseña)
+y páginas estáticas (/pagina1-3) y ficheros de /static, con imágenes de
+dataset/. Cada combinación driver x modo se ejecuta en un proceso nuevo:
+  - model:    INFERENCE_BACKEND=--backend, espera a que el modelo esté listo
+  - fallback: INFERENCE_BACKEND=none (solo heurística)
+
+Informa throughput, latencia p50/p95/p99/max y RSS pico, y escribe JSON con
+el commit actual para comparar ejecuciones. La base de usuarios, el log y las
+subidas van a un directorio temporal (no se toca users.db ni app.log).
+
+Uso:
+    python bench_app.py --clients 1 8 --requests 200 --output bench_results.json
+    python bench_app.py --drivers gunicorn --modes fallback --endpoints predict_json login
+    python bench_app.py --backend tflite --workers 2 --threads 4
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from bench_model_server import multipart_body, wait_until
+from inference import list_images
+
+ENDPOINTS = ('predict_json', 'predict', 'login', 'pages', 'static')
+BENCH_USER, BENCH_PASSWORD = 'bench_user', 'bench_password'
+STATIC_FILES = ('/static/fondo.jpg', '/static/reciclaje.png.jpg', '/static/verde.png')
+PAGES = ('/pagina1', '/pagina2', '/pagina3')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return round(sorted_values[idx] * 1000.0, 2)
+
+
+def peak_rss_mb():
+    # ru_maxrss está en KB en Linux (bytes en macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 / (1024.0 if sys.platform == 'darwin' else 1.0)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# =========================
+# SESIONES (una por hilo cliente)
+# =========================
+class ClientSession:
+    """Sesión sobre el Flask test client (cookies propias)."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, form=None, file=None):
+        data = dict(form or {})
+        if file is not None:
+            import io
+            data['file'] = (io.BytesIO(file[1]), file[0])
+        resp = self.client.open(path, method=method, data=data or None)
+        return resp.status_code, resp.get_data()
+
+
+class HttpSession:
+    """Sesión HTTP con cookies contra un servidor local."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, form=None, file=None):
+        headers, body = {}, None
+        if file is not None:
+            body, headers['Content-Type'] = multipart_body(*file)
+        elif form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=120) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def login(session):
+    status, _ = session.request('POST', '/login', form={'username': BENCH_USER, 'password': BENCH_PASSWORD})
+    return status in (200, 302)
+
+
+def build_request(endpoint, i, payloads):
+    """(method, path, form, file) de la petición i-ésima de un endpoint."""
+    if endpoint == 'predict_json':
+        return 'POST', '/predict.json', None, payloads[i % len(payloads)]
+    if endpoint == 'predict':
+        return 'POST', '/predict', None, payloads[i % len(payloads)]
+    if endpoint == 'login':
+        return 'POST', '/login', {'username': BENCH_USER, 'password': BENCH_PASSWORD}, None
+    if endpoint == 'pages':
+        return 'GET', PAGES[i % len(PAGES)], None, None
+    return 'GET', STATIC_FILES[i % len(STATIC_FILES)], None, None
+
+
+def run_endpoint(make_session, endpoint, payloads, clients, total):
+    """Lanza `total` peticiones con `clients` hilos (cada uno con su sesión logueada)."""
+    latencies, statuses, sources = [], {}, {}
+    lock = threading.Lock()
+    counter = iter(range(total))
+    sessions = []
+    for _ in range(clients):
+        session = make_session()
+        login(session)
+        sessions.append(session)
+
+    def worker(session):
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            method, path, form, file = build_request(endpoint, i, payloads)
+            t0 = time.perf_counter()
+            try:
+                status, body = session.request(method, path, form=form, file=file)
+            except Exception:
+                status, body = 'error', b''
+            elapsed = time.perf_counter() - t0
+            source = None
+            if endpoint == 'predict_json' and status == 200:
+                source = json.loads(body).get('source', '?')
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status in (200, 302):
+                    latencies.append(elapsed)
+                if source:
+                    sources[source] = sources.get(source, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(s,)) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'endpoint': endpoint,
+        'clients': clients,
+        'requests': total,
+        'ok': len(latencies),
+        'errors': total - len(latencies),
+        'status_codes': statuses,
+        'sources': sources or None,
+        'rps': round(len(latencies) / wall, 2) if wall else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': percentile(latencies, 100),
+    }
+
+
+def run_matrix(make_session, args, payloads):
+    rows = []
+    setup = make_session()
+    setup.request('POST', '/register', form={'username': BENCH_USER, 'password': BENCH_PASSWORD,
+                                             'password2': BENCH_PASSWORD})
+    for endpoint in args.endpoints:
+        # Calentamiento corto por endpoint (rutas, plantillas, primera inferencia)
+        run_endpoint(make_session, endpoint, payloads, 1, min(5, args.requests))
+        for clients in args.clients:
+            row = run_endpoint(make_session, endpoint, payloads, clients, args.requests)
+            rows.append(row)
+            print(f'  {endpoint:<13} clients={clients:<3} {row["rps"]:>8} req/s  p50={row["p50_ms"]}ms '
+                  f'p95={row["p95_ms"]}ms p99={row["p99_ms"]}ms errors={row["errors"]}', flush=True)
+    return rows
+
+
+# =========================
+# DRIVERS
+# =========================
+def mode_env(mode, args, workdir):
+    env = dict(os.environ,
+               INFERENCE_BACKEND=args.backend if mode == 'model' else 'none',
+               USERS_DB_PATH=os.path.join(workdir, 'users.db'),
+               APP_LOG_PATH=os.path.join(workdir, 'app.log'),
+               SAVE_UPLOADS='1' if args.save_uploads else '0',
+               WARMUP_ON_BOOT='1')
+    if not args.cache:
+        env['PREDICTION_CACHE_ENTRIES'] = '0'
+    return env
+
+
+def run_client_child(args, payloads):
+    """Proceso hijo del driver client: importa la app con el entorno ya preparado."""
+    import app as flask_app_module
+
+    model_ready = True
+    if args.child_mode == 'model':
+        flask_app_module.start_background_warmup()
+        model_ready = wait_until(flask_app_module.model_ready, args.ready_timeout, interval=0.2)
+    result = {'model_ready': model_ready}
+    if args.child_mode == 'model' and not model_ready:
+        result['skipped'] = f'Modelo no disponible: {flask_app_module._warmup_state["message"]}'
+        result['results'] = []
+    else:
+        result['results'] = run_matrix(lambda: ClientSession(flask_app_module.app), args, payloads)
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    with open(args.child_output, 'w', encoding='utf-8') as fh:
+        json.dump(result, fh)
+
+
+def run_client(mode, args, workdir):
+    out = os.path.join(workdir, f'client_{mode}.json')
+    cmd = [sys.executable, os.path.abspath(__file__), '--child_mode', mode, '--child_output', out,
+           '--requests', str(args.requests), '--data_dir', args.data_dir, '--seed', str(args.seed),
+           '--ready_timeout', str(args.ready_timeout), '--clients', *map(str, args.clients),
+           '--endpoints', *args.endpoints]
+    subprocess.run(cmd, env=mode_env(mode, args, workdir), check=True)
+    with open(out, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def _process_tree_rss_mb(root_pid):
+    """RSS actual (MB) del proceso maestro de gunicorn y sus workers (Linux /proc)."""
+    total_kb = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as fh:
+                status = dict(line.split(':', 1) for line in fh if ':' in line)
+        except OSError:
+            continue
+        if int(entry) == root_pid or int(status.get('PPid', '0').strip()) == root_pid:
+            total_kb += int(status.get('VmRSS', '0 kB').split()[0])
+    return total_kb / 1024.0
+
+
+def run_gunicorn(mode, args, workdir, payloads):
+    url = f'http://127.0.0.1:{args.port}'
+    web = subprocess.Popen(['gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+                            '--workers', str(args.workers), '--threads', str(args.threads),
+                            '--timeout', '300', '--log-level', 'warning'], env=mode_env(mode, args, workdir))
+    peak = [0.0]
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.is_set():
+            peak[0] = max(peak[0], _process_tree_rss_mb(web.pid))
+            stop.wait(0.1)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+
+    def status_of(path):
+        try:
+            with urllib.request.urlopen(url + path, timeout=2) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        if not wait_until(lambda: status_of('/healthz') == 200, 60):
+            raise SystemExit('gunicorn no arrancó')
+        result = {'model_ready': True}
+        if mode == 'model':
+            # Con varios workers /readyz responde el que atienda; se espera a que todos lo estén
+            result['model_ready'] = wait_until(
+                lambda: all(status_of('/readyz') == 200 for _ in range(args.workers * 4)),
+                args.ready_timeout, interval=0.5)
+        if mode == 'model' and not result['model_ready']:
+            result['skipped'] = 'Modelo no disponible (/readyz no devolvió 200)'
+            result['results'] = []
+        else:
+            result['results'] = run_matrix(lambda: HttpSession(url), args, payloads)
+    finally:
+        web.terminate()
+        web.wait(timeout=30)
+        stop.set()
+        sampler.join()
+    result['peak_rss_mb'] = round(peak[0], 1)
+    return result
+
+
+def load_payloads(args):
+    items = list_images(args.data_dir)
+    random.Random(args.seed).shuffle(items)
+    payloads = []
+    for path, _ in items[:max(1, args.images)]:
+        with open(path, 'rb') as fh:
+            payloads.append((os.path.basename(path), fh.read()))
+    return payloads
+
+
+def main(args):
+    payloads = load_payloads(args)
+    if args.child_mode:
+        run_client_child(args, payloads)
+        return
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if not k.startswith('child_')},
+        },
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory(prefix='bench_app_') as workdir:
+        for driver in args.drivers:
+            for mode in args.modes:
+                print(f'== driver={driver} mode={mode}', flush=True)
+                if driver == 'client':
+                    run = run_client(mode, args, workdir)
+                else:
+                    run = run_gunicorn(mode, args, workdir, payloads)
+                run.update(driver=driver, mode=mode)
+                if driver == 'gunicorn':
+                    run.update(workers=args.workers, threads=args.threads)
+                if run.get('skipped'):
+                    print(f'  omitido: {run["skipped"]}')
+                print(f'  RSS pico: {run["peak_rss_mb"]} MB')
+                report['runs'].append(run)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+        print(f'Resultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de carga y latencia de la app (test client y gunicorn)')
+    parser.add_argument('--drivers', nargs='+', choices=['client', 'gunicorn'], default=['client', 'gunicorn'],
+                        help='Cómo se ejecuta la app')
+    parser.add_argument('--modes', nargs='+', choices=['model', 'fallback'], default=['model', 'fallback'],
+                        help='Con modelo cargado o solo fallback heurístico')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS),
+                        help='Endpoints a medir')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8], help='Niveles de concurrencia')
+    parser.add_argument('--requests', type=int, default=200, help='Peticiones por endpoint y concurrencia')
+    parser.add_argument('--backend', choices=['keras', 'tflite', 'remote'], default='keras',
+                        help='INFERENCE_BACKEND en modo model')
+    parser.add_argument('--workers', type=int, default=1, help='Workers de gunicorn')
+    parser.add_argument('--threads', type=int, default=2, help='Hilos por worker de gunicorn')
+    parser.add_argument('--port', type=int, default=5057, help='Puerto local para gunicorn')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--images', type=int, default=50, help='Imágenes distintas usadas como carga')
+    parser.add_argument('--seed', type=int, default=0, help='Semilla para elegir las imágenes')
+    parser.add_argument('--cache', action='store_true', help='Dejar activada la caché de predicciones')
+    parser.add_argument('--save_uploads', action='store_true', help='Guardar las subidas en static/uploads')
+    parser.add_argument('--ready_timeout', type=float, default=300.0, help='Espera máxima a que cargue el modelo')
+    parser.add_argument('--output', type=str, default=None, help='Guardar resultados en JSON')
+    parser.add_argument('--child_mode', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--child_output', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,197 @@
+"""
+bench_async_api.py
+Throughput de /predict.json con muchos clientes lentos: gunicorn con hilos
+(configuración del Procfile: --workers 1 --threads 2) frente a la API asyncio
+(asgi_api.py con uvicorn).
+
+Los clientes lentos suben una imagen repartiendo el cuerpo a lo largo de
+--slow_seconds (red móvil) y repiten durante toda la prueba. Mientras tanto,
+--fast_clients clientes normales lanzan peticiones seguidas durante --duration
+segundos. Se mide el throughput y la latencia que ven los clientes normales y
+cuántas subidas lentas se completan.
+
+Uso:
+    python bench_async_api.py --slow_clients 32 --fast_clients 4 --duration 20
+    python bench_async_api.py --mode model --backend tflite --output async_bench.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench_model_server import multipart_body, wait_until
+from inference import list_images
+
+SERVERS = ('threaded', 'async')
+
+
+def server_command(kind, args, port):
+    if kind == 'threaded':
+        return ['gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+                '--threads', str(args.threads), '--timeout', '120', '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'asgi_api:app', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(args.workers), '--log-level', 'warning']
+
+
+def slow_upload(port, name, data, seconds, chunks, timeout):
+    """Una subida lenta por socket: cabeceras y después el cuerpo en `chunks` trozos a lo largo de `seconds`."""
+    body, ctype = multipart_body(name, data)
+    head = (f'POST /predict.json HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nContent-Type: {ctype}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode()
+    step = max(1, len(body) // chunks)
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+        sock.sendall(head)
+        for start in range(0, len(body), step):
+            sock.sendall(body[start:start + step])
+            time.sleep(seconds / chunks)
+        response = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    return response.startswith(b'HTTP/1.1 200')
+
+
+def run_scenario(port, payloads, args):
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'slow_ok': 0, 'slow_errors': 0, 'fast_latencies': [], 'fast_errors': 0}
+
+    def slow_worker(i):
+        rng = random.Random(i)
+        while not stop.is_set():
+            name, data = rng.choice(payloads)
+            try:
+                ok = slow_upload(port, name, data, args.slow_seconds, args.slow_chunks, timeout=args.timeout)
+            except OSError:
+                ok = False
+            with lock:
+                stats['slow_ok' if ok else 'slow_errors'] += 1
+
+    def fast_worker(i, deadline):
+        rng = random.Random(1000 + i)
+        while time.time() < deadline:
+            name, data = rng.choice(payloads)
+            body, ctype = multipart_body(name, data)
+            req = urllib.request.Request(f'http://127.0.0.1:{port}/predict.json', data=body,
+                                         headers={'Content-Type': ctype})
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=args.timeout) as resp:
+                    resp.read()
+                ok = True
+            except Exception:
+                ok = False
+            with lock:
+                if ok:
+                    stats['fast_latencies'].append(time.perf_counter() - t0)
+                else:
+                    stats['fast_errors'] += 1
+
+    slow = [threading.Thread(target=slow_worker, args=(i,), daemon=True) for i in range(args.slow_clients)]
+    for t in slow:
+        t.start()
+    time.sleep(min(2.0, args.slow_seconds / 2))  # que los clientes lentos ocupen el servidor
+    started = time.perf_counter()
+    deadline = time.time() + args.duration
+    fast = [threading.Thread(target=fast_worker, args=(i, deadline)) for i in range(args.fast_clients)]
+    for t in fast:
+        t.start()
+    for t in fast:
+        t.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    for t in slow:
+        t.join(timeout=args.slow_seconds + args.timeout)
+
+    lat = sorted(stats['fast_latencies'])
+    return {
+        'fast_rps': round(len(lat) / wall, 1),
+        'fast_ok': len(lat),
+        'fast_errors': stats['fast_errors'],
+        'fast_p50_ms': round(lat[len(lat) // 2] * 1000, 1) if lat else None,
+        'fast_p95_ms': round(lat[int(len(lat) * 0.95)] * 1000, 1) if lat else None,
+        'fast_max_ms': round(lat[-1] * 1000, 1) if lat else None,
+        'slow_ok': stats['slow_ok'],
+        'slow_errors': stats['slow_errors'],
+    }
+
+
+def main(args):
+    items = list_images(args.data_dir)
+    random.Random(0).shuffle(items)
+    payloads = []
+    for i, (path, _) in enumerate(items[:args.images]):
+        with open(path, 'rb') as fh:
+            payloads.append((os.path.basename(path), fh.read() + str(i).encode()))
+
+    workdir = tempfile.mkdtemp(prefix='bench_async_')
+    env = dict(os.environ,
+               INFERENCE_BACKEND=args.backend if args.mode == 'model' else 'none',
+               USERS_DB_PATH=os.path.join(workdir, 'users.db'),
+               APP_LOG_PATH=os.path.join(workdir, 'app.log'),
+               FINETUNE_DB_PATH=os.path.join(workdir, 'finetune.db'),
+               FINETUNE_INTERVAL='0',
+               SAVE_UPLOADS='0',
+               PREDICTION_CACHE_ENTRIES='0',
+               ASYNC_PREDICT_WORKERS=str(args.threads))
+
+    results = []
+    for offset, kind in enumerate(args.servers):
+        port = args.port + offset
+        server = subprocess.Popen(server_command(kind, args, port), env=env)
+        try:
+            base = f'http://127.0.0.1:{port}'
+            if not wait_until(lambda: urllib.request.urlopen(f'{base}/healthz', timeout=2), 60):
+                raise SystemExit(f'El servidor {kind} no arrancó')
+            if args.mode == 'model' and not wait_until(lambda: urllib.request.urlopen(f'{base}/readyz', timeout=2),
+                                                       args.ready_timeout):
+                raise SystemExit(f'El modelo no quedó listo en {kind}')
+            row = dict(server=kind, slow_clients=args.slow_clients, fast_clients=args.fast_clients,
+                       **run_scenario(port, payloads, args))
+            results.append(row)
+            print(json.dumps(row), flush=True)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(f'\n{"servidor":<10}{"req/s":>8}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}{"errores":>9}{"lentas ok":>11}')
+    for r in results:
+        print(f'{r["server"]:<10}{r["fast_rps"]:>8}{str(r["fast_p50_ms"]):>10}{str(r["fast_p95_ms"]):>10}'
+              f'{str(r["fast_max_ms"]):>10}{r["fast_errors"]:>9}{r["slow_ok"]:>11}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump({'args': vars(args), 'results': results}, fh, indent=2)
+        print(f'Resultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='API asyncio vs gunicorn con hilos bajo clientes lentos')
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=list(SERVERS))
+    parser.add_argument('--mode', choices=('fallback', 'model'), default='fallback')
+    parser.add_argument('--backend', type=str, default='keras', help='INFERENCE_BACKEND en modo model')
+    parser.add_argument('--workers', type=int, default=1, help='Procesos del servidor')
+    parser.add_argument('--threads', type=int, default=2,
+                        help='Hilos de gunicorn y ASYNC_PREDICT_WORKERS de la API asyncio')
+    parser.add_argument('--slow_clients', type=int, default=16)
+    parser.add_argument('--slow_seconds', type=float, default=8.0, help='Duración de cada subida lenta')
+    parser.add_argument('--slow_chunks', type=int, default=20, help='Trozos en que se envía cada subida lenta')
+    parser.add_argument('--fast_clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20.0, help='Segundos de carga de los clientes normales')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--images', type=int, default=50, help='Imágenes distintas de data_dir a usar')
+    parser.add_argument('--data_dir', type=str, default='dataset')
+    parser.add_argument('--port', type=int, default=8150)
+    parser.add_argument('--ready_timeout', type=float, default=300.0)
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,173 @@
+"""
+bench_fallback.py
+Micro-benchmark y comprobación de paridad del clasificador heurístico (fallback.py)
+frente a las dos implementaciones anteriores que vivían en app.py:
+  - `upload()`:       regla de papel con luminancia > 200
+  - `predict_json()`: regla de papel con media simple (R+G+B)/3 > 200
+
+La versión unificada adopta la regla de `upload()` (luminancia). El script
+verifica que las etiquetas coinciden exactamente con la implementación de
+`upload()`, tanto en modo draft (decodificación reducida, la que sirven las
+rutas) como con decodificación completa, e informa de la concordancia con la de
+`predict_json()`.
+
+Con --check solo se comprueban las reglas y un conjunto de imágenes sintéticas
+generadas en memoria (no necesita dataset/).
+
+Uso:
+    python bench_fallback.py --data_dir dataset --limit 500
+    python bench_fallback.py --check
+"""
+import argparse
+import colorsys
+import io
+import random
+import time
+
+from PIL import Image as PILImage
+
+from fallback import channel_means, classify_means, classify_rgb, heuristic_predict, heuristic_predict_batch
+from inference import list_images
+
+
+def legacy_upload_predict(img_path):
+    """Copia literal de la heurística anidada en upload() (antes de fallback.py)."""
+    im = PILImage.open(img_path).convert('RGB')
+    im = im.resize((64, 64))
+    pixels = list(im.getdata())
+    r_mean = sum([p[0] for p in pixels]) / len(pixels)
+    g_mean = sum([p[1] for p in pixels]) / len(pixels)
+    b_mean = sum([p[2] for p in pixels]) / len(pixels)
+    brightness = 0.2126 * r_mean + 0.7152 * g_mean + 0.0722 * b_mean
+    rn, gn, bn = r_mean/255.0, g_mean/255.0, b_mean/255.0
+    h, s, v = colorsys.rgb_to_hsv(rn, gn, bn)
+    if brightness < 60:
+        return 'trash', 45.0
+    if s < 0.15 and brightness > 200:
+        return 'paper', 65.0
+    if g_mean >= r_mean and g_mean >= b_mean and g_mean > 110:
+        return 'glass', 60.0
+    if r_mean > g_mean and r_mean > b_mean and r_mean > 130:
+        return 'metal', 55.0
+    if brightness > 120 and s > 0.25:
+        return 'plastic', 58.0
+    return 'cardboard', 50.0
+
+
+def legacy_json_predict(img_path):
+    """Copia literal de la heurística en línea de predict_json() (antes de fallback.py)."""
+    im = PILImage.open(img_path).convert('RGB')
+    im = im.resize((64,64))
+    pixels = list(im.getdata())
+    r_mean = sum([p[0] for p in pixels]) / len(pixels)
+    g_mean = sum([p[1] for p in pixels]) / len(pixels)
+    b_mean = sum([p[2] for p in pixels]) / len(pixels)
+    rn, gn, bn = r_mean/255.0, g_mean/255.0, b_mean/255.0
+    h, s, v = colorsys.rgb_to_hsv(rn, gn, bn)
+    if (0.2126 * r_mean + 0.7152 * g_mean + 0.0722 * b_mean) < 60:
+        return 'trash', 45.0
+    elif s < 0.15 and (r_mean+g_mean+b_mean)/3 > 200:
+        return 'paper', 65.0
+    elif g_mean >= r_mean and g_mean >= b_mean and g_mean > 110:
+        return 'glass', 60.0
+    elif r_mean > g_mean and r_mean > b_mean and r_mean > 130:
+        return 'metal', 55.0
+    elif (0.2126 * r_mean + 0.7152 * g_mean + 0.0722 * b_mean) > 120 and s > 0.25:
+        return 'plastic', 58.0
+    else:
+        return 'cardboard', 50.0
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def check_rules():
+    """Paridad de reglas sobre una rejilla sintética de medias RGB (vectorizado vs escalar)."""
+    grid = [(r, g, b) for r in range(0, 256, 5) for g in range(0, 256, 5) for b in range(0, 256, 5)]
+    vectorized = classify_means(grid)
+    mismatches = sum(1 for m, v in zip(grid, vectorized) if classify_rgb(*m) != v)
+    print(f'Reglas vectorizadas vs escalares: {len(grid) - mismatches}/{len(grid)} coinciden')
+    return mismatches == 0
+
+
+def synthetic_images():
+    """Imágenes JPEG/PNG en memoria que cubren todas las reglas: colores lisos y bloques."""
+    colors = [(20, 20, 20), (240, 240, 235), (60, 180, 70), (200, 60, 50), (230, 200, 40),
+              (150, 110, 70), (80, 140, 230), (128, 128, 128), (250, 250, 250), (90, 160, 90), (120, 100, 80)]
+    images = []
+    for i, color in enumerate(colors):
+        im = PILImage.new('RGB', (256, 192), color)
+        other = colors[(i + 3) % len(colors)]
+        im.paste(other, (0, 0, 64, 64))  # bloque alineado a la rejilla de draft y de 64x64
+        for fmt in ('JPEG', 'PNG'):
+            buf = io.BytesIO()
+            im.save(buf, fmt, **({'quality': 95} if fmt == 'JPEG' else {}))
+            images.append((f'{color}.{fmt.lower()}', buf.getvalue()))
+    return images
+
+
+def check_synthetic():
+    """Paridad con upload() sobre imágenes sintéticas, en modo draft y con decodificación completa."""
+    mismatches = []
+    images = synthetic_images()
+    for name, data in images:
+        expected = legacy_upload_predict(io.BytesIO(data))
+        for draft in (True, False):
+            got = heuristic_predict(io.BytesIO(data), draft=draft)
+            if got != expected:
+                mismatches.append((name, draft, expected, got))
+    print(f'Imágenes sintéticas vs upload(): {len(images) * 2 - len(mismatches)}/{len(images) * 2} coinciden')
+    for name, draft, expected, got in mismatches:
+        print(f'  {name} draft={draft}: esperado {expected}, obtenido {got}')
+    return not mismatches
+
+
+def main(args):
+    if args.check:
+        if not (check_rules() and check_synthetic()):
+            raise SystemExit(1)
+        print('Paridad con upload(): OK')
+        return
+
+    items = list_images(args.data_dir)
+    random.Random(0).shuffle(items)
+    paths = [p for p, _ in items[:args.limit]]
+    print(f'Imágenes: {len(paths)}')
+
+    ok = check_rules() and check_synthetic()
+
+    legacy_upload, t_upload = timed(lambda ps: [legacy_upload_predict(p) for p in ps], paths)
+    legacy_json, t_json = timed(lambda ps: [legacy_json_predict(p) for p in ps], paths)
+    full, t_full = timed(heuristic_predict_batch, paths, False)
+    fast, t_fast = timed(heuristic_predict_batch, paths, True)
+    _, t_stats = timed(lambda ps: [channel_means(p) for p in ps], paths)
+
+    def agreement(a, b):
+        return sum(1 for x, y in zip(a, b) if x == y)
+
+    n = len(paths)
+    print(f'{"implementación":<40}{"ms/img":>10}{"vs upload()":>14}')
+    print(f'{"legacy upload()":<40}{t_upload / n * 1000:>10.3f}{n:>10}/{n}')
+    print(f'{"legacy predict_json()":<40}{t_json / n * 1000:>10.3f}{agreement(legacy_json, legacy_upload):>10}/{n}')
+    print(f'{"fallback.py (decodificación completa)":<40}{t_full / n * 1000:>10.3f}{agreement(full, legacy_upload):>10}/{n}')
+    print(f'{"fallback.py (draft)":<40}{t_fast / n * 1000:>10.3f}{agreement(fast, legacy_upload):>10}/{n}')
+    print(f'{"  solo channel_means (draft)":<40}{t_stats / n * 1000:>10.3f}')
+
+    # Las rutas sirven el modo draft: se exige paridad en ambos modos
+    parity = agreement(fast, legacy_upload) == n and agreement(full, legacy_upload) == n
+    print('Paridad con upload() (draft y completa):', 'OK' if parity else 'FALLO')
+    if not (ok and parity):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark y paridad del fallback heurístico')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--limit', type=int, default=500, help='Número máximo de imágenes')
+    parser.add_argument('--check', action='store_true', help='Solo reglas e imágenes sintéticas (sin dataset/)')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,71 @@
+"""
+bench_inference.py
+Compara la latencia por imagen de `model.predict()` frente al callable
+compilado de inference.py (con y sin XLA) sobre imágenes reales de dataset/.
+
+Uso:
+    python bench_inference.py --model garbage_model.h5 --images 64 --repeats 3
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from tensorflow.keras.models import load_model
+from tensorflow.keras.preprocessing import image
+
+from inference import IMG_SIZE, build_inference_fn, warm_up
+
+
+def load_images(data_dir, limit):
+    paths = []
+    for root, dirs, files in os.walk(data_dir):
+        for f in sorted(files):
+            if f.lower().endswith(('.png', '.jpg', '.jpeg')):
+                paths.append(os.path.join(root, f))
+    paths = paths[:limit]
+    arrays = [image.img_to_array(image.load_img(p, target_size=(IMG_SIZE, IMG_SIZE))) / 255.0 for p in paths]
+    return np.stack(arrays).astype(np.float32)
+
+
+def time_per_image(fn, images, batch_size, repeats):
+    """Latencia media por imagen (ms) llamando a `fn` en batches de `batch_size`."""
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for i in range(0, len(images), batch_size):
+            fn(images[i:i + batch_size])
+        elapsed = (time.perf_counter() - started) / len(images) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args):
+    images = load_images(args.data_dir, args.images)
+    print(f'Imágenes cargadas: {len(images)}')
+    model = load_model(args.model, compile=False)
+
+    candidates = [('model.predict', lambda b: model.predict(b, verbose=0), 0.0)]
+    for jit in (False, True):
+        started = time.perf_counter()
+        fn = build_inference_fn(model, jit_compile=jit)
+        warm_up(fn, batch_sizes=sorted({1, args.batch_size}))
+        candidates.append((f'compilado{" + XLA" if jit else ""}', fn, time.perf_counter() - started))
+
+    print(f'{"backend":<20}{"warm-up (s)":>12}{"bs=1 (ms/img)":>16}{f"bs={args.batch_size} (ms/img)":>16}')
+    for name, fn, warm in candidates:
+        single = time_per_image(fn, images, 1, args.repeats)
+        batched = time_per_image(fn, images, args.batch_size, args.repeats)
+        print(f'{name:<20}{warm:>12.2f}{single:>16.2f}{batched:>16.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de latencia de inferencia')
+    parser.add_argument('--model', type=str, default='garbage_model.h5', help='Ruta del modelo .h5')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--images', type=int, default=64, help='Número de imágenes a usar')
+    parser.add_argument('--batch_size', type=int, default=8, help='Tamaño de batch para la medición agrupada')
+    parser.add_argument('--repeats', type=int, default=3, help='Repeticiones (se reporta la mejor)')
+    args = parser.parse_args()
+
+    main(args)
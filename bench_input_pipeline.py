@@ -0,0 +1,110 @@
+"""
+bench_input_pipeline.py
+Compara la entrada de entrenamiento ImageDataGenerator (anterior) con tf.data
+(data_pipeline.py) y con los shards memory-mapped (dataset_shards.py):
+imágenes/s y tiempo por época.
+
+- Solo entrada (por defecto): recorre las épocas de entrenamiento sin modelo,
+  midiendo cuánto tarda en producir todos los batches aumentados.
+- Con --fit: entrena build_transfer_model de train.py unas épocas con cada
+  entrada y mide el tiempo por época real (modelo + entrada).
+
+Uso:
+    python bench_input_pipeline.py --epochs 3
+    python bench_input_pipeline.py --fit --epochs 2 --output input_pipeline.json
+    python bench_input_pipeline.py --pipelines tfdata:memory shards
+"""
+import argparse
+import json
+import time
+
+from data_pipeline import make_datasets, make_shard_datasets
+
+
+def iterate_epochs(data, steps, epochs):
+    """Recorre `epochs` épocas de `steps` batches; devuelve segundos por época."""
+    times = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        for i, (images, _) in enumerate(data):
+            if hasattr(images, 'numpy'):
+                images.numpy()  # forzar el cálculo del batch (tf.data es perezoso)
+            if i + 1 >= steps:
+                break
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def run_pipeline(name, args):
+    import math
+    from train import make_generators
+
+    img_size = (args.img_size, args.img_size)
+    if name == 'generator':
+        train_data, _, class_indices, counts = make_generators(args.data_dir, img_size, args.batch_size)
+    elif name == 'shards':
+        from dataset_shards import update_shards
+        update_shards(args.data_dir, args.shards_dir, img_size=args.img_size)
+        train_data, _, class_indices, counts = make_shard_datasets(args.shards_dir, batch_size=args.batch_size)
+    else:
+        cache = name.split(':', 1)[1] if ':' in name else 'memory'
+        train_data, _, class_indices, counts = make_datasets(args.data_dir, img_size=args.img_size,
+                                                             batch_size=args.batch_size, cache=cache,
+                                                             cache_dir=args.cache_dir)
+    steps = math.ceil(counts['train'] / args.batch_size)
+
+    if args.fit:
+        from tensorflow.keras import optimizers
+        from train import EpochTimer, build_transfer_model
+
+        model = build_transfer_model(input_shape=(args.img_size, args.img_size, 3), num_classes=len(class_indices))
+        model.compile(optimizer=optimizers.Adam(learning_rate=1e-3), loss='categorical_crossentropy',
+                      metrics=['accuracy'])
+        timer = EpochTimer(counts['train'])
+        model.fit(train_data, epochs=args.epochs, steps_per_epoch=steps, callbacks=[timer], verbose=0)
+        times = [e['seconds'] for e in timer.epochs]
+    else:
+        times = iterate_epochs(train_data, steps, args.epochs)
+
+    steady = times[1:] or times
+    row = {
+        'pipeline': name,
+        'mode': 'fit' if args.fit else 'input_only',
+        'train_images': counts['train'],
+        'epoch_s': [round(t, 2) for t in times],
+        'first_epoch_images_per_s': round(counts['train'] / times[0], 1),
+        'steady_images_per_s': round(counts['train'] * len(steady) / sum(steady), 1),
+    }
+    print(json.dumps(row))
+    return row
+
+
+def main(args):
+    results = [run_pipeline(name, args) for name in args.pipelines]
+    base = next((r for r in results if r['pipeline'] == 'generator'), None)
+    print(f'\n{"pipeline":<16}{"1ª época s":>12}{"época s":>10}{"img/s":>10}{"speedup":>9}')
+    for r in results:
+        steady = r['epoch_s'][1:] or r['epoch_s']
+        speedup = r['steady_images_per_s'] / base['steady_images_per_s'] if base else 0.0
+        print(f'{r["pipeline"]:<16}{r["epoch_s"][0]:>12}{sum(steady) / len(steady):>10.2f}'
+              f'{r["steady_images_per_s"]:>10}{speedup:>9.2f}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ImageDataGenerator vs tf.data: imágenes/s y tiempo por época')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--img_size', type=int, default=128, help='Tamaño de imagen (px)')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    parser.add_argument('--epochs', type=int, default=3, help='Épocas por entrada (la primera llena la caché)')
+    parser.add_argument('--pipelines', nargs='+', default=['generator', 'tfdata:none', 'tfdata:memory'],
+                        help='generator, tfdata:none, tfdata:memory, tfdata:disk, shards')
+    parser.add_argument('--cache_dir', type=str, default='.tfdata_cache', help='Carpeta de la caché en disco')
+    parser.add_argument('--shards_dir', type=str, default='dataset_shards', help='Carpeta de los shards mmap')
+    parser.add_argument('--fit', action='store_true', help='Medir entrenando el modelo (no solo la entrada)')
+    parser.add_argument('--output', type=str, default=None, help='Guardar resultados en JSON')
+    args = parser.parse_args()
+
+    main(args)
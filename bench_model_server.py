@@ -0,0 +1,162 @@
+"""
+bench_model_server.py
+Prueba de carga local del servidor de modelo compartido (model_server.py):
+arranca un servidor de modelo y, para cada número de workers de gunicorn,
+levanta la app con INFERENCE_BACKEND=remote y mide el throughput de
+/predict.json con N clientes concurrentes.
+
+Uso:
+    python bench_model_server.py --workers 1 2 4 --clients 16 --requests 400
+    python bench_model_server.py --simulate_ms 20     # sin TensorFlow: modelo simulado
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+from inference import list_images
+
+
+def multipart_body(filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def wait_until(fn, timeout, interval=0.2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if fn():
+                return True
+        except Exception:
+            pass
+        time.sleep(interval)
+    return False
+
+
+def run_load(url, payloads, clients, total):
+    """Lanza `total` peticiones con `clients` hilos. Devuelve (req/s, latencias, fuentes)."""
+    latencies, sources, errors = [], {}, 0
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            name, data = payloads[i % len(payloads)]
+            body, ctype = multipart_body(name, data)
+            req = urllib.request.Request(url, data=body, headers={'Content-Type': ctype})
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as resp:
+                    source = json.loads(resp.read()).get('source', '?')
+                ok = True
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                    sources[source] = sources.get(source, 0) + 1
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    return len(latencies) / wall, sorted(latencies), sources, errors
+
+
+def main(args):
+    items = list_images(args.data_dir)
+    random.Random(0).shuffle(items)
+    # Bytes distintos por petición para no medir la caché de predicciones
+    payloads = []
+    for i, (path, _) in enumerate(items[:args.requests]):
+        with open(path, 'rb') as fh:
+            payloads.append((os.path.basename(path), fh.read() + str(i).encode()))
+
+    sock = os.path.join(tempfile.mkdtemp(), 'model.sock')
+    server_cmd = [sys.executable, 'model_server.py', '--socket', sock, '--model', args.model,
+                  '--backend', args.backend]
+    if args.simulate_ms:
+        server_cmd += ['--simulate_ms', str(args.simulate_ms)]
+    server = subprocess.Popen(server_cmd)
+    results = []
+    try:
+        if not wait_until(lambda: os.path.exists(sock), timeout=300):
+            raise SystemExit('El servidor de modelo no arrancó')
+        for workers in args.workers:
+            env = dict(os.environ, INFERENCE_BACKEND='remote', MODEL_SERVER_SOCKET=sock,
+                       SAVE_UPLOADS='0', PREDICTION_CACHE_ENTRIES='0')
+            web = subprocess.Popen(['gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+                                    '--workers', str(workers), '--threads', str(args.threads),
+                                    '--log-level', 'warning'], env=env)
+            try:
+                url = f'http://127.0.0.1:{args.port}'
+                if not wait_until(lambda: urllib.request.urlopen(f'{url}/public_model_status', timeout=2), 60):
+                    raise SystemExit('gunicorn no arrancó')
+                # Calentar: cada worker conecta con el servidor en su primera predicción
+                run_load(f'{url}/predict.json', payloads, workers * args.threads, workers * args.threads * 4)
+                rps, lat, sources, errors = run_load(f'{url}/predict.json', payloads, args.clients, args.requests)
+                row = {
+                    'workers': workers,
+                    'threads': args.threads,
+                    'clients': args.clients,
+                    'rps': round(rps, 1),
+                    'p50_ms': round(lat[len(lat) // 2] * 1000, 1) if lat else None,
+                    'p95_ms': round(lat[int(len(lat) * 0.95)] * 1000, 1) if lat else None,
+                    'sources': sources,
+                    'errors': errors,
+                }
+                results.append(row)
+                print(json.dumps(row))
+            finally:
+                web.terminate()
+                web.wait(timeout=30)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    base = results[0]['rps'] if results and results[0]['rps'] else None
+    print(f'\n{"workers":>8}{"req/s":>10}{"speedup":>10}{"p50 ms":>10}{"p95 ms":>10}')
+    for r in results:
+        speedup = r['rps'] / base if base else 0.0
+        print(f'{r["workers"]:>8}{r["rps"]:>10}{speedup:>10.2f}{str(r["p50_ms"]):>10}{str(r["p95_ms"]):>10}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prueba de carga: workers web contra un servidor de modelo')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Workers de gunicorn a probar')
+    parser.add_argument('--threads', type=int, default=2, help='Hilos por worker')
+    parser.add_argument('--clients', type=int, default=16, help='Clientes concurrentes')
+    parser.add_argument('--requests', type=int, default=400, help='Peticiones por ronda')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--model', type=str, default='garbage_model.h5', help='Modelo del servidor')
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras', help='Backend del servidor')
+    parser.add_argument('--simulate_ms', type=float, default=0.0, help='Modelo simulado con este coste por batch')
+    parser.add_argument('--port', type=int, default=5055, help='Puerto local para gunicorn')
+    parser.add_argument('--output', type=str, default=None, help='Guardar resultados en JSON')
+    args = parser.parse_args()
+
+    main(args)
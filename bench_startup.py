@@ -0,0 +1,131 @@
+"""
+bench_startup.py
+Mide el arranque en frío de la app:
+
+- tiempo de `import app` en un proceso nuevo (y si arrastra numpy/tensorflow);
+- con gunicorn: tiempo hasta que /healthz responde (liveness), hasta que
+  /readyz devuelve 200 (modelo cargado y calentado) y hasta la primera
+  respuesta de /predict.json servida por el modelo (source=model).
+
+Uso:
+    python bench_startup.py --repeats 5
+    python bench_startup.py --backend tflite --output startup.json
+    python bench_startup.py --skip_server          # solo el tiempo de import
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from bench_model_server import multipart_body, wait_until
+from inference import list_images
+
+_IMPORT_PROBE = (
+    'import sys, time; t0 = time.perf_counter(); import app; '
+    'print(time.perf_counter() - t0, "numpy" in sys.modules, "tensorflow" in sys.modules)'
+)
+
+
+def measure_import(env, repeats):
+    """Tiempo de `import app` en procesos nuevos. Devuelve (tiempos, numpy_importado, tf_importado)."""
+    times, numpy_loaded, tf_loaded = [], False, False
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', _IMPORT_PROBE], env=env, capture_output=True,
+                             text=True, check=True).stdout.strip().splitlines()[-1].split()
+        times.append(float(out[0]))
+        numpy_loaded |= out[1] == 'True'
+        tf_loaded |= out[2] == 'True'
+    return times, numpy_loaded, tf_loaded
+
+
+def _status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def measure_server(env, args, sample):
+    """Arranca gunicorn y mide los hitos del arranque (segundos desde el lanzamiento)."""
+    url = f'http://127.0.0.1:{args.port}'
+    name, data = sample
+    started = time.perf_counter()
+    web = subprocess.Popen(['gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+                            '--workers', '1', '--threads', str(args.threads), '--log-level', 'warning'], env=env)
+    row = {'healthz_s': None, 'readyz_s': None, 'first_model_prediction_s': None, 'first_source': None}
+    try:
+        if wait_until(lambda: _status(f'{url}/healthz') == 200, args.timeout, interval=0.05):
+            row['healthz_s'] = round(time.perf_counter() - started, 3)
+        # Primera predicción que llega mientras el modelo aún se está cargando (debe usar fallback)
+        body, ctype = multipart_body(name, data)
+        req = urllib.request.Request(f'{url}/predict.json', data=body, headers={'Content-Type': ctype})
+        with urllib.request.urlopen(req, timeout=args.timeout) as resp:
+            row['first_source'] = json.loads(resp.read()).get('source')
+        if wait_until(lambda: _status(f'{url}/readyz') == 200, args.timeout, interval=0.1):
+            row['readyz_s'] = round(time.perf_counter() - started, 3)
+
+        def model_prediction():
+            body, ctype = multipart_body(name, data)
+            req = urllib.request.Request(f'{url}/predict.json', data=body, headers={'Content-Type': ctype})
+            with urllib.request.urlopen(req, timeout=args.timeout) as resp:
+                return json.loads(resp.read()).get('source') == 'model'
+
+        if wait_until(model_prediction, args.timeout, interval=0.1):
+            row['first_model_prediction_s'] = round(time.perf_counter() - started, 3)
+    finally:
+        web.terminate()
+        web.wait(timeout=30)
+    return row
+
+
+def main(args):
+    env = dict(os.environ, INFERENCE_BACKEND=args.backend, SAVE_UPLOADS='0', PREDICTION_CACHE_ENTRIES='0')
+    times, numpy_loaded, tf_loaded = measure_import(env, args.repeats)
+    result = {
+        'backend': args.backend,
+        'import_s': {'min': round(min(times), 3), 'median': round(statistics.median(times), 3),
+                     'max': round(max(times), 3)},
+        'import_pulls_numpy': numpy_loaded,
+        'import_pulls_tensorflow': tf_loaded,
+        'server_runs': [],
+    }
+    print(f'import app: mediana {result["import_s"]["median"]:.3f}s '
+          f'(numpy={numpy_loaded}, tensorflow={tf_loaded})')
+
+    if not args.skip_server:
+        path, _ = list_images(args.data_dir)[0]
+        with open(path, 'rb') as fh:
+            sample = (os.path.basename(path), fh.read())
+        for i in range(args.server_repeats):
+            row = measure_server(env, args, sample)
+            result['server_runs'].append(row)
+            print(f'gunicorn #{i + 1}: healthz {row["healthz_s"]}s, readyz {row["readyz_s"]}s, '
+                  f'primera predicción del modelo {row["first_model_prediction_s"]}s '
+                  f'(primera respuesta: {row["first_source"]})')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(result, fh, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de arranque en frío (import, readiness, primera predicción)')
+    parser.add_argument('--backend', choices=['keras', 'tflite', 'remote'],
+                        default=os.environ.get('INFERENCE_BACKEND', 'keras'), help='INFERENCE_BACKEND a medir')
+    parser.add_argument('--repeats', type=int, default=5, help='Repeticiones del tiempo de import')
+    parser.add_argument('--server_repeats', type=int, default=1, help='Arranques de gunicorn a medir')
+    parser.add_argument('--threads', type=int, default=2, help='Hilos del worker de gunicorn')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--port', type=int, default=5056, help='Puerto local para gunicorn')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Espera máxima por hito (s)')
+    parser.add_argument('--skip_server', action='store_true', help='Medir solo el tiempo de import')
+    parser.add_argument('--output', type=str, default=None, help='Guardar resultados en JSON')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,133 @@
+"""
+bench_static_assets.py
+Bytes transferidos por las páginas /login e / (index) antes y después de las
+variantes con huella de static/dist/ (ver static_assets.py).
+
+Simula un navegador con el test client de Flask: descarga el HTML, extrae las
+imágenes de /static que pediría (fondos CSS, <img>, <picture>, favicon) y las
+descarga, respetando Cache-Control/ETag entre visitas:
+
+  - before: STATIC_ASSETS desactivado y sin max-age (comportamiento anterior:
+            ficheros originales, `Cache-Control: no-cache`, revalidación por ETag)
+  - after:  variantes de static/dist/ con `immutable` de un año
+
+  - modern: navegador con AVIF/WebP e image-set(type())
+  - legacy: solo JPEG/PNG (usa el url() de respaldo y el <img> del <picture>)
+
+Por página informa la primera visita (caché vacía) y una visita repetida.
+
+Uso:
+    python static_assets.py                # generar static/dist/ primero
+    python bench_static_assets.py --output static_bytes.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+
+PAGES = (('login', '/login', False), ('index', '/', True))
+PROFILES = {'modern': ('image/avif', 'image/webp', 'image/jpeg', 'image/png'), 'legacy': ('image/jpeg', 'image/png')}
+
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+_URL_RE = re.compile(r"url\('(/static/[^']+)'\)")
+_IMAGE_SET_RE = re.compile(r'image-set\((.*?)\);', re.S)
+_SET_ITEM_RE = re.compile(r"url\('(/static/[^']+)'\) type\('([^']+)'\)")
+_PICTURE_RE = re.compile(r'<picture>(.*?)</picture>', re.S)
+_SOURCE_RE = re.compile(r'<source type="([^"]+)" srcset="([^"]+)">')
+_SRC_RE = re.compile(r'<(?:img|link)[^>]+(?:src|href)="(/static/[^"]+)"')
+
+
+def page_assets(html, supported):
+    """URLs de /static que descargaría un navegador con los tipos `supported`."""
+    urls = set()
+    html = _COMMENT_RE.sub('', html)
+    for block in _IMAGE_SET_RE.findall(html):
+        items = _SET_ITEM_RE.findall(block)
+        chosen = next((u for u, t in items if t in supported), items[-1][0])
+        urls.add(chosen)
+        html = html.replace(f"url('{items[-1][0]}');", '', 1) if chosen != items[-1][0] else html
+    for block in _PICTURE_RE.findall(html):
+        chosen = next((u for t, u in _SOURCE_RE.findall(block) if t in supported), None)
+        if chosen:
+            urls.add(chosen)
+            html = html.replace(block, '')
+    html = _IMAGE_SET_RE.sub('', html)
+    urls.update(_URL_RE.findall(html))
+    urls.update(_SRC_RE.findall(html))
+    return sorted(urls)
+
+
+def visit(client, path, supported, cache):
+    """Una visita: HTML + imágenes. `cache` guarda {url: (etag, max_age)} entre visitas."""
+    response = client.get(path)
+    html = response.get_data(as_text=True)
+    stats = {'html_bytes': len(response.data), 'requests': 1, 'asset_bytes': 0, 'revalidated': 0, 'from_cache': 0}
+    for url in page_assets(html, supported):
+        cached = cache.get(url)
+        if cached and cached[1]:
+            stats['from_cache'] += 1
+            continue
+        headers = {'If-None-Match': cached[0]} if cached and cached[0] else {}
+        r = client.get(url, headers=headers)
+        stats['requests'] += 1
+        if r.status_code == 304:
+            stats['revalidated'] += 1
+        else:
+            stats['asset_bytes'] += len(r.data)
+        cache[url] = (r.headers.get('ETag'), r.cache_control.max_age or 0)
+        r.close()
+    stats['total_bytes'] = stats['html_bytes'] + stats['asset_bytes']
+    return stats
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix='bench_static_')
+    os.environ.update(USERS_DB_PATH=os.path.join(workdir, 'users.db'), APP_LOG_PATH=os.path.join(workdir, 'app.log'),
+                      INFERENCE_BACKEND='none', WARMUP_ON_BOOT='0', FINETUNE_INTERVAL='0',
+                      FINETUNE_DB_PATH=os.path.join(workdir, 'finetune.db'), UPLOAD_SWEEP_INTERVAL='0')
+    import app as flask_app_module
+    if not os.path.exists(flask_app_module.asset_manifest.path):
+        sys.exit(f'No existe {flask_app_module.asset_manifest.path}: ejecuta antes python static_assets.py')
+
+    rows = []
+    for variant in ('before', 'after'):
+        flask_app_module.asset_manifest.enabled = variant == 'after'
+        flask_app_module.app.config['SEND_FILE_MAX_AGE_DEFAULT'] = None if variant == 'before' else args.static_max_age
+        for profile in args.profiles:
+            for page, path, needs_login in PAGES:
+                client = flask_app_module.app.test_client()
+                if needs_login:
+                    with client.session_transaction() as sess:
+                        sess['user'] = 'admin'
+                cache = {}
+                for visit_name in ('first', 'repeat'):
+                    row = dict(variant=variant, profile=profile, page=page, visit=visit_name,
+                               **visit(client, path, PROFILES[profile], cache))
+                    rows.append(row)
+
+    print(f'{"página":<7} {"navegador":<9} {"visita":<7} {"antes (KB / peticiones)":>26} {"después":>20}')
+    for page, _, _ in PAGES:
+        for profile in args.profiles:
+            for visit_name in ('first', 'repeat'):
+                before, after = (next(r for r in rows if r['variant'] == v and r['page'] == page
+                                      and r['profile'] == profile and r['visit'] == visit_name)
+                                 for v in ('before', 'after'))
+                print(f'{page:<7} {profile:<9} {visit_name:<7} '
+                      f'{before["total_bytes"] / 1024:>15.1f} KB / {before["requests"]:<3}'
+                      f'{after["total_bytes"] / 1024:>12.1f} KB / {after["requests"]:<3}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump({'static_max_age': args.static_max_age, 'results': rows}, fh, indent=2)
+        print(f'Resultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bytes transferidos por /login e / antes y después de static/dist/')
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['modern', 'legacy'])
+    parser.add_argument('--static_max_age', type=int, default=3600, help='STATIC_MAX_AGE para el resto de static/')
+    parser.add_argument('--output', type=str, default=None, help='Fichero JSON con los resultados')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,183 @@
+"""
+bench_users_db.py
+Benchmark de concurrencia de users.db: compara el acceso anterior (una
+conexión nueva por petición, journal por defecto) con UserStore (conexión por
+hilo, WAL, busy_timeout) en operaciones de login (lectura del hash) y
+registro (INSERT), con varios hilos en paralelo.
+
+Por defecto NO incluye el coste del hash de contraseña (se mide solo la capa
+de datos); con --with_hash se añade check/generate_password_hash de werkzeug.
+
+Uso:
+    python bench_users_db.py --threads 1 4 8 --ops 2000
+    python bench_users_db.py --workload mixed --write_ratio 0.2 --output users_db.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from user_store import UserStore
+
+_SCHEMA = 'CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL)'
+
+
+class LegacyStore:
+    """Acceso equivalente al de app.py antes de UserStore: connect() + close() en cada operación."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _conn(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        conn = self._conn()
+        conn.execute(_SCHEMA)
+        conn.commit()
+        conn.close()
+
+    def get_password_hash(self, username):
+        conn = self._conn()
+        cur = conn.cursor()
+        cur.execute('SELECT password FROM users WHERE username = ?', (username,))
+        row = cur.fetchone()
+        conn.close()
+        return row['password'] if row else None
+
+    def create_user(self, username, password_hash):
+        conn = self._conn()
+        cur = conn.cursor()
+        try:
+            cur.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password_hash))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def make_store(kind, db_path):
+    if kind == 'legacy':
+        return LegacyStore(db_path)
+    return UserStore(db_path)
+
+
+def run(kind, threads, ops, workload, write_ratio, seed_users, with_hash):
+    if with_hash:
+        from werkzeug.security import check_password_hash, generate_password_hash
+    else:
+        def generate_password_hash(password):
+            return 'plain$' + password
+
+        def check_password_hash(stored, password):
+            return stored == 'plain$' + password
+
+    with tempfile.TemporaryDirectory(prefix='bench_users_') as tmp:
+        db_path = os.path.join(tmp, 'users.db')
+        store = make_store(kind, db_path)
+        store.init_schema()
+        for i in range(seed_users):
+            store.create_user(f'user{i}', generate_password_hash(f'pw{i}'))
+
+        counter = iter(range(ops))
+        lock = threading.Lock()
+        latencies = {'login': [], 'register': []}
+        errors = {'login': 0, 'register': 0}
+
+        def choose(i):
+            if workload == 'login':
+                return 'login'
+            if workload == 'register':
+                return 'register'
+            # Mezcla determinista: una escritura cada 1/write_ratio operaciones
+            every = max(1, int(round(1.0 / write_ratio))) if write_ratio > 0 else 0
+            return 'register' if every and i % every == 0 else 'login'
+
+        def worker():
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                op = choose(i)
+                t0 = time.perf_counter()
+                try:
+                    if op == 'login':
+                        n = i % seed_users
+                        stored = store.get_password_hash(f'user{n}')
+                        ok = stored is not None and check_password_hash(stored, f'pw{n}')
+                    else:
+                        store.create_user(f'new{i}', generate_password_hash(f'pw{i}'))
+                        ok = True
+                except sqlite3.Error:
+                    ok = False
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    if ok:
+                        latencies[op].append(elapsed)
+                    else:
+                        errors[op] += 1
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        wall = time.perf_counter() - started
+
+    def pct(values, p):
+        if not values:
+            return None
+        values = sorted(values)
+        return round(values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))] * 1000.0, 3)
+
+    done = sum(len(v) for v in latencies.values())
+    row = {'store': kind, 'threads': threads, 'workload': workload, 'ops': ops,
+           'ops_per_s': round(done / wall, 1), 'errors': errors}
+    for op, values in latencies.items():
+        if values:
+            row[op] = {'count': len(values), 'p50_ms': pct(values, 50), 'p95_ms': pct(values, 95),
+                       'p99_ms': pct(values, 99)}
+    if kind == 'pooled':
+        row['store_stats'] = {k: v for k, v in store.stats().items() if k != 'db_path'}
+    return row
+
+
+def main(args):
+    results = []
+    for workload in args.workload:
+        for threads in args.threads:
+            for kind in ('legacy', 'pooled'):
+                row = run(kind, threads, args.ops, workload, args.write_ratio, args.seed_users, args.with_hash)
+                results.append(row)
+                print(json.dumps(row))
+
+    print(f'\n{"workload":<10}{"threads":>8}{"legacy ops/s":>14}{"pooled ops/s":>14}{"speedup":>9}')
+    for i in range(0, len(results), 2):
+        legacy, pooled = results[i], results[i + 1]
+        speedup = pooled['ops_per_s'] / legacy['ops_per_s'] if legacy['ops_per_s'] else 0.0
+        print(f'{legacy["workload"]:<10}{legacy["threads"]:>8}{legacy["ops_per_s"]:>14}'
+              f'{pooled["ops_per_s"]:>14}{speedup:>9.2f}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrencia de users.db: conexión por petición vs UserStore (WAL)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8], help='Hilos concurrentes')
+    parser.add_argument('--ops', type=int, default=2000, help='Operaciones por ronda')
+    parser.add_argument('--workload', nargs='+', choices=['login', 'register', 'mixed'],
+                        default=['login', 'register', 'mixed'], help='Tipo de carga')
+    parser.add_argument('--write_ratio', type=float, default=0.1, help='Fracción de registros en la carga mixed')
+    parser.add_argument('--seed_users', type=int, default=200, help='Usuarios creados antes de medir')
+    parser.add_argument('--with_hash', action='store_true', help='Incluir el hash de contraseña de werkzeug')
+    parser.add_argument('--output', type=str, default=None, help='Guardar resultados en JSON')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,179 @@
+"""
+bottleneck_features.py
+Caché en disco de las características de la base congelada (MobileNetV2 +
+GlobalAveragePooling) para entrenar solo la cabeza densa.
+
+Con `base.trainable = False` la base da siempre el mismo vector para la misma
+imagen, así que se calcula una sola vez por imagen (y por variante de aumento,
+opcional) y se guarda indexado por el hash del contenido del fichero: mover o
+renombrar imágenes no invalida la caché y las imágenes nuevas solo calculan
+lo suyo. Cada época de la cabeza son unos productos de matrices sobre
+(N, 1280) en lugar de pasar todas las imágenes por la red convolucional.
+
+    .bottleneck_cache/<base>_<img>px/
+        variant_0.npy + variant_0.json   sin aumento (entrenamiento y validación)
+        variant_1.npy + variant_1.json   una muestra de aumento aleatorio (solo entrenamiento)
+        ...
+
+Uso (desde train.py):
+    python train.py --train_mode cached_head --aug_variants 3
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from data_pipeline import augment_batch, split_train_val
+from inference import load_image_uint8
+
+DEFAULT_CACHE_DIR = '.bottleneck_cache'
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """sha256 del contenido del fichero (clave de la caché)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureStore:
+    """Matriz de características float16 (N, D) + índice hash -> fila, solo de añadir.
+    `add()` acumula en memoria; `save()` escribe los ficheros de forma atómica.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.hashes = []
+        self.features = None
+        if os.path.exists(prefix + '.json') and os.path.exists(prefix + '.npy'):
+            with open(prefix + '.json', 'r', encoding='utf-8') as fh:
+                self.hashes = json.load(fh)['hashes']
+            self.features = np.load(prefix + '.npy')
+            if len(self.features) != len(self.hashes):
+                logging.warning('Caché de características inconsistente en %s; se recalcula', prefix)
+                self.hashes, self.features = [], None
+        self._rows = {h: i for i, h in enumerate(self.hashes)}
+
+    def missing(self, hashes):
+        seen = set()
+        out = []
+        for h in hashes:
+            if h not in self._rows and h not in seen:
+                seen.add(h)
+                out.append(h)
+        return out
+
+    def add(self, hashes, features):
+        features = np.asarray(features, dtype=np.float16)
+        self.features = features if self.features is None else np.concatenate([self.features, features])
+        for h in hashes:
+            self._rows[h] = len(self.hashes)
+            self.hashes.append(h)
+
+    def save(self):
+        if self.features is None:
+            return
+        os.makedirs(os.path.dirname(self.prefix) or '.', exist_ok=True)
+        # Escritura atómica: una ejecución interrumpida no deja la caché a medias
+        with open(self.prefix + '.npy.tmp', 'wb') as fh:
+            np.save(fh, self.features, allow_pickle=False)
+        with open(self.prefix + '.json.tmp', 'w', encoding='utf-8') as fh:
+            json.dump({'hashes': self.hashes}, fh)
+        os.replace(self.prefix + '.npy.tmp', self.prefix + '.npy')
+        os.replace(self.prefix + '.json.tmp', self.prefix + '.json')
+
+    def get(self, hashes):
+        return self.features[[self._rows[h] for h in hashes]]
+
+
+def compute_missing(extractor, store, paths, hashes, img_size, augment=False, batch_size=64, workers=4,
+                    save_every=1024):
+    """Calcula y guarda las características de las imágenes que no están en `store`
+    (guardando cada `save_every` imágenes para no perder lo calculado si se interrumpe).
+    Devuelve el número de imágenes calculadas.
+    """
+    import tensorflow as tf
+
+    first_path = {}
+    for path, h in zip(paths, hashes):
+        first_path.setdefault(h, path)
+    todo = store.missing(hashes)
+    if not todo:
+        return 0
+
+    unsaved = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for start in range(0, len(todo), batch_size):
+            chunk = todo[start:start + batch_size]
+            images = np.stack(list(pool.map(lambda h: load_image_uint8(first_path[h], img_size), chunk)))
+            x = tf.convert_to_tensor(images.astype(np.float32) / 255.0)
+            if augment:
+                x = augment_batch(x, img_size)
+            store.add(chunk, extractor(x, training=False).numpy())
+            unsaved += len(chunk)
+            if unsaved >= save_every:
+                store.save()
+                unsaved = 0
+    store.save()
+    return len(todo)
+
+
+def make_feature_datasets(data_dir, extractor, base_name, img_size=128, batch_size=32, validation_split=0.2,
+                          aug_variants=0, cache_dir=DEFAULT_CACHE_DIR, workers=None, seed=None):
+    """Datasets tf.data de (características, one-hot) con el mismo reparto que make_datasets.
+    En entrenamiento cada imagen usa en cada época una variante al azar (0 = sin aumento).
+    Devuelve (train_ds, val_ds, class_indices, counts); counts incluye 'computed' y 'feature_s'.
+    """
+    import tensorflow as tf
+
+    workers = workers or min(8, os.cpu_count() or 1)
+    class_names, train_items, val_items = split_train_val(data_dir, validation_split)
+    num_classes = len(class_names)
+    root = os.path.join(cache_dir, f'{base_name}_{img_size}px')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        train_hashes = list(pool.map(file_hash, [p for p, _ in train_items]))
+        val_hashes = list(pool.map(file_hash, [p for p, _ in val_items]))
+
+    computed = 0
+    stores = []
+    for variant in range(aug_variants + 1):
+        store = FeatureStore(os.path.join(root, f'variant_{variant}'))
+        paths = [p for p, _ in train_items]
+        hashes = list(train_hashes)
+        if variant == 0:
+            paths += [p for p, _ in val_items]
+            hashes += val_hashes
+        computed += compute_missing(extractor, store, paths, hashes, img_size, augment=variant > 0,
+                                    batch_size=max(batch_size, 64), workers=workers)
+        stores.append(store)
+    feature_s = time.perf_counter() - started
+    logging.info('Características: %d calculadas, %.1fs (caché %s)', computed, feature_s, root)
+
+    train_x = np.stack([s.get(train_hashes) for s in stores]).astype(np.float32)   # (V, N, D)
+    train_y = np.asarray([c for _, c in train_items], dtype=np.int32)
+    val_x = stores[0].get(val_hashes).astype(np.float32)
+    val_y = np.asarray([c for _, c in val_items], dtype=np.int32)
+
+    variants = tf.constant(train_x)
+    train_ds = tf.data.Dataset.from_tensor_slices((np.arange(len(train_y)), train_y))
+    train_ds = train_ds.shuffle(len(train_y), seed=seed, reshuffle_each_iteration=True)
+
+    def pick(i, label):
+        v = tf.random.uniform([], 0, len(stores), dtype=tf.int32)
+        return variants[v, i], tf.one_hot(label, num_classes)
+
+    train_ds = train_ds.map(pick).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    val_ds = tf.data.Dataset.from_tensor_slices((val_x, tf.one_hot(val_y, num_classes))).batch(batch_size)
+
+    class_indices = {name: i for i, name in enumerate(class_names)}
+    counts = {'train': len(train_items), 'val': len(val_items), 'computed': computed,
+              'feature_s': round(feature_s, 2), 'feature_dim': int(train_x.shape[-1])}
+    return train_ds, val_ds, class_indices, counts
@@ -0,0 +1,133 @@
+"""
+compare_backends.py
+Compara precisión, latencia por imagen y memoria (RSS pico) de los artefactos
+de inferencia: garbage_model.h5 (Keras), garbage_model_fp16.tflite y
+garbage_model_int8.tflite, sobre las imágenes de dataset/.
+
+Cada artefacto se evalúa en un subproceso independiente para que la medida de
+RSS no se contamine con TensorFlow cargado por otro backend.
+
+Uso:
+    python compare_backends.py --data_dir dataset --limit 600
+    python compare_backends.py --artifacts garbage_model.h5 garbage_model_int8.tflite
+    python compare_backends.py --shards dataset_shards   # leer de los shards mmap (sin decodificar)
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+DEFAULT_ARTIFACTS = ['garbage_model.h5', 'garbage_model_fp16.tflite', 'garbage_model_int8.tflite']
+
+
+def load_class_indices(path='class_indices.json'):
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def sample_images(data_dir, limit, seed=0):
+    from inference import list_images
+    items = list_images(data_dir)
+    random.Random(seed).shuffle(items)
+    return items[:limit] if limit else items
+
+
+def peak_rss_mb():
+    # ru_maxrss está en KB en Linux (bytes en macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 / (1024.0 if sys.platform == 'darwin' else 1.0)
+
+
+def sample_shard_indices(shards, limit, seed=0):
+    indices = list(range(len(shards)))
+    random.Random(seed).shuffle(indices)
+    return indices[:limit] if limit else indices
+
+
+def evaluate(artifact, data_dir, limit, shards_dir=None):
+    """Evalúa un artefacto en este proceso y devuelve un dict de resultados."""
+    import numpy as np
+    from inference import TFLiteModel, build_inference_fn, load_image_array, warm_up
+
+    started = time.perf_counter()
+    if artifact.endswith('.tflite'):
+        predict = TFLiteModel(artifact).predict
+    else:
+        from tensorflow.keras.models import load_model
+        predict = build_inference_fn(load_model(artifact, compile=False))
+    warm_up(predict, batch_sizes=(1,), rounds=1)
+    load_s = time.perf_counter() - started
+
+    class_indices = load_class_indices()
+    correct = 0
+    latencies = []
+    if shards_dir:
+        from dataset_shards import ShardedDataset
+        shards = ShardedDataset(shards_dir)
+        items = [(i, shards.class_names[shards.labels[i]]) for i in sample_shard_indices(shards, limit)]
+    else:
+        items = sample_images(data_dir, limit)
+    for source, cls in items:
+        arr = shards.batch([source], normalize=True) if shards_dir else load_image_array(source)
+        t0 = time.perf_counter()
+        probs = predict(arr)[0]
+        latencies.append(time.perf_counter() - t0)
+        correct += int(int(np.argmax(probs)) == class_indices[cls])
+
+    latencies.sort()
+    return {
+        'artifact': artifact,
+        'size_mb': round(os.path.getsize(artifact) / 1024 / 1024, 2),
+        'images': len(items),
+        'accuracy': round(correct / len(items), 4) if items else None,
+        'load_s': round(load_s, 2),
+        'latency_ms_p50': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        'latency_ms_p95': round(latencies[int(len(latencies) * 0.95)] * 1000, 2) if latencies else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def main(args):
+    results = []
+    for artifact in args.artifacts:
+        if not os.path.exists(artifact):
+            print(f'[WARN] No existe {artifact}, se omite (python train.py --export_only para generarlo)')
+            continue
+        cmd = [sys.executable, __file__, '--worker', artifact, '--data_dir', args.data_dir, '--limit', str(args.limit)]
+        if args.shards:
+            cmd += ['--shards', args.shards]
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f'[ERROR] Falló la evaluación de {artifact}:\n{out.stderr}')
+            continue
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    cols = ['artifact', 'size_mb', 'accuracy', 'load_s', 'latency_ms_p50', 'latency_ms_p95', 'peak_rss_mb']
+    print(''.join(f'{c:>28}' if i == 0 else f'{c:>16}' for i, c in enumerate(cols)))
+    for r in results:
+        print(''.join(f'{str(r[c]):>28}' if i == 0 else f'{str(r[c]):>16}' for i, c in enumerate(cols)))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=2)
+        print('Resultados guardados en', args.output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Comparar backends de inferencia (Keras vs TFLite)')
+    parser.add_argument('--artifacts', nargs='+', default=DEFAULT_ARTIFACTS, help='Modelos a comparar')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--limit', type=int, default=600, help='Máximo de imágenes (0 = todas)')
+    parser.add_argument('--shards', type=str, default=None, help='Leer las imágenes de estos shards mmap')
+    parser.add_argument('--output', type=str, default=None, help='Guardar resultados en JSON')
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+        print(json.dumps(evaluate(args.worker, args.data_dir, args.limit, args.shards)))
+    else:
+        main(args)
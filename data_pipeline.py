@@ -0,0 +1,212 @@
+"""
+data_pipeline.py
+Pipeline de entrada tf.data para el entrenamiento (sustituye a ImageDataGenerator).
+
+- Mismo reparto entrenamiento/validación que `flow_from_directory(validation_split=...)`:
+  por clase, las primeras imágenes (orden alfabético) van a validación.
+- Lectura y decodificación en paralelo (`num_parallel_calls=AUTOTUNE`), resize
+  NEAREST a img_size como `load_img`, y caché de las imágenes ya decodificadas
+  (uint8, en memoria o en disco) para que solo la primera época lea los JPEG.
+- Aumento de datos en el grafo y por batch, equivalente a los parámetros de
+  ImageDataGenerator en AUGMENTATION: rotación, desplazamiento, cizalla y zoom
+  se combinan en una única transformación afín por imagen (interpolación
+  bilineal, relleno 'nearest') y volteo horizontal aleatorio.
+- shuffle, batch y prefetch.
+- `make_shard_datasets()` lee de los shards memory-mapped de dataset_shards.py
+  (sin decodificar JPEG; solo se copia cada batch).
+
+Uso:
+    from data_pipeline import make_datasets
+    train_ds, val_ds, class_indices, counts = make_datasets('dataset', img_size=128, batch_size=32)
+    model.fit(train_ds, validation_data=val_ds, epochs=10)
+"""
+import math
+import os
+
+from inference import list_images
+
+# Mismos parámetros que usaba train.py con ImageDataGenerator
+AUGMENTATION = {
+    'rotation_range': 20,         # grados
+    'width_shift_range': 0.1,     # fracción del ancho
+    'height_shift_range': 0.1,    # fracción del alto
+    'shear_range': 0.1,           # grados (como en Keras)
+    'zoom_range': 0.15,           # zoom en [0.85, 1.15], independiente por eje
+    'horizontal_flip': True,
+}
+
+
+def split_train_val(data_dir, validation_split=0.2):
+    """Devuelve (class_names, train_items, val_items) con items = [(ruta, índice_clase)].
+    Reproduce el reparto de `flow_from_directory(subset=...)`.
+    """
+    by_class = {}
+    for path, cls in list_images(data_dir):
+        by_class.setdefault(cls, []).append(path)
+    class_names = sorted(by_class)
+    train_items, val_items = [], []
+    for idx, cls in enumerate(class_names):
+        paths = sorted(by_class[cls])
+        n_val = int(validation_split * len(paths))
+        val_items.extend((p, idx) for p in paths[:n_val])
+        train_items.extend((p, idx) for p in paths[n_val:])
+    return class_names, train_items, val_items
+
+
+def _affine_rows(tf, a, b, c, d, e, f):
+    """Matrices 3x3 por imagen [[a,b,c],[d,e,f],[0,0,1]] a partir de vectores (B,)."""
+    zeros, ones = tf.zeros_like(a), tf.ones_like(a)
+    return tf.stack([tf.stack([a, b, c], axis=-1),
+                     tf.stack([d, e, f], axis=-1),
+                     tf.stack([zeros, zeros, ones], axis=-1)], axis=1)
+
+
+def augment_batch(images, img_size, params=None):
+    """Aumento aleatorio de un batch float32 (B,H,W,3) dentro del grafo.
+    Construye la misma matriz que `ImageDataGenerator.apply_transform`
+    (rotación @ desplazamiento @ cizalla @ zoom, centrada) en coordenadas (fila, columna).
+    Sin semilla por operación: con la misma semilla todos los parámetros saldrían correlacionados.
+    """
+    import tensorflow as tf
+
+    p = dict(AUGMENTATION, **(params or {}))
+    h = w = float(img_size)
+    batch = tf.shape(images)[0]
+    deg = math.pi / 180.0
+
+    def uniform(limit, low=None):
+        low = -limit if low is None else low
+        return tf.random.uniform([batch], low, limit)
+
+    theta = uniform(p['rotation_range']) * deg
+    tx = uniform(p['height_shift_range']) * h   # desplazamiento en filas
+    ty = uniform(p['width_shift_range']) * w    # desplazamiento en columnas
+    shear = uniform(p['shear_range']) * deg
+    zx = uniform(1.0 + p['zoom_range'], 1.0 - p['zoom_range'])
+    zy = uniform(1.0 + p['zoom_range'], 1.0 - p['zoom_range'])
+
+    zeros, ones = tf.zeros_like(theta), tf.ones_like(theta)
+    rotation = _affine_rows(tf, tf.cos(theta), -tf.sin(theta), zeros, tf.sin(theta), tf.cos(theta), zeros)
+    shift = _affine_rows(tf, ones, zeros, tx, zeros, ones, ty)
+    shearing = _affine_rows(tf, ones, -tf.sin(shear), zeros, zeros, tf.cos(shear), zeros)
+    zoom = _affine_rows(tf, zx, zeros, zeros, zeros, zy, zeros)
+    m = rotation @ shift @ shearing @ zoom
+
+    # Centrar en la imagen (transform_matrix_offset_center de Keras)
+    o_r, o_c = h / 2.0 - 0.5, w / 2.0 - 0.5
+    offset = _affine_rows(tf, ones, zeros, ones * o_r, zeros, ones, ones * o_c)
+    reset = _affine_rows(tf, ones, zeros, ones * -o_r, zeros, ones, ones * -o_c)
+    m = offset @ m @ reset
+
+    # La matriz lleva (fila, col) de salida a (fila, col) de entrada; ImageProjectiveTransform
+    # usa (x=col, y=fila): x_in = a0*x + a1*y + a2 ; y_in = b0*x + b1*y + b2
+    transforms = tf.stack([m[:, 1, 1], m[:, 1, 0], m[:, 1, 2],
+                           m[:, 0, 1], m[:, 0, 0], m[:, 0, 2],
+                           zeros, zeros], axis=-1)
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=tf.constant([img_size, img_size], tf.int32),
+        fill_value=0.0, interpolation='BILINEAR', fill_mode='NEAREST')
+
+    if p['horizontal_flip']:
+        flip = tf.random.uniform([batch, 1, 1, 1]) < 0.5
+        images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    return images
+
+
+def build_dataset(items, num_classes, img_size=128, batch_size=32, training=False, augment=True,
+                  cache='memory', cache_path=None, seed=None):
+    """tf.data.Dataset de (imágenes float32 [0,1], etiquetas one-hot) a partir de [(ruta, clase)].
+    cache: 'memory', 'disk' (en `cache_path`) o 'none'.
+    """
+    import tensorflow as tf
+
+    autotune = tf.data.AUTOTUNE
+    paths = [p for p, _ in items]
+    labels = [c for _, c in items]
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+
+    def load(path, label):
+        img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        img = tf.image.resize(img, [img_size, img_size], method='nearest')  # conserva uint8
+        img.set_shape([img_size, img_size, 3])
+        return img, label
+
+    ds = ds.map(load, num_parallel_calls=autotune, deterministic=not training)
+    if cache == 'memory':
+        ds = ds.cache()
+    elif cache == 'disk':
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        ds = ds.cache(cache_path)
+
+    if training:
+        ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+
+    def finish(images, label):
+        images = tf.cast(images, tf.float32) / 255.0
+        if training and augment:
+            images = augment_batch(images, img_size)
+        return images, tf.one_hot(label, num_classes)
+
+    ds = ds.map(finish, num_parallel_calls=autotune, deterministic=not training)
+    return ds.prefetch(autotune)
+
+
+def build_shard_dataset(shards, indices, batch_size=32, training=False, augment=True, seed=None):
+    """Igual que build_dataset pero leyendo batches uint8 de un ShardedDataset (mmap)."""
+    import numpy as np
+    import tensorflow as tf
+
+    autotune = tf.data.AUTOTUNE
+    img_size = shards.img_size
+    ds = tf.data.Dataset.from_tensor_slices(np.asarray(indices, dtype=np.int64))
+    if training:
+        ds = ds.shuffle(len(indices), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+
+    def gather(idx):
+        return shards.batch(idx), np.asarray(shards.labels[idx], dtype=np.int32)
+
+    def load(idx):
+        images, labels = tf.numpy_function(gather, [idx], [tf.uint8, tf.int32])
+        images.set_shape([None, img_size, img_size, 3])
+        labels.set_shape([None])
+        return images, labels
+
+    def finish(images, label):
+        images = tf.cast(images, tf.float32) / 255.0
+        if training and augment:
+            images = augment_batch(images, img_size)
+        return images, tf.one_hot(label, shards.num_classes)
+
+    ds = ds.map(load, num_parallel_calls=autotune, deterministic=not training)
+    ds = ds.map(finish, num_parallel_calls=autotune, deterministic=not training)
+    return ds.prefetch(autotune)
+
+
+def make_shard_datasets(shards_dir, batch_size=32, validation_split=0.2, augment=True, seed=None):
+    """Como make_datasets pero desde los shards (python dataset_shards.py para generarlos)."""
+    from dataset_shards import ShardedDataset
+
+    shards = ShardedDataset(shards_dir)
+    train_idx, val_idx = shards.split(validation_split)
+    train_ds = build_shard_dataset(shards, train_idx, batch_size, training=True, augment=augment, seed=seed)
+    val_ds = build_shard_dataset(shards, val_idx, batch_size, training=False, seed=seed)
+    class_indices = {name: i for i, name in enumerate(shards.class_names)}
+    return train_ds, val_ds, class_indices, {'train': len(train_idx), 'val': len(val_idx)}
+
+
+def make_datasets(data_dir, img_size=128, batch_size=32, validation_split=0.2, augment=True,
+                  cache='memory', cache_dir='.tfdata_cache', seed=None):
+    """Datasets de entrenamiento y validación (sin aumento en validación).
+    Devuelve (train_ds, val_ds, class_indices, {'train': n, 'val': n}).
+    """
+    class_names, train_items, val_items = split_train_val(data_dir, validation_split)
+    num_classes = len(class_names)
+    suffix = f'{img_size}px'
+    train_ds = build_dataset(train_items, num_classes, img_size, batch_size, training=True, augment=augment,
+                             cache=cache, cache_path=os.path.join(cache_dir, f'train_{suffix}'), seed=seed)
+    val_ds = build_dataset(val_items, num_classes, img_size, batch_size, training=False,
+                           cache=cache, cache_path=os.path.join(cache_dir, f'val_{suffix}'), seed=seed)
+    class_indices = {name: i for i, name in enumerate(class_names)}
+    return train_ds, val_ds, class_indices, {'train': len(train_items), 'val': len(val_items)}
@@ -0,0 +1,275 @@
+"""
+dataset_shards.py
+Dataset preprocesado en shards uint8 (N,128,128,3) memory-mapped.
+
+Convierte `dataset/<clase>/*.jpg` una sola vez (mismo preprocesado que
+`load_img`: RGB + resize NEAREST) y guarda:
+
+    dataset_shards/
+        shard_00000.npy ...   uint8 (filas, img, img, 3), se abren con mmap
+        labels.npy            int16 (N,)   etiqueta de cada imagen
+        locations.npy         int32 (N,2)  (shard, fila) de cada imagen
+        index.json            img_size, clases, shards y ficheros de origen
+                              (ruta relativa, tamaño, mtime) en orden alfabético
+
+La actualización es incremental: solo se decodifican los ficheros nuevos o
+modificados (p.ej. los añadidos por /collect) y se escriben en el shard final
+o en shards nuevos; los borrados dejan de indexarse (`--rebuild` compacta).
+
+`ShardedDataset` lee directamente del mmap: `image(i)` es una vista sin copia
+y `batch(indices)` solo copia el batch pedido, así que la memoria no crece con
+el tamaño del dataset.
+
+Uso:
+    python dataset_shards.py --data_dir dataset --out dataset_shards
+    python dataset_shards.py --rebuild --shard_size 2048 --workers 8
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import IMG_SIZE, list_images, load_image_uint8
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+DEFAULT_SHARDS_DIR = 'dataset_shards'
+INDEX_FILE = 'index.json'
+FORMAT_VERSION = 1
+
+
+@contextlib.contextmanager
+def _update_lock(out_dir):
+    """Bloqueo exclusivo entre procesos (workers de gunicorn, CLI) durante una actualización."""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, '.lock'), 'w') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _shard_path(out_dir, shard_id):
+    return os.path.join(out_dir, f'shard_{shard_id:05d}.npy')
+
+
+def _save_atomic(path, array):
+    # os.replace mantiene válidos los mmaps abiertos sobre el fichero anterior
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        np.save(fh, array, allow_pickle=False)
+    os.replace(tmp, path)
+
+
+def _load_index(out_dir):
+    path = os.path.join(out_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def _write_index(out_dir, index, entries):
+    """Guarda index.json + labels.npy + locations.npy (entradas ordenadas por ruta)."""
+    entries.sort(key=lambda e: e[0])
+    index['entries'] = entries
+    index['count'] = len(entries)
+    index['dead_rows'] = sum(s['rows'] for s in index['shards']) - len(entries)
+    _save_atomic(os.path.join(out_dir, 'labels.npy'), np.asarray([e[1] for e in entries], dtype=np.int16))
+    _save_atomic(os.path.join(out_dir, 'locations.npy'),
+                 np.asarray([(e[2], e[3]) for e in entries], dtype=np.int32).reshape(-1, 2))
+    tmp = os.path.join(out_dir, INDEX_FILE + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(index, fh)
+    os.replace(tmp, os.path.join(out_dir, INDEX_FILE))
+
+
+def _decode_all(paths, img_size, workers):
+    """Decodifica en paralelo (PIL libera el GIL). Devuelve [(array|None, error)]."""
+    def decode(path):
+        try:
+            return load_image_uint8(path, img_size), None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(decode, paths))
+
+
+def update_shards(data_dir, out_dir=DEFAULT_SHARDS_DIR, img_size=IMG_SIZE, shard_size=1024,
+                  workers=None, rebuild=False):
+    """Sincroniza los shards con data_dir decodificando solo lo nuevo. Devuelve estadísticas."""
+    started = time.perf_counter()
+    workers = workers or min(8, os.cpu_count() or 1)
+    with _update_lock(out_dir):
+        index = None if rebuild else _load_index(out_dir)
+        if index is not None and (index.get('version') != FORMAT_VERSION or index.get('img_size') != img_size):
+            logging.info('Shards con otro formato/tamaño; se reconstruyen')
+            index = None
+        if index is None:
+            for name in os.listdir(out_dir):
+                if name.startswith('shard_') and name.endswith('.npy'):
+                    os.remove(os.path.join(out_dir, name))
+            index = {'version': FORMAT_VERSION, 'img_size': img_size, 'shard_size': shard_size,
+                     'class_names': [], 'shards': [], 'entries': []}
+        shard_size = index['shard_size']
+
+        # Entradas: [ruta_relativa, etiqueta, shard, fila, tamaño, mtime_ns]
+        known = {e[0]: e for e in index['entries']}
+        entries, pending, changed = [], [], 0
+        seen = set()
+        for path, cls in list_images(data_dir):
+            rel = os.path.relpath(path, data_dir).replace(os.sep, '/')
+            seen.add(rel)
+            st = os.stat(path)
+            entry = known.get(rel)
+            if entry is not None and entry[4] == st.st_size and entry[5] == st.st_mtime_ns:
+                entries.append(entry)
+                continue
+            changed += entry is not None
+            if cls not in index['class_names']:
+                # Clases nuevas al final: no cambian las etiquetas ya guardadas
+                index['class_names'].append(cls)
+            pending.append((rel, path, index['class_names'].index(cls), st.st_size, st.st_mtime_ns))
+        removed = sum(1 for rel in known if rel not in seen)
+        added = len(pending)
+
+        # Completar el último shard (reescribiéndolo) y crear shards nuevos para el resto.
+        # Se decodifica shard a shard: la memoria usada es la de un shard, no la del dataset.
+        failed = []
+        while pending:
+            shards = index['shards']
+            if shards and shards[-1]['rows'] < shard_size:
+                shard_id = len(shards) - 1
+                existing = np.load(_shard_path(out_dir, shard_id), mmap_mode='r')
+                start = shards[-1]['rows']
+            else:
+                shard_id = len(shards)
+                shards.append({'file': os.path.basename(_shard_path(out_dir, shard_id)), 'rows': 0})
+                existing, start = None, 0
+            chunk, pending = pending[:shard_size - start], pending[shard_size - start:]
+            take = []
+            for item, (array, error) in zip(chunk, _decode_all([p for _, p, _, _, _ in chunk], img_size, workers)):
+                if error is not None:
+                    logging.warning('No se pudo decodificar %s: %s', item[1], error)
+                    failed.append(item[0])
+                else:
+                    take.append((item, array))
+            if not take:
+                if existing is None:
+                    shards.pop()
+                continue
+            block = np.stack([array for _, array in take])
+            if existing is not None:
+                block = np.concatenate([existing, block])
+            _save_atomic(_shard_path(out_dir, shard_id), block)
+            del existing
+            shards[-1]['rows'] = len(block)
+            for row, ((rel, _, label, size, mtime), _) in enumerate(take, start=start):
+                entries.append([rel, label, shard_id, row, size, mtime])
+
+        _write_index(out_dir, index, entries)
+
+    stats = {
+        'images': len(entries),
+        'added': added - changed - len(failed),
+        'changed': changed,
+        'removed': removed,
+        'failed': len(failed),
+        'shards': len(index['shards']),
+        'dead_rows': index['dead_rows'],
+        'bytes': sum(os.path.getsize(os.path.join(out_dir, s['file'])) for s in index['shards']),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    logging.info('Shards actualizados en %s: %s', out_dir, stats)
+    return stats
+
+
+class ShardedDataset:
+    """Lectura del dataset preprocesado directamente desde los shards memory-mapped."""
+
+    def __init__(self, out_dir=DEFAULT_SHARDS_DIR):
+        index = _load_index(out_dir)
+        if index is None:
+            raise FileNotFoundError(f'No hay shards en {out_dir} (python dataset_shards.py --out {out_dir})')
+        self.out_dir = out_dir
+        self.img_size = index['img_size']
+        self.class_names = index['class_names']
+        self.paths = [e[0] for e in index['entries']]
+        self.labels = np.load(os.path.join(out_dir, 'labels.npy'), mmap_mode='r')
+        self.locations = np.load(os.path.join(out_dir, 'locations.npy'))
+        self._shards = [np.load(os.path.join(out_dir, s['file']), mmap_mode='r') for s in index['shards']]
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def num_classes(self):
+        return len(self.class_names)
+
+    def image(self, i):
+        """Vista uint8 (img,img,3) sobre el mmap (sin copia)."""
+        shard, row = self.locations[i]
+        return self._shards[shard][row]
+
+    def batch(self, indices, normalize=False):
+        """Copia solo las filas pedidas: uint8 (N,img,img,3) o float32 [0,1] con normalize=True."""
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((len(indices), self.img_size, self.img_size, 3), dtype=np.uint8)
+        locations = self.locations[indices]
+        for shard in np.unique(locations[:, 0]):
+            mask = locations[:, 0] == shard
+            out[mask] = self._shards[shard][locations[mask, 1]]
+        if normalize:
+            return out.astype(np.float32) / 255.0
+        return out
+
+    def iter_batches(self, batch_size=64, indices=None, normalize=True):
+        """Itera (imágenes, etiquetas, índices) en orden; la memoria es la de un batch."""
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        for start in range(0, len(indices), batch_size):
+            idx = indices[start:start + batch_size]
+            yield self.batch(idx, normalize=normalize), np.asarray(self.labels[idx]), idx
+
+    def split(self, validation_split=0.2):
+        """(train_idx, val_idx) con el reparto de flow_from_directory: por clase, los primeros
+        ficheros en orden alfabético van a validación."""
+        train_idx, val_idx = [], []
+        for label in range(self.num_classes):
+            members = [i for i in np.flatnonzero(np.asarray(self.labels) == label)]
+            members.sort(key=lambda i: self.paths[i])
+            n_val = int(validation_split * len(members))
+            val_idx.extend(members[:n_val])
+            train_idx.extend(members[n_val:])
+        return np.asarray(train_idx, dtype=np.int64), np.asarray(val_idx, dtype=np.int64)
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    stats = update_shards(args.data_dir, args.out, img_size=args.img_size, shard_size=args.shard_size,
+                          workers=args.workers, rebuild=args.rebuild)
+    print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Construir/actualizar los shards memory-mapped del dataset')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--out', type=str, default=DEFAULT_SHARDS_DIR, help='Carpeta de salida de los shards')
+    parser.add_argument('--img_size', type=int, default=IMG_SIZE, help='Tamaño de imagen (px)')
+    parser.add_argument('--shard_size', type=int, default=1024, help='Imágenes por shard')
+    parser.add_argument('--workers', type=int, default=None, help='Hilos de decodificación')
+    parser.add_argument('--rebuild', action='store_true', help='Reconstruir desde cero (compacta filas borradas)')
+    args = parser.parse_args()
+
+    main(args)
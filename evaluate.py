@@ -0,0 +1,233 @@
+"""
+evaluate.py
+Evaluación offline de todo un dataset (carpeta con subcarpetas por clase) con
+el modelo guardado o con la heurística de respaldo (fallback.py).
+
+- Decodificación en paralelo (pool de hilos; PIL libera el GIL) con unos
+  batches decodificados por delante mientras el modelo procesa el actual.
+- Inferencia por batches con `build_inference_fn` (Keras) o `TFLiteModel`.
+- Informe: accuracy, precisión/recall/F1 por clase, matriz de confusión (en el
+  orden de class_indices.json) e imágenes/segundo (total y solo inferencia).
+- `--mode fallback` puntúa la heurística igual que la ven los usuarios cuando
+  el modelo no está cargado (decodificación draft + reglas de fallback.py).
+
+Uso:
+    python evaluate.py --data_dir dataset --model garbage_model.h5
+    python evaluate.py --mode fallback --output eval_fallback.json
+    python evaluate.py --model garbage_model_int8.tflite --limit 500
+    python evaluate.py --shards dataset_shards   # imágenes ya decodificadas (dataset_shards.py)
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import IMG_SIZE, list_images, load_image_uint8
+
+
+def load_class_indices(path='class_indices.json'):
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def load_predictor(model_path):
+    """Devuelve predict(batch float32) -> probabilidades (N, clases)."""
+    from inference import TFLiteModel, build_inference_fn, warm_up
+
+    if model_path.endswith('.tflite'):
+        return TFLiteModel(model_path).predict
+    from tensorflow.keras.models import load_model
+    predict = build_inference_fn(load_model(model_path, compile=False))
+    warm_up(predict)
+    return predict
+
+
+def iter_decoded(items, batch_size, decode, workers, prefetch=2):
+    """Itera (items_del_batch, resultados) decodificando en paralelo con `prefetch` batches por delante.
+    Cada resultado es el valor de `decode(ruta)` o None si falló.
+    """
+    def safe(path):
+        try:
+            return decode(path)
+        except Exception as e:
+            print(f'[WARN] No se pudo decodificar {path}: {e}')
+            return None
+
+    chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        in_flight = collections.deque()
+        for chunk in chunks:
+            in_flight.append((chunk, [pool.submit(safe, path) for path, _ in chunk]))
+            if len(in_flight) > prefetch:
+                done, futures = in_flight.popleft()
+                yield done, [f.result() for f in futures]
+        while in_flight:
+            done, futures = in_flight.popleft()
+            yield done, [f.result() for f in futures]
+
+
+def iter_shard_batches(shards, indices, batch_size):
+    """Como iter_decoded pero leyendo del mmap (no hay decodificación)."""
+    for start in range(0, len(indices), batch_size):
+        idx = indices[start:start + batch_size]
+        images = shards.batch(idx)
+        yield [(i, shards.class_names[shards.labels[i]]) for i in idx], list(images)
+
+
+def classification_report(y_true, y_pred, class_names):
+    """Accuracy, métricas por clase y matriz de confusión (filas = real, columnas = predicción)."""
+    n = len(class_names)
+    matrix = np.zeros((n, n), dtype=np.int64)
+    np.add.at(matrix, (np.asarray(y_true, dtype=np.int64), np.asarray(y_pred, dtype=np.int64)), 1)
+    tp = np.diag(matrix).astype(np.float64)
+    predicted = matrix.sum(axis=0)
+    support = matrix.sum(axis=1)
+    precision = np.divide(tp, predicted, out=np.zeros(n), where=predicted > 0)
+    recall = np.divide(tp, support, out=np.zeros(n), where=support > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(n), where=(precision + recall) > 0)
+    per_class = {
+        name: {'precision': round(float(precision[i]), 4), 'recall': round(float(recall[i]), 4),
+               'f1': round(float(f1[i]), 4), 'support': int(support[i]), 'predicted': int(predicted[i])}
+        for i, name in enumerate(class_names)
+    }
+    present = support > 0
+    return {
+        'accuracy': round(float(tp.sum() / max(1, matrix.sum())), 4),
+        'macro_precision': round(float(precision[present].mean()), 4) if present.any() else 0.0,
+        'macro_recall': round(float(recall[present].mean()), 4) if present.any() else 0.0,
+        'macro_f1': round(float(f1[present].mean()), 4) if present.any() else 0.0,
+        'per_class': per_class,
+        'confusion_matrix': matrix.tolist(),
+    }
+
+
+def evaluate(args):
+    class_indices = load_class_indices(args.class_indices)
+    class_names = [name for name, _ in sorted(class_indices.items(), key=lambda kv: kv[1])]
+
+    shards = None
+    if args.shards:
+        from dataset_shards import ShardedDataset
+        shards = ShardedDataset(args.shards)
+        if shards.img_size != args.img_size:
+            raise SystemExit(f'Los shards son de {shards.img_size}px (--img_size {args.img_size})')
+        items = [(i, shards.class_names[shards.labels[i]]) for i in range(len(shards))]
+    else:
+        items = list_images(args.data_dir)
+    if args.limit:
+        random.Random(0).shuffle(items)
+        items = items[:args.limit]
+
+    # Solo se puntúan las clases que conoce el modelo (class_indices.json)
+    unknown = collections.Counter(cls for _, cls in items if cls not in class_indices)
+    items = [(source, cls) for source, cls in items if cls in class_indices]
+    if unknown:
+        print(f'[WARN] Se ignoran clases que no están en {args.class_indices}: {dict(unknown)}')
+    if not items:
+        raise SystemExit('No hay imágenes que evaluar')
+
+    load_s = 0.0
+    if args.mode == 'model':
+        started = time.perf_counter()
+        predict = load_predictor(args.model)
+        load_s = time.perf_counter() - started
+        decode = lambda path: load_image_uint8(path, args.img_size)  # noqa: E731
+    else:
+        from fallback import channel_means, classify_means
+        decode = channel_means
+
+    y_true, y_pred, failed = [], [], 0
+    infer_s = 0.0
+    started = time.perf_counter()
+    if shards is not None:
+        batches = iter_shard_batches(shards, [source for source, _ in items], args.batch_size)
+    else:
+        batches = iter_decoded(items, args.batch_size, decode, args.workers)
+    for chunk, decoded in batches:
+        good = [(cls, value) for (_, cls), value in zip(chunk, decoded) if value is not None]
+        failed += len(chunk) - len(good)
+        if not good:
+            continue
+        t0 = time.perf_counter()
+        if args.mode == 'model':
+            probs = predict(np.stack([value for _, value in good]).astype(np.float32) / 255.0)
+            labels = np.argmax(probs, axis=1).tolist()
+        else:
+            labels = [class_indices[label] for label, _ in classify_means([value for _, value in good])]
+        infer_s += time.perf_counter() - t0
+        y_true.extend(class_indices[cls] for cls, _ in good)
+        y_pred.extend(labels)
+    wall_s = time.perf_counter() - started
+
+    report = classification_report(y_true, y_pred, class_names)
+    report.update({
+        'mode': args.mode,
+        'model': args.model if args.mode == 'model' else 'fallback.py',
+        'source': args.shards or args.data_dir,
+        'class_names': class_names,
+        'images': len(y_true),
+        'failed': failed,
+        'batch_size': args.batch_size,
+        'workers': args.workers,
+        'load_s': round(load_s, 3),
+        'wall_s': round(wall_s, 3),
+        'images_per_s': round(len(y_true) / wall_s, 1) if wall_s else 0.0,
+        'inference_images_per_s': round(len(y_true) / infer_s, 1) if infer_s else 0.0,
+    })
+    return report
+
+
+def print_report(report):
+    names = report['class_names']
+    print(f'\nModo: {report["mode"]} ({report["model"]})  Imágenes: {report["images"]}'
+          f'  Fallidas: {report["failed"]}')
+    print(f'Accuracy: {report["accuracy"] * 100:.2f}%  Macro P/R/F1: {report["macro_precision"]:.3f} / '
+          f'{report["macro_recall"]:.3f} / {report["macro_f1"]:.3f}')
+    print(f'Throughput: {report["images_per_s"]} img/s total, {report["inference_images_per_s"]} img/s '
+          f'inferencia (batch={report["batch_size"]}, workers={report["workers"]}, carga={report["load_s"]}s)')
+
+    print(f'\n{"clase":<12}{"precision":>10}{"recall":>10}{"f1":>8}{"soporte":>9}')
+    for name in names:
+        m = report['per_class'][name]
+        print(f'{name:<12}{m["precision"]:>10.3f}{m["recall"]:>10.3f}{m["f1"]:>8.3f}{m["support"]:>9}')
+
+    width = max(6, max(len(n) for n in names) + 1)
+    print('\nMatriz de confusión (filas = real, columnas = predicción)')
+    print(' ' * 12 + ''.join(f'{n[:width - 1]:>{width}}' for n in names))
+    for name, row in zip(names, report['confusion_matrix']):
+        print(f'{name:<12}' + ''.join(f'{v:>{width}}' for v in row))
+
+
+def main(args):
+    report = evaluate(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+        print(f'\nResultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluación offline (modelo o heurística) con métricas por clase')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--model', type=str, default='garbage_model.h5', help='Modelo .h5/.keras o .tflite')
+    parser.add_argument('--mode', choices=['model', 'fallback'], default='model',
+                        help='Puntuar el modelo o la heurística de respaldo')
+    parser.add_argument('--class_indices', type=str, default='class_indices.json', help='Mapa clase -> índice')
+    parser.add_argument('--batch_size', type=int, default=64, help='Imágenes por batch de inferencia')
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1), help='Hilos de decodificación')
+    parser.add_argument('--img_size', type=int, default=IMG_SIZE, help='Tamaño de entrada del modelo (px)')
+    parser.add_argument('--limit', type=int, default=0, help='Máximo de imágenes, muestreo aleatorio (0 = todas)')
+    parser.add_argument('--shards', type=str, default=None,
+                        help='Leer las imágenes de estos shards mmap (solo --mode model)')
+    parser.add_argument('--output', type=str, default=None, help='Guardar el informe en JSON')
+    args = parser.parse_args()
+    if args.shards and args.mode == 'fallback':
+        parser.error('--shards solo aplica a --mode model (la heurística usa su propia decodificación draft)')
+
+    main(args)
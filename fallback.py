@@ -0,0 +1,122 @@
+"""
+fallback.py
+Clasificador heurístico de respaldo (cuando el modelo no está cargado).
+
+Única implementación usada por `/predict` y `/predict.json`. Calcula las medias
+por canal con `PIL.ImageStat` (en C) sobre una decodificación de resolución
+reducida (JPEG draft mode) y aplica las reglas de brillo/color de forma
+vectorizada con NumPy, también para varias imágenes en una sola llamada.
+
+Reglas (en orden, la primera que se cumple gana):
+    brillo < 60                                   -> trash     45%
+    saturación < 0.15 y brillo > 200              -> paper     65%
+    verde dominante y G > 110                     -> glass     60%
+    rojo dominante y R > 130                      -> metal     55%
+    brillo > 120 y saturación > 0.25              -> plastic   58%
+    en otro caso                                  -> cardboard 50%
+donde brillo = luminancia Rec.709 de las medias y saturación = S de HSV.
+"""
+import logging
+
+from PIL import Image as PILImage, ImageStat
+
+# NumPy se importa en el primer uso para no penalizar el arranque de app.py;
+# el fallback debe funcionar incluso sin NumPy (reglas en Python puro).
+_np = None
+
+FALLBACK_SIZE = (64, 64)
+ERROR_RESULT = ('trash', 40.0)
+
+_RULE_LABELS = ('trash', 'paper', 'glass', 'metal', 'plastic')
+_RULE_CONFIDENCES = (45.0, 65.0, 60.0, 55.0, 58.0)
+_DEFAULT_RESULT = ('cardboard', 50.0)
+
+
+def _numpy():
+    global _np
+    if _np is None:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = False
+    return _np or None
+
+
+def channel_means(source, size=FALLBACK_SIZE, draft=True):
+    """Medias (R, G, B) de una imagen (ruta o file-like) reducida a `size`.
+    Con `draft=True` el decodificador JPEG escala por 1/2, 1/4 o 1/8 al decodificar.
+    """
+    with PILImage.open(source) as im:
+        if draft:
+            im.draft('RGB', (size[0] * 2, size[1] * 2))
+        im = im.convert('RGB').resize(size)
+        return tuple(ImageStat.Stat(im).mean)
+
+
+def classify_rgb(r_mean, g_mean, b_mean):
+    """Reglas heurísticas para una sola imagen (implementación de referencia)."""
+    brightness = 0.2126 * r_mean + 0.7152 * g_mean + 0.0722 * b_mean
+    max_c, min_c = max(r_mean, g_mean, b_mean), min(r_mean, g_mean, b_mean)
+    s = (max_c - min_c) / max_c if max_c > 0 else 0.0
+
+    if brightness < 60:
+        return 'trash', 45.0
+    if s < 0.15 and brightness > 200:
+        return 'paper', 65.0
+    if g_mean >= r_mean and g_mean >= b_mean and g_mean > 110:
+        return 'glass', 60.0
+    if r_mean > g_mean and r_mean > b_mean and r_mean > 130:
+        return 'metal', 55.0
+    if brightness > 120 and s > 0.25:
+        return 'plastic', 58.0
+    return _DEFAULT_RESULT
+
+
+def classify_means(means):
+    """Aplica las reglas a una matriz (N,3) de medias RGB. Devuelve lista de (label, confidence)."""
+    np = _numpy()
+    if np is None:
+        return [classify_rgb(*m) for m in means]
+    means = np.asarray(means, dtype=np.float64).reshape(-1, 3)
+    r, g, b = means[:, 0], means[:, 1], means[:, 2]
+    brightness = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    max_c, min_c = means.max(axis=1), means.min(axis=1)
+    s = np.divide(max_c - min_c, max_c, out=np.zeros_like(max_c), where=max_c > 0)
+
+    conditions = [
+        brightness < 60,
+        (s < 0.15) & (brightness > 200),
+        (g >= r) & (g >= b) & (g > 110),
+        (r > g) & (r > b) & (r > 130),
+        (brightness > 120) & (s > 0.25),
+    ]
+    rule = np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+    results = []
+    for idx in rule.tolist():
+        if idx < len(_RULE_LABELS):
+            results.append((_RULE_LABELS[idx], _RULE_CONFIDENCES[idx]))
+        else:
+            results.append(_DEFAULT_RESULT)
+    return results
+
+
+def heuristic_predict(source, draft=True):
+    """Predicción heurística de una imagen. Devuelve (label, confidence); lanza si no se puede decodificar."""
+    return classify_means([channel_means(source, draft=draft)])[0]
+
+
+def heuristic_predict_batch(sources, draft=True):
+    """Predicción heurística de varias imágenes en una llamada.
+    Las imágenes que no se pueden decodificar devuelven ERROR_RESULT.
+    """
+    means, ok = [], []
+    for source in sources:
+        try:
+            means.append(channel_means(source, draft=draft))
+            ok.append(True)
+        except Exception as e:
+            logging.warning('Heuristic predict failed for %s: %s', source, e)
+            ok.append(False)
+    classified = iter(classify_means(means)) if means else iter(())
+    return [next(classified) if good else ERROR_RESULT for good in ok]
@@ -0,0 +1,474 @@
+"""
+finetune.py
+Cola de fine-tuning incremental alimentada por /collect.
+
+- `FinetuneQueue` (SQLite en WAL, compartido por los workers de gunicorn)
+  registra cada imagen recolectada como muestra pendiente, y los trabajos con
+  su estado, duración y accuracy antes/después.
+- `FinetuneScheduler` comprueba cada `interval` segundos si hay al menos
+  `min_samples` pendientes. En ese caso reclama las muestras de forma atómica
+  (solo un worker gana) y lanza el entrenamiento en un PROCESO aparte
+  (`python finetune.py --job_id N`, con nice), así que TensorFlow y el
+  entrenamiento no compiten con los hilos de las peticiones.
+- El trabajo ajusta solo la cabeza densa del modelo actual. Usa las muestras
+  nuevas más una muestra de repaso (replay) de las antiguas, sobre
+  características cacheadas (bottleneck_features.py). Valida en la partición
+  de validación, y solo publica si la accuracy no baja más de `max_drop`: el
+  nuevo garbage_model.h5 se escribe con un reemplazo atómico y se guarda una
+  copia del anterior. El watcher del registro de modelos de cada worker
+  recoge el fichero nuevo.
+
+Uso:
+    python finetune.py --run              # reclamar lo pendiente y entrenar ahora en este proceso
+    python finetune.py --status           # (por defecto) muestras pendientes y últimos trabajos
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS samples (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT NOT NULL,
+        label TEXT NOT NULL,
+        added_at REAL NOT NULL,
+        job_id INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS samples_job ON samples (job_id);
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL,
+        reason TEXT,
+        samples INTEGER NOT NULL,
+        replay INTEGER,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        duration_s REAL,
+        pid INTEGER,
+        baseline_acc REAL,
+        new_acc REAL,
+        delta REAL,
+        published INTEGER NOT NULL DEFAULT 0,
+        model_path TEXT,
+        backup_path TEXT,
+        log_path TEXT,
+        message TEXT
+    );
+'''
+
+ACTIVE_STATUSES = ('queued', 'running')
+# Un trabajo reclamado que no arranca en este tiempo se considera abandonado
+QUEUED_TIMEOUT_S = 120
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FinetuneQueue:
+    """Muestras recolectadas y trabajos de fine-tuning en SQLite (una conexión por operación)."""
+
+    def __init__(self, db_path, busy_timeout_ms=5000):
+        self.db_path = str(db_path)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {self.busy_timeout_ms}')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def init_schema(self):
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def record_sample(self, path, label):
+        """Registra una imagen nueva (ruta relativa a dataset/) como pendiente de incorporar."""
+        conn = self._connect()
+        try:
+            conn.execute('INSERT INTO samples (path, label, added_at) VALUES (?, ?, ?)', (path, label, time.time()))
+        finally:
+            conn.close()
+
+    def pending(self):
+        """{clase: n} de muestras todavía no asignadas a un trabajo."""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT label, COUNT(*) AS n FROM samples WHERE job_id IS NULL GROUP BY label')
+            return {r['label']: r['n'] for r in rows}
+        finally:
+            conn.close()
+
+    def _recover_stale(self, conn):
+        """Marca como fallidos los trabajos cuyo proceso ya no existe y libera sus muestras."""
+        now = time.time()
+        for row in conn.execute(f'SELECT id, status, pid, created_at FROM jobs WHERE status IN {ACTIVE_STATUSES}'):
+            if row['pid'] is not None:
+                stale = not _pid_alive(row['pid'])
+            else:
+                stale = now - row['created_at'] > QUEUED_TIMEOUT_S
+            if stale:
+                conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, message = ? WHERE id = ?",
+                             (now, 'El proceso del trabajo terminó sin registrar el resultado', row['id']))
+                conn.execute('UPDATE samples SET job_id = NULL WHERE job_id = ?', (row['id'],))
+
+    def claim(self, min_samples=1, reason='auto'):
+        """Crea un trabajo con todas las muestras pendientes si hay al menos `min_samples`
+        y no hay otro en curso. Atómico entre procesos. Devuelve job_id o None.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._recover_stale(conn)
+                active = conn.execute(f'SELECT COUNT(*) FROM jobs WHERE status IN {ACTIVE_STATUSES}').fetchone()[0]
+                pending = conn.execute('SELECT COUNT(*) FROM samples WHERE job_id IS NULL').fetchone()[0]
+                if active or pending < max(1, min_samples):
+                    conn.execute('COMMIT')
+                    return None
+                cur = conn.execute("INSERT INTO jobs (status, reason, samples, created_at) VALUES ('queued', ?, ?, ?)",
+                                   (reason, pending, time.time()))
+                job_id = cur.lastrowid
+                conn.execute('UPDATE samples SET job_id = ? WHERE job_id IS NULL', (job_id,))
+                conn.execute('COMMIT')
+                return job_id
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def job_samples(self, job_id):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT path, label FROM samples WHERE job_id = ? ORDER BY id', (job_id,))
+            return [(r['path'], r['label']) for r in rows]
+        finally:
+            conn.close()
+
+    def update_job(self, job_id, **fields):
+        if not fields:
+            return
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        conn = self._connect()
+        try:
+            conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', list(fields.values()) + [job_id])
+        finally:
+            conn.close()
+
+    def finish_job(self, job_id, status, release_samples=False, **fields):
+        """Cierra el trabajo; con release_samples las muestras vuelven a pendientes (p.ej. si falló)."""
+        fields.update(status=status, finished_at=time.time())
+        self.update_job(job_id, **fields)
+        if release_samples:
+            conn = self._connect()
+            try:
+                conn.execute('UPDATE samples SET job_id = NULL WHERE job_id = ?', (job_id,))
+            finally:
+                conn.close()
+
+    def job(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def jobs(self, limit=20):
+        conn = self._connect()
+        try:
+            return [dict(r) for r in conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,))]
+        finally:
+            conn.close()
+
+    def status(self, limit=20):
+        pending = self.pending()
+        return {'pending': sum(pending.values()), 'pending_by_class': pending, 'jobs': self.jobs(limit)}
+
+
+# ---------- lanzamiento desde la app ----------
+class FinetuneScheduler:
+    """Hilo (uno por proceso) que lanza trabajos cuando hay suficientes muestras pendientes."""
+
+    def __init__(self, queue, interval=900.0, min_samples=20, job_args=(), log_dir='finetune_logs', nice=10):
+        self.queue = queue
+        self.interval = interval
+        self.min_samples = min_samples
+        self.job_args = list(job_args)
+        self.log_dir = log_dir
+        self.nice = nice
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Inicia el hilo periódico (idempotente por proceso; interval <= 0 lo desactiva)."""
+        if self.interval <= 0:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name='finetune-scheduler', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.trigger('auto', self.min_samples)
+            except Exception as e:
+                logging.warning('Planificador de fine-tuning: %s', e)
+
+    def trigger(self, reason='manual', min_samples=1):
+        """Reclama las muestras pendientes y lanza el proceso de entrenamiento. Devuelve job_id o None."""
+        job_id = self.queue.claim(min_samples=min_samples, reason=reason)
+        if job_id is None:
+            return None
+        os.makedirs(self.log_dir, exist_ok=True)
+        log_path = os.path.join(self.log_dir, f'job_{job_id}.log')
+        cmd = [sys.executable, os.path.join(APP_DIR, 'finetune.py'), '--job_id', str(job_id),
+               '--db', self.queue.db_path] + self.job_args
+        try:
+            with open(log_path, 'ab') as log:
+                proc = subprocess.Popen(cmd, cwd=APP_DIR, stdout=log, stderr=subprocess.STDOUT)
+        except Exception as e:
+            self.queue.finish_job(job_id, 'failed', release_samples=True, message=f'No se pudo lanzar: {e}')
+            raise
+        # Prioridad baja desde el padre: preexec_fn no es seguro en un worker con hilos
+        if self.nice and hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, proc.pid, os.getpriority(os.PRIO_PROCESS, 0) + self.nice)
+            except OSError as e:
+                logging.warning('No se pudo bajar la prioridad del fine-tuning (PID=%d): %s', proc.pid, e)
+        self.queue.update_job(job_id, pid=proc.pid, log_path=log_path)
+        threading.Thread(target=self._reap, args=(job_id, proc), name=f'finetune-job-{job_id}', daemon=True).start()
+        logging.info('Trabajo de fine-tuning %d lanzado (%s, PID=%d)', job_id, reason, proc.pid)
+        return job_id
+
+    def _reap(self, job_id, proc):
+        returncode = proc.wait()
+        job = self.queue.job(job_id)
+        if job is not None and job['status'] in ACTIVE_STATUSES:
+            # El proceso terminó sin registrar el resultado (p.ej. error al importar TF)
+            self.queue.finish_job(job_id, 'failed', release_samples=True,
+                                  message=f'El proceso terminó con código {returncode}')
+
+
+# ---------- el trabajo (proceso aparte) ----------
+def _split_model(model):
+    """(extractor, head) compartiendo capas con `model`: entrenar head actualiza model."""
+    from tensorflow.keras import layers, models
+
+    gap = next((i for i, l in enumerate(model.layers) if isinstance(l, layers.GlobalAveragePooling2D)), None)
+    if gap is None:
+        raise ValueError('el modelo no tiene GlobalAveragePooling2D: no es un modelo de transfer learning')
+    extractor = models.Model(model.input, model.layers[gap].output)
+    inputs = layers.Input(shape=(int(extractor.output.shape[-1]),))
+    x = inputs
+    for layer in model.layers[gap + 1:]:
+        x = layer(x)
+    return extractor, models.Model(inputs, x)
+
+
+def _weights_digest(model):
+    h = hashlib.sha256()
+    for w in model.get_weights():
+        h.update(w.tobytes())
+    return h.hexdigest()[:12]
+
+
+def _accuracy(head, x, y):
+    import numpy as np
+    if len(y) == 0:
+        return None
+    return float(np.mean(np.argmax(head.predict(x, verbose=0), axis=1) == y))
+
+
+def finetune_head(samples, model_path, data_dir, class_indices, job_id=0, epochs=5, learning_rate=1e-4,
+                  batch_size=32, replay_ratio=4.0, min_replay=200, validation_split=0.2, max_drop=0.01,
+                  feature_cache='.bottleneck_cache', img_size=128, tflite=False, backup_dir='model_backups'):
+    """Ajusta la cabeza del modelo con las muestras nuevas + repaso. Devuelve dict de resultados."""
+    import numpy as np
+    from tensorflow.keras import optimizers
+    from tensorflow.keras.models import load_model
+    from tensorflow.keras.utils import to_categorical
+
+    from bottleneck_features import FeatureStore, compute_missing, file_hash
+    from data_pipeline import split_train_val
+
+    model = load_model(model_path, compile=False)
+    extractor, head = _split_model(model)
+
+    # Muestras nuevas (solo clases que ya conoce el modelo: la cabeza no cambia de tamaño)
+    new = []
+    skipped = 0
+    for rel, label in samples:
+        path = os.path.join(data_dir, rel)
+        if label in class_indices and os.path.exists(path):
+            new.append((path, class_indices[label]))
+        else:
+            skipped += 1
+    if not new:
+        raise ValueError('Ninguna muestra utilizable (borradas o de clases que el modelo no conoce)')
+
+    class_names, train_items, val_items = split_train_val(data_dir, validation_split)
+    new_paths = {os.path.abspath(p) for p, _ in new}
+
+    def known(items):
+        return [(p, class_indices[class_names[c]]) for p, c in items
+                if class_names[c] in class_indices and os.path.abspath(p) not in new_paths]
+
+    old_train, val = known(train_items), known(val_items)
+    n_replay = min(len(old_train), max(min_replay, int(replay_ratio * len(new))))
+    replay = random.Random(job_id).sample(old_train, n_replay)
+
+    # Características con la base ACTUAL (clave = huella de sus pesos)
+    store = FeatureStore(os.path.join(feature_cache, f'base_{_weights_digest(extractor)}_{img_size}px', 'variant_0'))
+    items = new + replay + val
+    paths = [p for p, _ in items]
+    hashes = [file_hash(p) for p in paths]
+    computed = compute_missing(extractor, store, paths, hashes, img_size)
+    feats = store.get(hashes).astype(np.float32)
+    labels = np.asarray([c for _, c in items], dtype=np.int64)
+    n_new, n_train = len(new), len(new) + len(replay)
+    train_x, train_y = feats[:n_train], labels[:n_train]
+    val_x, val_y = feats[n_train:], labels[n_train:]
+
+    baseline_acc = _accuracy(head, val_x, val_y)
+    baseline_new_acc = _accuracy(head, train_x[:n_new], train_y[:n_new])
+
+    head.compile(optimizer=optimizers.Adam(learning_rate=learning_rate), loss='categorical_crossentropy',
+                 metrics=['accuracy'])
+    head.fit(train_x, to_categorical(train_y, len(class_indices)), batch_size=batch_size, epochs=epochs,
+             shuffle=True, verbose=2)
+
+    new_acc = _accuracy(head, val_x, val_y)
+    new_samples_acc = _accuracy(head, train_x[:n_new], train_y[:n_new])
+    delta = None if baseline_acc is None or new_acc is None else new_acc - baseline_acc
+    result = {
+        'samples': n_new, 'skipped': skipped, 'replay': len(replay), 'val': len(val_y),
+        'features_computed': computed,
+        'baseline_acc': baseline_acc, 'new_acc': new_acc, 'delta': delta,
+        'baseline_new_samples_acc': baseline_new_acc, 'new_samples_acc': new_samples_acc,
+        'published': False, 'backup_path': None,
+    }
+    if delta is None or delta < -max_drop:
+        return result
+
+    # Publicar: copia de seguridad + reemplazo atómico (el watcher de la app recarga)
+    os.makedirs(backup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    backup_path = os.path.join(backup_dir, f'{stem}_before_job{job_id}.h5')
+    shutil.copy2(model_path, backup_path)
+    tmp_path = os.path.join(os.path.dirname(os.path.abspath(model_path)), f'.{stem}_job{job_id}.h5')
+    model.save(tmp_path)
+    os.replace(tmp_path, model_path)
+    if tflite:
+        from train import export_tflite
+        tmp_prefix = os.path.join(os.path.dirname(os.path.abspath(model_path)), f'.{stem}_job{job_id}')
+        for path in export_tflite(model, data_dir, img_size=img_size, prefix=tmp_prefix):
+            os.replace(path, os.path.join(os.path.dirname(os.path.abspath(model_path)),
+                                          stem + path[len(tmp_prefix):]))
+    result.update(published=True, backup_path=backup_path)
+    return result
+
+
+def run_job(queue, job_id, args):
+    """Ejecuta el trabajo `job_id` y registra el resultado en la cola."""
+    started = time.perf_counter()
+    queue.update_job(job_id, status='running', started_at=time.time(), pid=os.getpid(),
+                     model_path=os.path.abspath(args.model))
+    try:
+        with open(args.class_indices, 'r', encoding='utf-8') as fh:
+            class_indices = json.load(fh)
+        result = finetune_head(queue.job_samples(job_id), args.model, args.data_dir, class_indices, job_id=job_id,
+                               epochs=args.epochs, learning_rate=args.learning_rate, batch_size=args.batch_size,
+                               replay_ratio=args.replay_ratio, min_replay=args.min_replay, max_drop=args.max_drop,
+                               feature_cache=args.feature_cache, img_size=args.img_size, tflite=args.tflite,
+                               backup_dir=args.backup_dir)
+    except Exception as e:
+        logging.exception('Trabajo de fine-tuning %d fallido', job_id)
+        queue.finish_job(job_id, 'failed', release_samples=True, duration_s=time.perf_counter() - started,
+                         message=f'{type(e).__name__}: {e}')
+        return None
+
+    if result['published']:
+        message = f'Publicado ({result["samples"]} nuevas + {result["replay"]} de repaso)'
+    else:
+        message = f'No publicado: la accuracy de validación bajaría más de {args.max_drop:.1%}'
+    if result['skipped']:
+        message += f'; {result["skipped"]} muestras omitidas'
+    queue.finish_job(job_id, 'published' if result['published'] else 'rejected',
+                     duration_s=time.perf_counter() - started, replay=result['replay'],
+                     baseline_acc=result['baseline_acc'], new_acc=result['new_acc'], delta=result['delta'],
+                     published=int(result['published']), backup_path=result['backup_path'], message=message)
+    print(json.dumps(result))
+    return result
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [PID:%(process)d] %(levelname)s: %(message)s')
+    queue = FinetuneQueue(args.db)
+    queue.init_schema()
+    if args.status or (args.job_id is None and not args.run):
+        print(json.dumps(queue.status(), indent=2))
+        return
+    job_id = args.job_id
+    if job_id is None:
+        job_id = queue.claim(min_samples=1, reason='cli')
+        if job_id is None:
+            print('No hay muestras pendientes (o ya hay un trabajo en curso)')
+            return
+    result = run_job(queue, job_id, args)
+    if result is None:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fine-tuning incremental de la cabeza con las muestras de /collect')
+    parser.add_argument('--db', type=str, default=os.path.join(APP_DIR, 'finetune.db'), help='Base de datos de la cola')
+    parser.add_argument('--job_id', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--run', action='store_true', help='Reclamar las muestras pendientes y entrenar ahora')
+    parser.add_argument('--status', action='store_true', help='Mostrar muestras pendientes y trabajos')
+    parser.add_argument('--model', type=str, default='garbage_model.h5', help='Modelo a ajustar y publicar')
+    parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
+    parser.add_argument('--class_indices', type=str, default='class_indices.json', help='Mapa clase -> índice')
+    parser.add_argument('--epochs', type=int, default=5, help='Épocas de ajuste de la cabeza')
+    parser.add_argument('--learning_rate', type=float, default=1e-4, help='Learning rate del ajuste')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    parser.add_argument('--replay_ratio', type=float, default=4.0, help='Muestras antiguas de repaso por cada nueva')
+    parser.add_argument('--min_replay', type=int, default=200, help='Mínimo de muestras de repaso')
+    parser.add_argument('--max_drop', type=float, default=0.01,
+                        help='Caída máxima de accuracy de validación permitida para publicar')
+    parser.add_argument('--feature_cache', type=str, default='.bottleneck_cache', help='Caché de características')
+    parser.add_argument('--img_size', type=int, default=128, help='Tamaño de imagen (px)')
+    parser.add_argument('--tflite', action='store_true', help='Exportar también los .tflite al publicar')
+    parser.add_argument('--backup_dir', type=str, default='model_backups', help='Copias de los modelos reemplazados')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,16 @@
+"""
+gunicorn.conf.py
+Hooks de gunicorn (se carga automáticamente desde el directorio de trabajo).
+
+El import de app.py ya no carga TensorFlow; cada worker lanza el warm-up del
+modelo en segundo plano en cuanto arranca, de modo que /healthz responde al
+instante y /readyz pasa a 200 cuando el modelo está listo.
+"""
+import os
+
+
+def post_worker_init(worker):
+    if os.environ.get('WARMUP_ON_BOOT', '1').lower() not in ('1', 'true', 'yes'):
+        return
+    from app import start_background_warmup
+    start_background_warmup()
@@ -0,0 +1,148 @@
+"""
+inference.py
+Utilidades de inferencia compartidas por app.py, test_predict.py y los benchmarks.
+
+`build_inference_fn(model)` envuelve el modelo Keras en una `tf.function` con
+firma fija [None,128,128,3] (opcionalmente compilada con XLA), evitando el
+data adapter y el bucle de `model.predict()` en cada llamada.
+`warm_up(fn)` ejecuta unos batches sintéticos para pagar el coste de trazado
+antes de publicar el modelo.
+`TFLiteModel` carga un modelo .tflite (float16/int8) con el intérprete ligero
+(tflite-runtime / ai-edge-litert) sin importar TensorFlow completo.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image as PILImage
+
+IMG_SIZE = 128
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_images(data_dir):
+    """Lista (ruta, clase) de todas las imágenes bajo data_dir/<clase>/."""
+    items = []
+    for cls in sorted(os.listdir(data_dir)):
+        cls_dir = os.path.join(data_dir, cls)
+        if not os.path.isdir(cls_dir):
+            continue
+        for f in sorted(os.listdir(cls_dir)):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                items.append((os.path.join(cls_dir, f), cls))
+    return items
+
+
+def load_image_uint8(source, img_size=IMG_SIZE):
+    """Carga una imagen (ruta o file-like) como array uint8 (img,img,3) sin normalizar.
+    Replica `keras.preprocessing.image.load_img` (RGB + resize NEAREST).
+    """
+    with PILImage.open(source) as im:
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+        im = im.resize((img_size, img_size), PILImage.NEAREST)
+        return np.asarray(im, dtype=np.uint8)
+
+
+def load_image_array(source, img_size=IMG_SIZE):
+    """Carga una imagen (ruta o file-like) como tensor float32 (1,img,img,3) normalizado a [0,1].
+    Replica `keras.preprocessing.image.load_img` (RGB + resize NEAREST) + `img_to_array` / 255.
+    """
+    arr = load_image_uint8(source, img_size).astype(np.float32)
+    return arr[np.newaxis, ...] / 255.0
+
+
+def build_inference_fn(model, img_size=IMG_SIZE, jit_compile=False):
+    """Devuelve `predict(batch) -> np.ndarray` compilado en grafo para (None,img,img,3)."""
+    import tensorflow as tf
+
+    spec = tf.TensorSpec(shape=[None, img_size, img_size, 3], dtype=tf.float32)
+
+    @tf.function(input_signature=[spec], jit_compile=bool(jit_compile))
+    def _infer(x):
+        return model(x, training=False)
+
+    def predict(batch):
+        x = tf.convert_to_tensor(np.asarray(batch, dtype=np.float32))
+        return _infer(x).numpy()
+
+    return predict
+
+
+def warm_up(predict_fn, img_size=IMG_SIZE, batch_sizes=(1, 8), rounds=2):
+    """Ejecuta batches sintéticos para trazar/compilar el grafo. Devuelve segundos empleados."""
+    started = time.perf_counter()
+    for batch_size in batch_sizes:
+        dummy = np.zeros((batch_size, img_size, img_size, 3), dtype=np.float32)
+        for _ in range(rounds):
+            predict_fn(dummy)
+    elapsed = time.perf_counter() - started
+    logging.info('Warm-up de inferencia completado en %.3fs (batches=%s)', elapsed, list(batch_sizes))
+    return elapsed
+
+
+def _import_tflite_interpreter():
+    """Devuelve la clase Interpreter más ligera disponible (sin cargar TF completo si es posible)."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    # Último recurso: intérprete incluido en TensorFlow (importa TF completo)
+    import tensorflow as tf
+    logging.warning('tflite-runtime/ai-edge-litert no disponibles; usando tf.lite.Interpreter')
+    return tf.lite.Interpreter
+
+
+class TFLiteModel:
+    """Modelo .tflite con la misma interfaz `predict(batch) -> np.ndarray` que el callable Keras.
+
+    Gestiona modelos cuantizados (entrada/salida int8/uint8) aplicando escala y
+    zero-point. Las filas del batch se invocan de una en una (el modelo exportado
+    tiene batch fijo 1), protegidas por un lock porque el intérprete no es thread-safe.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        Interpreter = _import_tflite_interpreter()
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=str(model_path), num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _quantize(x, details):
+        scale, zero_point = details['quantization']
+        if details['dtype'] == np.float32 or not scale:
+            return x.astype(details['dtype'])
+        info = np.iinfo(details['dtype'])
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(details['dtype'])
+
+    @staticmethod
+    def _dequantize(y, details):
+        scale, zero_point = details['quantization']
+        if details['dtype'] == np.float32 or not scale:
+            return y.astype(np.float32)
+        return (y.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        outputs = []
+        with self._lock:
+            for row in batch:
+                x = self._quantize(row[np.newaxis, ...], self._input)
+                self.interpreter.set_tensor(self._input['index'], x)
+                self.interpreter.invoke()
+                y = self.interpreter.get_tensor(self._output['index'])
+                outputs.append(self._dequantize(y, self._output)[0])
+        return np.stack(outputs)
+
+    __call__ = predict
@@ -0,0 +1,198 @@
+"""
+metrics.py
+Métricas en proceso (contadores, gauges e histogramas) con exportación en el
+formato de texto de Prometheus, sin dependencias externas.
+
+El coste por observación es un `bisect` y una suma bajo un lock por métrica,
+así que se puede dejar activado en producción. Los gauges pueden calcularse en
+el momento del scrape con `set_function()` (p.ej. estado del modelo o de la caché).
+
+Uso:
+    registry = MetricsRegistry()
+    stage = registry.histogram('app_stage_seconds', 'Latencia por etapa', ('route', 'stage'))
+    with stage.time(route='predict', stage='decode'):
+        ...
+    registry.render()   # -> texto para /metrics
+
+Con varios workers de gunicorn cada proceso mantiene sus propias series.
+"""
+import bisect
+import math
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latencias de ~0.5 ms a 10 s (segundos)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name}: se esperaban las etiquetas {self.labelnames}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, key, value in self._samples():
+            lines.append(f'{name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Contador monótono."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valor instantáneo; con `set_function(fn)` se calcula al exportar.
+    `fn` devuelve un número (sin etiquetas) o un dict {tupla_de_etiquetas: valor}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), kind=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+        if kind:
+            self.kind = kind
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, fn):
+        self._function = fn
+
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        try:
+            value = self._function()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [(self.name, tuple(str(v) for v in key), val) for key, val in sorted(value.items())]
+        return [(self.name, (), value)]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo con buckets fijos (segundos por defecto)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [conteos por bucket (+Inf al final), suma]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][idx] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        """Context manager que observa la duración del bloque."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in sorted(self._values.items())]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas de un proceso y su exportación en formato Prometheus."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), kind=None):
+        return self._register(Gauge(name, documentation, labelnames, kind=kind))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,247 @@
+"""
+model_registry.py
+Registro versionado de modelos con recarga en segundo plano y cambio atómico.
+
+- `reload()` / `reload_async()` cargan y calientan el modelo nuevo FUERA de la
+  ruta de las peticiones (una sola carga a la vez) y lo publican con un único
+  cambio de referencia.
+- Cada versión tiene su propio MicroBatcher: las peticiones en curso terminan
+  sobre la versión que adquirieron (`with registry.acquire() as mv:`) y la
+  versión retirada se libera cuando su contador de peticiones llega a cero.
+- `start_watcher()` vigila mtime/tamaño (y hash) del fichero del modelo, de
+  modo que cada worker de gunicorn recarga por su cuenta cuando el fichero cambia.
+"""
+import contextlib
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+
+
+def file_fingerprint(path, with_hash=True):
+    """Huella de un fichero: mtime_ns, tamaño y (opcional) SHA-256. None si no existe."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    fingerprint = {'path': str(path), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                h.update(chunk)
+        fingerprint['sha256'] = h.hexdigest()
+    return fingerprint
+
+
+def _same_file(a, b):
+    if a is None or b is None:
+        return a is b
+    return a['mtime_ns'] == b['mtime_ns'] and a['size'] == b['size']
+
+
+def _iso(ts):
+    return datetime.datetime.fromtimestamp(ts).isoformat(timespec='seconds') if ts else None
+
+
+class ModelVersion:
+    """Un modelo publicado: callable de inferencia + batcher propio + contador de peticiones."""
+
+    def __init__(self, version, model, predict_fn, batcher, fingerprint, load_duration):
+        self.version = version
+        self.model = model
+        self.predict_fn = predict_fn
+        self.batcher = batcher
+        self.fingerprint = fingerprint
+        self.load_duration = load_duration
+        self.loaded_at = time.time()
+        self.swapped_at = None
+        self.retired_at = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def _enter(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def _exit(self):
+        with self._lock:
+            self._in_flight -= 1
+            release = self.retired_at is not None and self._in_flight == 0
+        if release:
+            self._release()
+
+    def _retire(self):
+        with self._lock:
+            self.retired_at = time.time()
+            release = self._in_flight == 0
+        if release:
+            self._release()
+
+    def _release(self):
+        logging.info('Liberando modelo versión %d', self.version)
+        if self.batcher is not None:
+            self.batcher.close()
+        self.model = None
+        self.predict_fn = None
+
+    def info(self):
+        fp = self.fingerprint or {}
+        return {
+            'version': self.version,
+            'sha256': fp.get('sha256', '')[:12] or None,
+            'file_mtime': _iso(fp['mtime_ns'] / 1e9) if 'mtime_ns' in fp else None,
+            'loaded_at': _iso(self.loaded_at),
+            'load_duration_s': round(self.load_duration, 3),
+            'swapped_at': _iso(self.swapped_at),
+            'retired_at': _iso(self.retired_at),
+            'in_flight': self._in_flight,
+        }
+
+
+class ModelRegistry:
+    """Mantiene la versión activa del modelo y gestiona recargas y cambios.
+
+    `loader()` devuelve (model, predict_fn) ya calentado o lanza excepción.
+    `fingerprint_fn()` devuelve la huella del artefacto (o None si no aplica).
+    `batcher_factory(predict_fn)` crea el MicroBatcher de cada versión.
+    `on_publish(version)` se invoca tras cada cambio (p.ej. para invalidar cachés).
+    """
+
+    def __init__(self, loader, fingerprint_fn=None, batcher_factory=None, on_publish=None, history=5):
+        self.loader = loader
+        self.fingerprint_fn = fingerprint_fn or (lambda: None)
+        self.batcher_factory = batcher_factory
+        self.on_publish = on_publish
+        self._active = None
+        self._retired = []
+        self._history_size = history
+        self._history = []
+        self._next_version = 1
+        self._swap_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._load_generation = 0
+        self._last_result = (False, 'Modelo no cargado')
+        self._loading_since = None
+        self._last_error = None
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+        self._watch_interval = None
+
+    @property
+    def active(self):
+        return self._active
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Fija la versión activa durante una petición; no se libera hasta salir del bloque."""
+        with self._swap_lock:
+            mv = self._active
+            if mv is None:
+                raise RuntimeError('No hay modelo cargado')
+            mv._enter()
+        try:
+            yield mv
+        finally:
+            mv._exit()
+
+    # ---------- carga ----------
+    def reload(self, reason='manual'):
+        """Carga, calienta y publica un modelo nuevo. Bloquea; si otra carga está en curso,
+        espera a que termine y devuelve su resultado. Devuelve (ok, message).
+        """
+        generation = self._load_generation
+        with self._load_lock:
+            if self._load_generation != generation:
+                return self._last_result
+            self._loading_since = time.time()
+            try:
+                self._last_result = self._load_and_swap(reason)
+            finally:
+                self._loading_since = None
+                self._load_generation += 1
+            return self._last_result
+
+    def reload_async(self, reason='manual'):
+        """Lanza la recarga en un hilo de fondo. Devuelve False si ya había una en curso."""
+        if self._load_lock.locked():
+            return False
+        threading.Thread(target=self.reload, args=(reason,), name='model-reload', daemon=True).start()
+        return True
+
+    def _load_and_swap(self, reason):
+        fingerprint = self.fingerprint_fn()
+        started = time.perf_counter()
+        try:
+            model, predict_fn = self.loader()
+        except Exception as e:
+            self._last_error = f'{type(e).__name__}: {e}'
+            logging.error('Recarga de modelo (%s) fallida: %s', reason, e)
+            return False, f'Error recargando el modelo: {e}'
+        load_duration = time.perf_counter() - started
+
+        batcher = self.batcher_factory(predict_fn) if self.batcher_factory else None
+        mv = ModelVersion(self._next_version, model, predict_fn, batcher, fingerprint, load_duration)
+        self._next_version += 1
+
+        with self._swap_lock:
+            old, self._active = self._active, mv
+            mv.swapped_at = time.time()
+        if old is not None:
+            old._retire()
+            self._retired.append(old)
+        self._retired = [v for v in self._retired if v.model is not None]
+        self._history = (self._history + [mv])[-self._history_size:]
+        self._last_error = None
+        if self.on_publish:
+            self.on_publish(mv)
+        logging.info('Modelo versión %d publicado (%s) en %.2fs', mv.version, reason, load_duration)
+        return True, f'Modelo versión {mv.version} cargado en {load_duration:.2f}s'
+
+    # ---------- vigilancia del fichero ----------
+    def start_watcher(self, interval):
+        """Inicia (una vez por proceso) el hilo que recarga al cambiar el fichero del modelo."""
+        if interval <= 0:
+            return
+        # Se llama desde before_request con varios hilos: comprobar y arrancar bajo el lock
+        with self._watcher_lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watch_interval = interval
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='model-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            mv = self._active
+            if mv is None or mv.fingerprint is None or self._load_lock.locked():
+                continue
+            try:
+                # Solo stat() en cada vuelta; el hash se calcula al cargar
+                current = file_fingerprint(mv.fingerprint['path'], with_hash=False)
+            except Exception as e:
+                logging.warning('Watcher de modelo: no se pudo leer la huella: %s', e)
+                continue
+            if current is not None and not _same_file(current, mv.fingerprint):
+                logging.info('Fichero de modelo modificado; recargando en segundo plano (PID=%d)', os.getpid())
+                self.reload_async('file-watch')
+
+    # ---------- estado ----------
+    def status(self):
+        mv = self._active
+        return {
+            'active': mv.info() if mv else None,
+            'loading': self._loading_since is not None,
+            'loading_since': _iso(self._loading_since),
+            'last_error': self._last_error,
+            'watch_interval_s': self._watch_interval,
+            'draining': [v.info() for v in self._retired if v.model is not None],
+            'history': [v.info() for v in self._history],
+        }
@@ -0,0 +1,257 @@
+"""
+model_server.py
+Servidor de inferencia fuera de proceso, compartido por todos los workers de gunicorn.
+
+Un único proceso carga TensorFlow (o el intérprete TFLite) y el modelo; los
+workers Flask (INFERENCE_BACKEND=remote) no importan TensorFlow y envían los
+tensores ya preprocesados por un socket Unix local. Las peticiones de todos los
+workers se agrupan con el mismo MicroBatcher que usa app.py; los workers no
+agrupan por su cuenta (ver PassThroughBatcher en batching.py).
+
+Protocolo (por conexión, peticiones en serie):
+    petición:  uint32 big-endian con la longitud + payload
+               payload vacío  -> ping (devuelve JSON con el estado del modelo)
+               payload .npy   -> batch float32 (N,128,128,3)
+    respuesta: uint32 longitud + 1 byte de estado + cuerpo
+               estado 0 -> cuerpo .npy (N,num_classes) o JSON del ping
+               estado 1 -> mensaje de error (utf-8)
+
+Uso:
+    python model_server.py --socket /tmp/garbage_model.sock --model garbage_model.h5
+    INFERENCE_BACKEND=remote MODEL_SERVER_SOCKET=/tmp/garbage_model.sock \
+        gunicorn app:app --workers 4 --threads 2
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from thread_tuning import load_tuning
+
+DEFAULT_SOCKET = '/tmp/garbage_model.sock'
+_HEADER = struct.Struct('!I')
+_STATUS_OK = b'\x00'
+_STATUS_ERROR = b'\x01'
+
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        chunk = sock.recv_into(view[received:], n - received)
+        if not chunk:
+            raise ConnectionError('Conexión cerrada por el otro extremo')
+        received += chunk
+    return bytes(buf)
+
+
+def _send_frame(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_frame(sock):
+    (length,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return _recv_exact(sock, length) if length else b''
+
+
+def _encode_array(array):
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(array), allow_pickle=False)
+    return buf.getvalue()
+
+
+def _decode_array(payload):
+    return np.load(io.BytesIO(payload), allow_pickle=False)
+
+
+# =========================
+# CLIENTE (usado por app.py)
+# =========================
+class ModelServerClient:
+    """Cliente del servidor de modelo con la interfaz `predict(batch) -> np.ndarray`.
+    Mantiene una conexión por hilo y reconecta una vez si falla al conectar o enviar
+    (servidor reiniciado); los errores esperando la respuesta no se reintentan.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            # Proceso hijo tras fork (gunicorn --preload): no reutilizar sockets del padre
+            self._local = threading.local()
+            self._pid = os.getpid()
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                sock.close()
+            finally:
+                self._local.sock = None
+
+    def _request(self, payload):
+        for attempt in (1, 2):
+            try:
+                sock = self._connection()
+                _send_frame(sock, payload)
+                break
+            except OSError:
+                # Al conectar o enviar (p.ej. socket de un servidor que se reinició): reintentar una vez
+                self._close()
+                if attempt == 2:
+                    raise
+        try:
+            response = _recv_frame(sock)
+        except OSError:
+            # El servidor ya tiene el batch: un timeout no se reenvía (duplicaría la carga)
+            self._close()
+            raise
+        status, body = response[:1], response[1:]
+        if status != _STATUS_OK:
+            raise RuntimeError(f'Servidor de modelo: {body.decode("utf-8", "replace")}')
+        return body
+
+    def ping(self):
+        """Estado del servidor (model_path, backend, version, batching)."""
+        return json.loads(self._request(b'').decode('utf-8'))
+
+    def predict(self, batch):
+        return _decode_array(self._request(_encode_array(np.asarray(batch, dtype=np.float32))))
+
+    __call__ = predict
+
+
+# =========================
+# SERVIDOR
+# =========================
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                payload = _recv_frame(self.request)
+            except ConnectionError:
+                return
+            try:
+                if not payload:
+                    body = json.dumps(server.status()).encode('utf-8')
+                else:
+                    # Siempre (N,H,W,C) -> (N,num_classes)
+                    body = _encode_array(server.batcher.submit(_decode_array(payload)))
+                _send_frame(self.request, _STATUS_OK + body)
+            except Exception as e:
+                logging.error('Error atendiendo petición de inferencia: %s', e)
+                _send_frame(self.request, _STATUS_ERROR + str(e).encode('utf-8'))
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Servidor Unix multihilo; cada conexión encola su batch en un MicroBatcher común."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, predict_fn, model_path, backend,
+                 max_batch_size=16, max_wait_ms=5.0):
+        from batching import MicroBatcher
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _Handler)
+        self.model_path = model_path
+        self.backend = backend
+        self.started_at = time.time()
+        self.batcher = MicroBatcher(predict_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                    name='model-server-batcher')
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'model_path': self.model_path,
+            'backend': self.backend,
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'batching': self.batcher.stats(),
+        }
+
+
+def load_predict_fn(backend, model_path, jit_compile=False, num_threads=None):
+    """Carga el modelo según el backend y devuelve un callable calentado."""
+    from inference import TFLiteModel, build_inference_fn, warm_up
+
+    if backend == 'tflite':
+        predict_fn = TFLiteModel(model_path, num_threads=num_threads).predict
+        warm_up(predict_fn, batch_sizes=(1,), rounds=1)
+    else:
+        from tensorflow.keras.models import load_model
+        predict_fn = build_inference_fn(load_model(model_path, compile=False), jit_compile=jit_compile)
+        warm_up(predict_fn, batch_sizes=(1, 8))
+    return predict_fn
+
+
+def simulated_predict_fn(ms_per_batch, num_classes=6):
+    """Modelo simulado para pruebas de carga sin TensorFlow: coste fijo por batch."""
+    def predict(batch):
+        time.sleep(ms_per_batch / 1000.0)
+        return np.full((len(batch), num_classes), 1.0 / num_classes, dtype=np.float32)
+    return predict
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [PID:%(process)d] %(levelname)s: %(message)s')
+    started = time.perf_counter()
+    if args.simulate_ms:
+        predict_fn = simulated_predict_fn(args.simulate_ms)
+        args.model, args.backend = 'simulated', 'simulated'
+    else:
+        # Hilos calibrados para esta máquina (thread_tuning.py), antes de importar TensorFlow
+        tuning = load_tuning(args.backend)
+        tuning.apply_env()
+        predict_fn = load_predict_fn(args.backend, args.model, jit_compile=args.xla,
+                                     num_threads=tuning.tflite_threads)
+    logging.info('Modelo %s (%s) cargado en %.2fs', args.model, args.backend, time.perf_counter() - started)
+
+    server = ModelServer(args.socket, predict_fn, args.model, args.backend,
+                         max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    logging.info('Servidor de modelo escuchando en %s', args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor de inferencia compartido (socket Unix)')
+    parser.add_argument('--socket', type=str, default=os.environ.get('MODEL_SERVER_SOCKET', DEFAULT_SOCKET),
+                        help='Ruta del socket Unix')
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras', help='Backend de inferencia')
+    parser.add_argument('--model', type=str, default='garbage_model.h5', help='Ruta del modelo (.h5 o .tflite)')
+    parser.add_argument('--max_batch_size', type=int, default=16, help='Tamaño máximo de batch entre workers')
+    parser.add_argument('--max_wait_ms', type=float, default=5.0, help='Espera máxima para completar un batch')
+    parser.add_argument('--xla', action='store_true', help='Compilar el grafo con XLA')
+    parser.add_argument('--simulate_ms', type=float, default=0.0,
+                        help='Sin modelo real: simular cada batch con este coste en ms (pruebas de carga)')
+    args = parser.parse_args()
+
+    main(args)
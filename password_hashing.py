@@ -0,0 +1,160 @@
+"""
+password_hashing.py
+Hash y verificación de contraseñas fuera del hilo de la petición.
+
+El hash de werkzeug (scrypt por defecto) es costoso en CPU y memoria a
+propósito; una ráfaga de logins en línea con la petición ocupa todos los
+núcleos y deja sin CPU a /predict. `PasswordHasher` ejecuta cada hash en un
+pool con un número fijo de hilos (límite de concurrencia) y una cola acotada:
+si la cola está llena la operación se rechaza enseguida (HashingBusyError) en
+lugar de acumular esperas.
+
+El método y coste son configurables (p.ej. 'scrypt:32768:8:1' o
+'pbkdf2:sha256:600000'); si un hash almacenado usa otros parámetros,
+`verify_and_update()` lo recalcula en segundo plano tras un login correcto.
+"""
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def canonical_method(method):
+    """Prefijo que werkzeug escribe en el hash para `method` (con sus parámetros por defecto),
+    sin calcular ningún hash: 'scrypt' -> 'scrypt:32768:8:1', 'pbkdf2' -> 'pbkdf2:sha256:600000'.
+    """
+    name, *params = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, params) if params else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = params[0] if params else 'sha256'
+        iterations = int(params[1]) if len(params) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f'Método de hash no soportado: {method!r}')
+
+
+class HashingBusyError(RuntimeError):
+    """La cola de hashing está llena; reintentar más tarde."""
+
+
+class PasswordHasher:
+    """Pool acotado para generate/check_password_hash con estadísticas de cola y tiempo."""
+
+    def __init__(self, method='scrypt', salt_length=16, max_workers=1, max_queue=16,
+                 timeout=10.0, timer=None, stats_window=500):
+        self.method = method
+        self.salt_length = salt_length
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.timeout = timeout
+        self.timer = timer
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='password-hash')
+        # Plazas = hilos trabajando + cola de espera
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = collections.Counter()
+        self._rejected = 0
+        self._rehashed = 0
+        self._hash_times = collections.deque(maxlen=stats_window)
+        self._wait_times = collections.deque(maxlen=stats_window)
+        self._method_prefix = canonical_method(method)
+
+    # ---------- ejecución en el pool ----------
+    def _submit(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusyError('Demasiadas operaciones de contraseña en cola')
+        enqueued = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+
+        def task():
+            with self._lock:
+                self._pending -= 1
+                self._wait_times.append(time.perf_counter() - enqueued)
+                self._running += 1
+            try:
+                started = time.perf_counter()
+                result = fn(*args)
+                elapsed = time.perf_counter() - started
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self._slots.release()
+            with self._lock:
+                self._completed[op] += 1
+                self._hash_times.append(elapsed)
+            if self.timer is not None:
+                self.timer(op, elapsed)
+            return result
+
+        return self._pool.submit(task)
+
+    def _wait(self, future):
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            raise HashingBusyError('Tiempo de espera agotado en la cola de contraseñas') from None
+
+    # ---------- API ----------
+    def hash(self, password):
+        """Hash con el método configurado (bloquea hasta tenerlo; lanza HashingBusyError si la cola está llena)."""
+        return self._wait(self._submit('hash', generate_password_hash, password, self.method, self.salt_length))
+
+    def verify(self, stored_hash, password):
+        return self._wait(self._submit('verify', check_password_hash, stored_hash, password))
+
+    def needs_rehash(self, stored_hash):
+        """True si el hash almacenado usa un método/coste distinto del configurado."""
+        return stored_hash.split('$', 1)[0] != self._method_prefix
+
+    def verify_and_update(self, stored_hash, password, on_rehash=None):
+        """Verifica la contraseña. Si es correcta y el hash está desactualizado, calcula el
+        hash nuevo en segundo plano y llama a `on_rehash(stored_hash, new_hash)` (no retrasa
+        el login); el callback debe sustituir el hash solo si sigue siendo `stored_hash`.
+        """
+        if not self.verify(stored_hash, password):
+            return False
+        if on_rehash is not None and self.needs_rehash(stored_hash):
+            try:
+                future = self._submit('rehash', generate_password_hash, password, self.method, self.salt_length)
+            except HashingBusyError:
+                return True  # se reintentará en el siguiente login
+            future.add_done_callback(lambda f: self._finish_rehash(f, stored_hash, on_rehash))
+        return True
+
+    def _finish_rehash(self, future, stored_hash, on_rehash):
+        if future.exception() is None and on_rehash(stored_hash, future.result()):
+            with self._lock:
+                self._rehashed += 1
+
+    def stats(self):
+        with self._lock:
+            hash_times = sorted(self._hash_times)
+            wait_times = sorted(self._wait_times)
+            stats = {
+                'method': self.method,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queue_depth': self._pending,
+                'running': self._running,
+                'completed': dict(self._completed),
+                'rejected': self._rejected,
+                'rehashed': self._rehashed,
+            }
+
+        def _pct(values, p):
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))] * 1000.0, 2)
+
+        stats['hash_ms'] = {'p50': _pct(hash_times, 50), 'p95': _pct(hash_times, 95), 'max': _pct(hash_times, 100)}
+        stats['queue_wait_ms'] = {'p50': _pct(wait_times, 50), 'p95': _pct(wait_times, 95),
+                                  'max': _pct(wait_times, 100)}
+        return stats
@@ -0,0 +1,108 @@
+"""
+prediction_cache.py
+Caché LRU en proceso para resultados de predicción.
+
+La clave es el SHA-256 de los bytes subidos + la identidad del modelo cargado,
+así que una misma foto re-subida no vuelve a decodificarse ni a pasar por el
+modelo, y al cambiar de modelo las entradas antiguas dejan de coincidir
+(además app.py vacía la caché al recargar).
+
+Límites: número de entradas, bytes estimados y TTL por entrada.
+"""
+import collections
+import hashlib
+import sys
+import threading
+import time
+
+
+def make_key(data, model_id):
+    """Clave de caché para los bytes de una imagen y la identidad del modelo."""
+    return f'{hashlib.sha256(data).hexdigest()}:{model_id}'
+
+
+class PredictionCache:
+    """LRU thread-safe acotada por entradas, bytes y TTL (segundos)."""
+
+    def __init__(self, max_entries=1024, max_bytes=1024 * 1024, ttl_seconds=3600.0):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl = float(ttl_seconds)
+        self._data = collections.OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def _estimate_size(key, value):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, (tuple, list)):
+            size += sum(sys.getsizeof(v) for v in value)
+        return size
+
+    def get(self, key):
+        """Devuelve el valor cacheado o None (cuenta hit/miss)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        size = self._estimate_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Invalida todas las entradas (p.ej. al cambiar de modelo)."""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,236 @@
+"""
+static_assets.py
+Variantes optimizadas y con huella de contenido de las imágenes de static/.
+
+Paso de build (se ejecuta al cambiar una imagen; la salida se versiona junto al código):
+
+    python static_assets.py                 # static/*.jpg|png -> static/dist/ + manifest.json
+    python static_assets.py --force         # regenerar todo
+
+Por cada imagen de static/ (no recursivo: static/uploads no se toca) genera en
+static/dist/ un fallback que cualquier navegador decodifica (JPEG progresivo, o PNG
+optimizado si hay transparencia) y variantes WebP y AVIF, cada una llamada `<nombre>.<sha256[:10]>.<ext>`.
+Una variante solo se guarda si pesa menos que el fallback. El contenido define el
+nombre, así que la app sirve static/dist/ con `Cache-Control: immutable` de un año:
+al cambiar la imagen cambia la URL.
+
+En las plantillas (ver AssetManifest.template_helpers):
+    {{ asset_url('fondo.jpg') }}                  URL del fallback con huella
+    {{ asset_image_set('fondo.jpg') }}            image-set(...) AVIF/WebP/fallback para CSS
+    {{ asset_picture('verde.png', 'Caneca') }}    <picture> con <source> AVIF/WebP
+Sin manifest (o sin la imagen en él) devuelven la URL original de static/.
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+
+from markupsafe import Markup, escape
+from PIL import Image as PILImage, features as pil_features
+
+STATIC_DIR = 'static'
+DIST_SUBDIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Orden de preferencia en <picture>/image-set: el navegador usa la primera que soporte
+MODERN_FORMATS = (('image/avif', 'AVIF', '.avif'), ('image/webp', 'WEBP', '.webp'))
+
+
+def _fingerprinted(name, data, ext):
+    stem = os.path.splitext(name)[0]
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+
+def _encode(im, fmt, quality):
+    out = io.BytesIO()
+    if fmt == 'JPEG':
+        im.convert('RGB').save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif fmt == 'PNG':
+        im.save(out, 'PNG', optimize=True)
+    elif fmt == 'WEBP':
+        im.save(out, 'WEBP', quality=quality, method=6)
+    else:
+        im.save(out, fmt, quality=quality)
+    return out.getvalue()
+
+
+def build_asset(path, out_dir, max_width=1920, jpeg_quality=82, webp_quality=80, avif_quality=55):
+    """Genera las variantes de una imagen y devuelve su entrada de manifest."""
+    name = os.path.basename(path)
+    with open(path, 'rb') as fh:
+        original = fh.read()
+    with PILImage.open(io.BytesIO(original)) as im:
+        im.load()
+        source_format, source_size = im.format, im.size
+        if im.mode == 'P':
+            im = im.convert('RGBA')
+        # Fallback universal: JPEG salvo que haya transparencia real (algunos .jpg de static/ son AVIF/WebP)
+        has_alpha = im.mode in ('RGBA', 'LA') and im.getchannel('A').getextrema()[0] < 255
+        if not has_alpha and im.mode != 'RGB':
+            im = im.convert('RGB')
+        if im.width > max_width:
+            im = im.resize((max_width, round(im.height * max_width / im.width)), PILImage.LANCZOS)
+        width, height = im.size
+
+        fallback_format = 'PNG' if has_alpha else 'JPEG'
+        fallback = _encode(im, fallback_format, jpeg_quality)
+        if source_format in ('JPEG', 'PNG') and source_size == (width, height) and len(original) <= len(fallback):
+            fallback_format, fallback = source_format, original  # Ya estaba mejor comprimida
+        fallback_mime, fallback_ext = ('image/jpeg', '.jpg') if fallback_format == 'JPEG' else ('image/png', '.png')
+        encoded = [(fallback_mime, fallback_ext, fallback)]
+        for mime, fmt, ext in MODERN_FORMATS:
+            if not pil_features.check(fmt.lower()):
+                continue
+            data = _encode(im, fmt, avif_quality if fmt == 'AVIF' else webp_quality)
+            if len(data) < len(fallback):
+                encoded.append((mime, ext, data))
+
+    variants, sizes = {}, {}
+    for mime, ext, data in encoded:
+        filename = _fingerprinted(name, data, ext)
+        target = os.path.join(out_dir, filename)
+        if not os.path.exists(target):
+            with open(target + '.tmp', 'wb') as fh:
+                fh.write(data)
+            os.replace(target + '.tmp', target)
+        variants[mime] = f'{DIST_SUBDIR}/{filename}'
+        sizes[mime] = len(data)
+    return {
+        'source_sha256': hashlib.sha256(original).hexdigest(),
+        'source_bytes': len(original),
+        'width': width,
+        'height': height,
+        'fallback': variants[fallback_mime],
+        'variants': variants,
+        'bytes': sizes,
+    }
+
+
+def build(static_dir=STATIC_DIR, force=False, **options):
+    """Actualiza static/dist/ y su manifest (solo reprocesa imágenes cambiadas). Devuelve el manifest."""
+    out_dir = os.path.join(static_dir, DIST_SUBDIR)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    previous = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, 'r', encoding='utf-8') as fh:
+            previous = json.load(fh)
+
+    manifest = {}
+    for name in sorted(os.listdir(static_dir)):
+        path = os.path.join(static_dir, name)
+        if not os.path.isfile(path) or os.path.splitext(name)[1].lower() not in SOURCE_EXTENSIONS:
+            continue
+        entry = previous.get(name)
+        if entry is not None:
+            with open(path, 'rb') as fh:
+                unchanged = hashlib.sha256(fh.read()).hexdigest() == entry['source_sha256']
+            if unchanged and all(os.path.exists(os.path.join(static_dir, v)) for v in entry['variants'].values()):
+                manifest[name] = entry
+                continue
+        manifest[name] = build_asset(path, out_dir, **options)
+        logging.info('%s: %d -> %s bytes', name, manifest[name]['source_bytes'],
+                     ', '.join(f'{m.split("/")[1]} {n}' for m, n in manifest[name]['bytes'].items()))
+
+    # Borrar variantes huérfanas (imágenes eliminadas o regeneradas)
+    referenced = {os.path.basename(v) for entry in manifest.values() for v in entry['variants'].values()}
+    for filename in os.listdir(out_dir):
+        if filename != MANIFEST_NAME and filename not in referenced:
+            os.remove(os.path.join(out_dir, filename))
+
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+class AssetManifest:
+    """Lectura del manifest desde la app. Se recarga si el fichero cambia (un stat por consulta)."""
+
+    def __init__(self, static_dir=STATIC_DIR, url_for=None, enabled=True):
+        self.path = os.path.join(static_dir, DIST_SUBDIR, MANIFEST_NAME)
+        self.url_for = url_for or (lambda filename: f'/static/{filename}')
+        self.enabled = enabled
+        self._entries = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        if not self.enabled:
+            return {}
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            with self._lock:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as fh:
+                        self._entries = json.load(fh)
+                    self._mtime = mtime
+                except (OSError, ValueError) as e:
+                    logging.warning('No se pudo leer %s: %s', self.path, e)
+        return self._entries
+
+    def entry(self, name):
+        return self._current().get(name)
+
+    def url(self, name):
+        entry = self.entry(name)
+        return self.url_for(entry['fallback'] if entry else name)
+
+    def sources(self, name):
+        """[(mime, url)] de las variantes modernas, en orden de preferencia."""
+        entry = self.entry(name)
+        if not entry:
+            return []
+        return [(mime, self.url_for(entry['variants'][mime])) for mime, _, _ in MODERN_FORMATS
+                if mime in entry['variants']]
+
+    def image_set(self, name):
+        """Valor CSS image-set(); usar tras una declaración url() de respaldo para navegadores antiguos."""
+        entry = self.entry(name)
+        if not entry:
+            return Markup(f"url('{escape(self.url(name))}')")
+        fallback_mime = next(m for m, v in entry['variants'].items() if v == entry['fallback'])
+        items = self.sources(name) + [(fallback_mime, self.url(name))]
+        return Markup('image-set(' + ', '.join(f"url('{escape(u)}') type('{m}')" for m, u in items) + ')')
+
+    def picture(self, name, alt='', **attrs):
+        entry = self.entry(name)
+        img_attrs = {'src': self.url(name), 'alt': alt}
+        if entry:
+            img_attrs.update(width=entry['width'], height=entry['height'])
+        img_attrs.update(attrs)
+        img = '<img ' + ' '.join(f'{k}="{escape(v)}"' for k, v in img_attrs.items()) + '>'
+        sources = ''.join(f'<source type="{m}" srcset="{escape(u)}">' for m, u in self.sources(name))
+        return Markup(f'<picture>{sources}{img}</picture>' if sources else img)
+
+    def template_helpers(self):
+        return {'asset_url': self.url, 'asset_image_set': self.image_set, 'asset_picture': self.picture}
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    manifest = build(args.static_dir, force=args.force, max_width=args.max_width, jpeg_quality=args.jpeg_quality,
+                     webp_quality=args.webp_quality, avif_quality=args.avif_quality)
+    before = sum(e['source_bytes'] for e in manifest.values())
+    best = sum(min(e['bytes'].values()) for e in manifest.values())
+    print(f'{len(manifest)} imágenes: {before / 1024:.0f} KB originales -> {best / 1024:.0f} KB '
+          f'(mejor variante por imagen, {100 * (1 - best / max(before, 1)):.0f}% menos)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Variantes WebP/AVIF con huella de contenido de static/')
+    parser.add_argument('--static_dir', type=str, default=STATIC_DIR, help='Carpeta static de la app')
+    parser.add_argument('--max_width', type=int, default=1920, help='Ancho máximo (px) de las variantes')
+    parser.add_argument('--jpeg_quality', type=int, default=82, help='Calidad del fallback JPEG')
+    parser.add_argument('--webp_quality', type=int, default=80, help='Calidad WebP')
+    parser.add_argument('--avif_quality', type=int, default=55, help='Calidad AVIF')
+    parser.add_argument('--force', action='store_true', help='Regenerar aunque la imagen no haya cambiado')
+    args = parser.parse_args()
+
+    main(args)
@@ -3,6 +3,7 @@ import json
 import numpy as np
 from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing import image
+from inference import build_inference_fn
 
 MODEL = 'garbage_model.h5'
 DATASET = 'dataset'
@@ -38,7 +39,8 @@ else:
 
 # cargar modelo
 print('Cargando modelo', MODEL)
-model = load_model(MODEL)
+model = load_model(MODEL, compile=False)
+predict = build_inference_fn(model)
 print('Modelo cargado OK')
 
 # procesar imagen
@@ -46,7 +48,7 @@ img = image.load_img(first_img, target_size=IMG_SIZE)
 arr = image.img_to_array(img)
 arr = np.expand_dims(arr,0)/255.0
 
-pred = model.predict(arr)
+pred = predict(arr)
 print('Raw pred vector (first 10):', pred[0][:10])
 idx = int(np.argmax(pred[0]))
 conf = float(pred[0][idx])*100
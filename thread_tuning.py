@@ -0,0 +1,316 @@
+"""
+thread_tuning.py
+Calibración de hilos de inferencia y tamaño de batch para la CPU de la máquina.
+
+app.py fijaba OMP/TF intra/inter a 1 hilo (ajustado para una instancia gratuita
+de 1 CPU). Ahora lee inference_threads.json, que tiene perfiles por backend y
+por número de CPUs disponibles:
+
+    {"keras": {"1": {"intra_op_threads": 1, ..., "batch_max_size": 4},
+               "8": {"intra_op_threads": 4, "inter_op_threads": 2, ..., "batch_max_size": 16}}}
+
+Al arrancar se usa el perfil del backend activo con más CPUs que no supere las
+disponibles (afinidad y cuota de cgroup, que es lo que limita en un contenedor
+PaaS). Así la misma imagen, calibrada en una instancia pequeña y en una grande,
+usa en cada una su configuración. Si no hay perfil, se usa 1 hilo y batch 8,
+como antes. Las variables de entorno tienen prioridad sobre el fichero:
+OMP_NUM_THREADS, TF_NUM_INTRAOP_THREADS, TF_NUM_INTEROP_THREADS,
+TFLITE_NUM_THREADS y BATCH_MAX_SIZE.
+
+La calibración mide cada combinación de hilos en un proceso nuevo, porque TF
+y OpenMP fijan sus pools al inicializarse. Para cada tamaño de batch mide la
+latencia p50 y las imágenes por segundo. Elige la combinación de mayor
+throughput cuya latencia por batch no supere --max_latency_ms; si otra queda a
+menos de --tolerance, prefiere la de menos hilos y el batch más pequeño.
+
+Uso:
+    python thread_tuning.py --backend keras --model garbage_model.h5
+    python thread_tuning.py --backend tflite --model garbage_model_int8.tflite --workers 2
+    python thread_tuning.py --show                      # perfil que aplicaría la app aquí
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+DEFAULT_TUNING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inference_threads.json')
+DEFAULTS = {
+    'intra_op_threads': 1,
+    'inter_op_threads': 1,
+    'omp_threads': 1,
+    'tflite_threads': 1,
+    'batch_max_size': 8,
+}
+# Clave del perfil -> variable de entorno que la sobrescribe
+ENV_VARS = {
+    'intra_op_threads': 'TF_NUM_INTRAOP_THREADS',
+    'inter_op_threads': 'TF_NUM_INTEROP_THREADS',
+    'omp_threads': 'OMP_NUM_THREADS',
+    'tflite_threads': 'TFLITE_NUM_THREADS',
+    'batch_max_size': 'BATCH_MAX_SIZE',
+}
+_THREAD_ENV = ('intra_op_threads', 'inter_op_threads', 'omp_threads')
+
+
+def available_cpus():
+    """CPUs que puede usar este proceso: afinidad y cuota de cgroup (v2 o v1)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as fh:
+            limit, period = fh.read().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', 'r') as fh:
+                limit = int(fh.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'r') as fh:
+                period = int(fh.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+class InferenceTuning:
+    """Configuración efectiva de hilos/batch y de dónde sale cada valor ('env', 'calibrated', 'default')."""
+
+    def __init__(self, values, sources, backend, cpus, profile_cpus=None, path=None):
+        self.values = values
+        self.sources = sources
+        self.backend = backend
+        self.cpus = cpus
+        self.profile_cpus = profile_cpus
+        self.path = path
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['values'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def apply_env(self, environ=None):
+        """Exporta los hilos a OMP/TF antes de importar TensorFlow (sin pisar lo que ya defina el entorno)."""
+        environ = os.environ if environ is None else environ
+        for key in _THREAD_ENV:
+            environ.setdefault(ENV_VARS[key], str(self.values[key]))
+
+    def configure_tensorflow(self, tf):
+        """Refuerza los hilos en TensorFlow recién importado (falla en silencio si ya se inicializó)."""
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(self.values['intra_op_threads'])
+            tf.config.threading.set_inter_op_parallelism_threads(self.values['inter_op_threads'])
+        except RuntimeError as e:
+            logging.info('Hilos de TensorFlow ya inicializados: %s', e)
+
+    def describe(self):
+        return {'backend': self.backend, 'available_cpus': self.cpus, 'profile_cpus': self.profile_cpus,
+                'path': self.path, 'values': dict(self.values), 'sources': dict(self.sources)}
+
+
+def read_profiles(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def load_tuning(backend, path=None, environ=None):
+    """Perfil calibrado para `backend` y los CPUs disponibles, con las variables de entorno por encima."""
+    environ = os.environ if environ is None else environ
+    path = path or environ.get('INFERENCE_TUNING_PATH', DEFAULT_TUNING_PATH)
+    cpus = available_cpus()
+    try:
+        profiles = read_profiles(path).get(backend, {})
+    except (OSError, ValueError) as e:
+        logging.warning('No se pudo leer %s: %s', path, e)
+        profiles = {}
+    fitting = [int(n) for n in profiles if int(n) <= cpus]
+    profile_cpus = max(fitting) if fitting else None
+    profile = profiles[str(profile_cpus)] if profile_cpus is not None else {}
+
+    values, sources = {}, {}
+    for key, default in DEFAULTS.items():
+        if environ.get(ENV_VARS[key]):
+            values[key], sources[key] = int(environ[ENV_VARS[key]]), 'env'
+        elif key in profile:
+            values[key], sources[key] = int(profile[key]), 'calibrated'
+        else:
+            values[key], sources[key] = default, 'default'
+    return InferenceTuning(values, sources, backend, cpus, profile_cpus, path)
+
+
+# =========================
+# CALIBRACIÓN
+# =========================
+def _synthetic_predict_fn(img_size):
+    """Carga densa con NumPy/BLAS (respeta OMP_NUM_THREADS) para probar la calibración sin modelo."""
+    import numpy as np
+    weights = np.random.default_rng(0).standard_normal((img_size * img_size * 3, 512)).astype(np.float32)
+
+    def predict(batch):
+        return batch.reshape(len(batch), -1) @ weights
+    return predict
+
+
+def measure_child(args):
+    """Proceso hijo: carga el modelo con los hilos ya fijados por entorno y mide cada batch."""
+    import numpy as np
+    from inference import IMG_SIZE
+
+    started = time.perf_counter()
+    if args.backend == 'synthetic':
+        predict_fn = _synthetic_predict_fn(IMG_SIZE)
+    else:
+        from model_server import load_predict_fn
+        predict_fn = load_predict_fn(args.backend, args.model, num_threads=args.child_threads)
+    load_s = time.perf_counter() - started
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for bs in args.batch_sizes:
+        batch = rng.random((bs, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        for _ in range(2):
+            predict_fn(batch)
+        latencies = []
+        deadline = time.perf_counter() + args.seconds
+        while len(latencies) < 3 or time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            predict_fn(batch)
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        rows.append({'batch_size': bs, 'p50_ms': round(p50 * 1000, 2), 'images_per_s': round(bs / p50, 1),
+                     'calls': len(latencies)})
+    print(json.dumps({'load_s': round(load_s, 2), 'rows': rows}))
+
+
+def thread_candidates(max_threads):
+    values = {1, max_threads}
+    n = 2
+    while n < max_threads:
+        values.add(n)
+        n *= 2
+    return sorted(values)
+
+
+def run_candidate(args, intra, inter):
+    env = dict(os.environ, OMP_NUM_THREADS=str(intra), TF_NUM_INTRAOP_THREADS=str(intra),
+               TF_NUM_INTEROP_THREADS=str(inter), TF_CPP_MIN_LOG_LEVEL='3', CUDA_VISIBLE_DEVICES='-1')
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', '--child_threads', str(intra),
+           '--backend', args.backend, '--model', args.model, '--seconds', str(args.seconds),
+           '--batch_sizes', *map(str, args.batch_sizes)]
+    out = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=args.timeout)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f'exit {out.returncode}')
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def choose(measurements, max_latency_ms, tolerance):
+    """Mayor throughput dentro del límite de latencia; ante empate (tolerance) menos hilos y batch menor."""
+    ok = [m for m in measurements if m['p50_ms'] <= max_latency_ms] or \
+        [min(measurements, key=lambda m: m['p50_ms'])]
+    best = max(m['images_per_s'] for m in ok)
+    near = [m for m in ok if m['images_per_s'] >= best * (1 - tolerance)]
+    return min(near, key=lambda m: (m['intra_op_threads'] * m['inter_op_threads'], m['batch_size'], -m['images_per_s']))
+
+
+def calibrate(args):
+    cpus = available_cpus()
+    max_threads = max(1, (args.max_threads or cpus) // max(1, args.workers))
+    intra_values = thread_candidates(max_threads)
+    inter_values = [1, 2] if args.backend == 'keras' and max_threads > 1 else [1]
+    print(f'CPUs disponibles: {cpus}  workers: {args.workers}  hilos por worker: hasta {max_threads}')
+
+    measurements = []
+    print(f'{"intra":>6}{"inter":>6}{"batch":>7}{"p50 ms":>10}{"img/s":>10}')
+    for intra in intra_values:
+        for inter in inter_values:
+            try:
+                result = run_candidate(args, intra, inter)
+            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                print(f'{intra:>6}{inter:>6}  error: {e}')
+                continue
+            for row in result['rows']:
+                measurements.append(dict(row, intra_op_threads=intra, inter_op_threads=inter))
+                print(f'{intra:>6}{inter:>6}{row["batch_size"]:>7}{row["p50_ms"]:>10}{row["images_per_s"]:>10}')
+    if not measurements:
+        raise SystemExit('Ninguna configuración se pudo medir')
+
+    best = choose(measurements, args.max_latency_ms, args.tolerance)
+    single = next((m for m in measurements if m['batch_size'] == min(args.batch_sizes)
+                   and m['intra_op_threads'] == best['intra_op_threads']
+                   and m['inter_op_threads'] == best['inter_op_threads']), best)
+    profile = {
+        'intra_op_threads': best['intra_op_threads'],
+        'inter_op_threads': best['inter_op_threads'],
+        'omp_threads': best['intra_op_threads'],
+        'tflite_threads': best['intra_op_threads'],
+        'batch_max_size': best['batch_size'],
+        'images_per_s': best['images_per_s'],
+        'batch_p50_ms': best['p50_ms'],
+        'single_p50_ms': single['p50_ms'],
+        'workers': args.workers,
+        'model': 'synthetic' if args.backend == 'synthetic' else os.path.basename(args.model),
+        'host': platform.node(),
+        'processor': platform.processor() or platform.machine(),
+        'calibrated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    profiles = read_profiles(args.path)
+    profiles.setdefault(args.backend, {})[str(cpus)] = profile
+    with open(args.path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump(profiles, fh, indent=2, sort_keys=True)
+    os.replace(args.path + '.tmp', args.path)
+
+    baseline = next((m for m in measurements if m['intra_op_threads'] == 1 and m['inter_op_threads'] == 1
+                     and m['batch_size'] == DEFAULTS['batch_max_size']), None)
+    print(f'\nElegido para {args.backend} con {cpus} CPUs: intra={profile["intra_op_threads"]} '
+          f'inter={profile["inter_op_threads"]} batch={profile["batch_max_size"]} -> '
+          f'{profile["images_per_s"]} img/s (p50 batch {profile["batch_p50_ms"]} ms, '
+          f'batch 1 {profile["single_p50_ms"]} ms)')
+    if baseline:
+        print(f'Configuración anterior (1 hilo, batch 8): {baseline["images_per_s"]} img/s')
+    print(f'Guardado en {args.path}')
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    if args.child:
+        measure_child(args)
+    elif args.show:
+        print(json.dumps(load_tuning(args.backend, args.path).describe(), indent=2))
+    else:
+        calibrate(args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibra hilos de inferencia y tamaño de batch para esta máquina')
+    parser.add_argument('--backend', choices=('keras', 'tflite', 'synthetic'), default='keras',
+                        help='synthetic: carga NumPy para probar la calibración sin modelo (la app no la usa)')
+    parser.add_argument('--model', type=str, default='garbage_model.h5', help='Modelo .h5 o .tflite de producción')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--workers', type=int, default=1, help='Workers de gunicorn que compartirán los CPUs')
+    parser.add_argument('--max_threads', type=int, default=None, help='Máximo de hilos a probar (por defecto, los CPUs)')
+    parser.add_argument('--seconds', type=float, default=2.0, help='Tiempo de medida por tamaño de batch')
+    parser.add_argument('--max_latency_ms', type=float, default=250.0, help='Latencia p50 máxima por batch')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='Margen para preferir menos hilos/batch menor')
+    parser.add_argument('--timeout', type=float, default=600.0, help='Tiempo máximo por configuración')
+    parser.add_argument('--path', type=str, default=os.environ.get('INFERENCE_TUNING_PATH', DEFAULT_TUNING_PATH))
+    parser.add_argument('--show', action='store_true', help='Mostrar la configuración que aplicaría la app')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--child_threads', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    main(args)
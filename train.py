@@ -4,12 +4,32 @@ Script de entrenamiento mejorado para el proyecto CLASIFICADOR.
 
 Características:
 - Usa transfer learning con MobileNetV2 (pesos imagenet) para mejorar precisión.
+- Por defecto (`--train_mode cached_head`) la base congelada se ejecuta una sola vez
+  por imagen: sus características se guardan en disco indexadas por el hash del
+  fichero (bottleneck_features.py) y cada época entrena solo la cabeza densa.
+  Al final se monta el modelo completo (base + cabeza) con la misma arquitectura.
+- `--train_mode full` pasa las imágenes por toda la red en cada época (necesario
+  para afinar la base con `--fine_tune_layers`).
 - Aumento de datos (rotaciones, zoom, flips, shifts).
+- Entrada con tf.data (por defecto; decodificación en paralelo, caché, aumento en el
+  grafo y prefetch, ver data_pipeline.py), desde los shards memory-mapped ya
+  preprocesados (dataset_shards.py, actualizados de forma incremental) o con el
+  ImageDataGenerator anterior.
+- Informa del tiempo por época e imágenes/s.
 - Callbacks: ModelCheckpoint (mejor modelo), EarlyStopping, ReduceLROnPlateau.
 - Guarda el mejor modelo en `garbage_model_best.h5` y el último en `garbage_model.h5`.
+- Exporta opcionalmente a TFLite (float16 e int8 con cuantización post-entrenamiento
+  calibrada con un subconjunto de `dataset/`) para el backend ligero de app.py.
 
 Uso:
     python train.py --data_dir dataset --epochs 15
+    python train.py --aug_variants 0              # cabeza sobre características sin aumento
+    python train.py --train_mode full --fine_tune_layers 30
+    python train.py --train_mode full --pipeline generator   # ImageDataGenerator (comparación)
+    python train.py --train_mode full --cache disk --cache_dir .tfdata_cache
+    python train.py --train_mode full --pipeline shards --shards_dir dataset_shards
+    python train.py --data_dir dataset --epochs 15 --tflite --calib_samples 200
+    python train.py --export_only          # solo exportar garbage_model.h5 existente a TFLite
 
 Requisitos:
     tensorflow (o tensorflow-cpu), numpy, Pillow
@@ -18,45 +38,45 @@ Requisitos:
 import argparse
 import os
 import json
+import random
+import time
+from inference import list_images
+from data_pipeline import AUGMENTATION, make_datasets, make_shard_datasets
+from bottleneck_features import make_feature_datasets
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras import layers, models, optimizers
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+from tensorflow.keras.callbacks import Callback, ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
 
 
-def build_transfer_model(input_shape=(128,128,3), num_classes=6):
-    base = MobileNetV2(include_top=False, weights='imagenet', input_shape=input_shape)
-    base.trainable = False  # congelar base al inicio
+class EpochTimer(Callback):
+    """Mide la duración de cada época y las imágenes de entrenamiento por segundo."""
 
-    x = layers.GlobalAveragePooling2D()(base.output)
-    x = layers.Dropout(0.3)(x)
-    x = layers.Dense(128, activation='relu')(x)
-    x = layers.Dropout(0.25)(x)
-    outputs = layers.Dense(num_classes, activation='softmax')(x)
-
-    model = models.Model(inputs=base.input, outputs=outputs)
-    return model
+    def __init__(self, train_samples):
+        super().__init__()
+        self.train_samples = train_samples
+        self.epochs = []
 
+    def on_epoch_begin(self, epoch, logs=None):
+        self._started = time.perf_counter()
 
-def main(args):
-    data_dir = args.data_dir
-    img_size = (args.img_size, args.img_size)
-    batch_size = args.batch_size
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self._started
+        images_per_s = self.train_samples / seconds if seconds else 0.0
+        self.epochs.append({'epoch': epoch + 1, 'seconds': round(seconds, 2), 'images_per_s': round(images_per_s, 1)})
+        if logs is not None:
+            logs['epoch_time_s'] = seconds
+            logs['images_per_s'] = images_per_s
+        print(f'  Época {epoch + 1}: {seconds:.1f}s ({images_per_s:.1f} imágenes/s)')
 
-    if not os.path.exists(data_dir):
-        raise FileNotFoundError(f"No se encontró la carpeta de datos: {data_dir}")
 
-    # Aumentos + valid split
+def make_generators(data_dir, img_size, batch_size, validation_split=0.2):
+    """Entrada anterior con ImageDataGenerator (Python, un hilo). Devuelve (train, val, class_indices, counts)."""
     train_datagen = ImageDataGenerator(
         rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.1,
-        height_shift_range=0.1,
-        shear_range=0.1,
-        zoom_range=0.15,
-        horizontal_flip=True,
         fill_mode='nearest',
-        validation_split=0.2
+        validation_split=validation_split,
+        **AUGMENTATION
     )
 
     train_gen = train_datagen.flow_from_directory(
@@ -74,41 +94,242 @@ def main(args):
         class_mode='categorical',
         subset='validation'
     )
+    return train_gen, val_gen, train_gen.class_indices, {'train': train_gen.samples, 'val': val_gen.samples}
 
-    num_classes = train_gen.num_classes
-    print("Clases detectadas:", train_gen.class_indices)
 
-    model = build_transfer_model(input_shape=(img_size[0], img_size[1], 3), num_classes=num_classes)
-    model.compile(optimizer=optimizers.Adam(learning_rate=1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
+BASE_NAME = 'mobilenetv2_imagenet'
 
-    # Callbacks
-    checkpoint = ModelCheckpoint('garbage_model_best.h5', monitor='val_accuracy', save_best_only=True, verbose=1)
-    earlystop = EarlyStopping(monitor='val_loss', patience=6, restore_best_weights=True, verbose=1)
-    reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, min_lr=1e-6, verbose=1)
 
-    history = model.fit(
-        train_gen,
-        validation_data=val_gen,
-        epochs=args.epochs,
-        callbacks=[checkpoint, earlystop, reduce_lr]
-    )
+def build_base(input_shape=(128,128,3)):
+    base = MobileNetV2(include_top=False, weights='imagenet', input_shape=input_shape)
+    base.trainable = False  # congelar base al inicio
+    return base
+
+
+def _head_layers(x, num_classes):
+    x = layers.Dropout(0.3)(x)
+    x = layers.Dense(128, activation='relu')(x)
+    x = layers.Dropout(0.25)(x)
+    return layers.Dense(num_classes, activation='softmax')(x)
+
+
+def build_transfer_model(input_shape=(128,128,3), num_classes=6, base=None):
+    base = base if base is not None else build_base(input_shape)
+    x = layers.GlobalAveragePooling2D()(base.output)
+    outputs = _head_layers(x, num_classes)
+
+    model = models.Model(inputs=base.input, outputs=outputs)
+    return model
+
+
+def build_feature_extractor(base):
+    """Base congelada + GlobalAveragePooling: imagen -> vector de características."""
+    return models.Model(inputs=base.input, outputs=layers.GlobalAveragePooling2D()(base.output))
+
+
+def build_head(feature_dim, num_classes):
+    """Misma cabeza que build_transfer_model, sobre las características cacheadas."""
+    inputs = layers.Input(shape=(feature_dim,))
+    return models.Model(inputs=inputs, outputs=_head_layers(inputs, num_classes))
+
+
+def unfreeze_top_layers(model, n):
+    """Descongela las últimas `n` capas de la base (BatchNormalization sigue congelada)."""
+    base_layers = [l for l in model.layers if l.weights and not isinstance(l, layers.Dense)]
+    for layer in base_layers[-n:]:
+        if not isinstance(layer, layers.BatchNormalization):
+            layer.trainable = True
+
 
+def attach_head(base, head, num_classes):
+    """Modelo completo (base + cabeza) con los pesos de la cabeza entrenada sobre características."""
+    model = build_transfer_model(input_shape=tuple(base.input.shape[1:]), num_classes=num_classes, base=base)
+    dense = [l for l in model.layers if isinstance(l, layers.Dense)]
+    for target, source in zip(dense, [l for l in head.layers if isinstance(l, layers.Dense)]):
+        target.set_weights(source.get_weights())
+    return model
+
+
+def train_cached_head(args, callbacks):
+    """Entrena solo la cabeza sobre características cacheadas. Devuelve (modelo_último, modelo_mejor, class_indices)."""
+    base = build_base(input_shape=(args.img_size, args.img_size, 3))
+    train_data, val_data, class_indices, counts = make_feature_datasets(
+        args.data_dir, build_feature_extractor(base), BASE_NAME, img_size=args.img_size,
+        batch_size=args.batch_size, aug_variants=args.aug_variants, cache_dir=args.feature_cache)
+    num_classes = len(class_indices)
+    print("Clases detectadas:", class_indices)
+    print(f"Características: {counts['computed']} calculadas en {counts['feature_s']}s "
+          f"({counts['train']} entrenamiento / {counts['val']} validación, {args.aug_variants} variantes de aumento)")
+
+    head = build_head(counts['feature_dim'], num_classes)
+    head.compile(optimizer=optimizers.Adam(learning_rate=1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
+    best_weights = os.path.join(args.feature_cache, 'head_best.weights.h5')
+    os.makedirs(args.feature_cache, exist_ok=True)
+    checkpoint = ModelCheckpoint(best_weights, monitor='val_accuracy', save_best_only=True,
+                                 save_weights_only=True, verbose=1)
+    timer = EpochTimer(counts['train'])
+    head.fit(train_data, validation_data=val_data, epochs=args.epochs, callbacks=[timer, checkpoint] + callbacks)
+    report_epoch_times(timer, 'cached_head')
+
+    model = attach_head(base, head, num_classes)
+    head.load_weights(best_weights)
+    best_model = attach_head(build_base(input_shape=(args.img_size, args.img_size, 3)), head, num_classes)
+    return model, best_model, class_indices
+
+
+def report_epoch_times(timer, label):
+    if timer.epochs:
+        # La primera época incluye la decodificación (y el llenado de la caché con tf.data)
+        steady = timer.epochs[1:] or timer.epochs
+        print(f"\nTiempo por época ({label}): primera {timer.epochs[0]['seconds']}s, "
+              f"media resto {sum(e['seconds'] for e in steady) / len(steady):.1f}s, "
+              f"{sum(e['images_per_s'] for e in steady) / len(steady):.1f} imágenes/s")
+
+
+def export_tflite(model, data_dir, img_size=128, calib_samples=200, prefix='garbage_model'):
+    """Exporta el modelo a TFLite float16 e int8 (calibrado con imágenes de data_dir).
+    Devuelve la lista de rutas generadas.
+    """
+    import tensorflow as tf
+    from inference import load_image_array
+
+    # Subconjunto de calibración reproducible y repartido entre clases
+    items = list_images(data_dir)
+    random.Random(0).shuffle(items)
+    calib_paths = [p for p, _ in items[:calib_samples]]
+
+    def representative_dataset():
+        for path in calib_paths:
+            yield [load_image_array(path, img_size)]
+
+    outputs = []
+
+    # float16: pesos en fp16, mitad de tamaño, precisión prácticamente idéntica
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    fp16_path = f'{prefix}_fp16.tflite'
+    with open(fp16_path, 'wb') as f:
+        f.write(converter.convert())
+    outputs.append(fp16_path)
+
+    # int8: cuantización entera completa (entrada/salida float para no cambiar el preprocesado)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    int8_path = f'{prefix}_int8.tflite'
+    with open(int8_path, 'wb') as f:
+        f.write(converter.convert())
+    outputs.append(int8_path)
+
+    for path in outputs:
+        print(f'Exportado {path} ({os.path.getsize(path) / 1024 / 1024:.2f} MB)')
+    return outputs
+
+
+def save_model_and_classes(model, class_indices):
     # Guardar modelo final (último estado) y exportar mapping de clases
     model.save('garbage_model.h5')
     print('\nModelo guardado en garbage_model.h5 y mejor modelo en garbage_model_best.h5')
 
     # Guardar mapping de clases para referencia
     with open('class_indices.json', 'w') as f:
-        json.dump(train_gen.class_indices, f)
+        json.dump(class_indices, f)
     print('Class indices guardados en class_indices.json')
 
 
+def main(args):
+    data_dir = args.data_dir
+    img_size = (args.img_size, args.img_size)
+    batch_size = args.batch_size
+
+    if not os.path.exists(data_dir):
+        raise FileNotFoundError(f"No se encontró la carpeta de datos: {data_dir}")
+
+    if args.export_only:
+        from tensorflow.keras.models import load_model
+        model = load_model('garbage_model.h5', compile=False)
+        export_tflite(model, data_dir, img_size=args.img_size, calib_samples=args.calib_samples)
+        return
+
+    earlystop = EarlyStopping(monitor='val_loss', patience=6, restore_best_weights=True, verbose=1)
+    reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, min_lr=1e-6, verbose=1)
+
+    if args.train_mode == 'cached_head':
+        model, best_model, class_indices = train_cached_head(args, [earlystop, reduce_lr])
+        best_model.save('garbage_model_best.h5')
+        save_model_and_classes(model, class_indices)
+        if args.tflite:
+            export_tflite(model, data_dir, img_size=args.img_size, calib_samples=args.calib_samples)
+        return
+
+    # Aumentos + valid split
+    if args.pipeline == 'tfdata':
+        train_data, val_data, class_indices, counts = make_datasets(
+            data_dir, img_size=args.img_size, batch_size=batch_size, cache=args.cache, cache_dir=args.cache_dir)
+    elif args.pipeline == 'shards':
+        from dataset_shards import update_shards
+        # Solo decodifica las imágenes nuevas o modificadas desde la última vez
+        print('Shards:', update_shards(data_dir, args.shards_dir, img_size=args.img_size))
+        train_data, val_data, class_indices, counts = make_shard_datasets(args.shards_dir, batch_size=batch_size)
+    else:
+        train_data, val_data, class_indices, counts = make_generators(data_dir, img_size, batch_size)
+
+    num_classes = len(class_indices)
+    print("Clases detectadas:", class_indices)
+    print(f"Entrada: {args.pipeline} ({counts['train']} entrenamiento / {counts['val']} validación)")
+
+    model = build_transfer_model(input_shape=(img_size[0], img_size[1], 3), num_classes=num_classes)
+    learning_rate = 1e-3
+    if args.fine_tune_layers:
+        unfreeze_top_layers(model, args.fine_tune_layers)
+        learning_rate = 1e-4  # LR bajo para no destruir los pesos preentrenados
+    model.compile(optimizer=optimizers.Adam(learning_rate=learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+
+    # Callbacks
+    checkpoint = ModelCheckpoint('garbage_model_best.h5', monitor='val_accuracy', save_best_only=True, verbose=1)
+    timer = EpochTimer(counts['train'])
+
+    history = model.fit(
+        train_data,
+        validation_data=val_data,
+        epochs=args.epochs,
+        callbacks=[timer, checkpoint, earlystop, reduce_lr]
+    )
+    report_epoch_times(timer, args.pipeline)
+    save_model_and_classes(model, class_indices)
+
+    if args.tflite:
+        export_tflite(model, data_dir, img_size=args.img_size, calib_samples=args.calib_samples)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Entrenar modelo de clasificación de basura')
     parser.add_argument('--data_dir', type=str, default='dataset', help='Carpeta con subcarpetas por clase')
     parser.add_argument('--img_size', type=int, default=128, help='Tamaño de imagen (px)')
     parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
     parser.add_argument('--epochs', type=int, default=12, help='Número máximo de épocas')
+    parser.add_argument('--train_mode', choices=['cached_head', 'full'], default='cached_head',
+                        help='cached_head: solo la cabeza sobre características cacheadas; full: red completa por época')
+    parser.add_argument('--aug_variants', type=int, default=3,
+                        help='Variantes aumentadas cacheadas por imagen (cached_head; 0 = sin aumento)')
+    parser.add_argument('--feature_cache', type=str, default='.bottleneck_cache',
+                        help='Carpeta de la caché de características (cached_head)')
+    parser.add_argument('--fine_tune_layers', type=int, default=0,
+                        help='Capas finales de la base a descongelar (solo --train_mode full)')
+    parser.add_argument('--pipeline', choices=['tfdata', 'shards', 'generator'], default='tfdata',
+                        help='Entrada de datos: tf.data (paralela, con caché), shards mmap o ImageDataGenerator')
+    parser.add_argument('--shards_dir', type=str, default='dataset_shards',
+                        help='Carpeta de los shards memory-mapped (--pipeline shards)')
+    parser.add_argument('--cache', choices=['memory', 'disk', 'none'], default='memory',
+                        help='Caché de imágenes decodificadas (solo tf.data)')
+    parser.add_argument('--cache_dir', type=str, default='.tfdata_cache', help='Carpeta de la caché en disco')
+    parser.add_argument('--tflite', action='store_true', help='Exportar también a TFLite (float16 e int8)')
+    parser.add_argument('--export_only', action='store_true', help='No entrenar: exportar garbage_model.h5 a TFLite')
+    parser.add_argument('--calib_samples', type=int, default=200, help='Imágenes de calibración para int8')
     args = parser.parse_args()
+    if args.fine_tune_layers and args.train_mode != 'full':
+        parser.error('--fine_tune_layers requiere --train_mode full (la base no se ejecuta en cached_head)')
 
     main(args)
@@ -0,0 +1,291 @@
+"""
+upload_store.py
+Almacén de subidas direccionado por contenido, con miniaturas y retención.
+
+    static/uploads/store/
+        orig/<sha[:2]>/<sha256>.<ext>    original (escrito en segundo plano)
+        thumb/<sha[:2]>/<sha256>.jpg     miniatura (lado mayor `thumb_size`) para index.html
+
+- Subir dos veces la misma imagen no duplica ficheros. Tampoco hay colisiones
+  de nombre entre peticiones concurrentes: la ruta depende solo del contenido.
+  Las escrituras son atómicas (temporal + os.replace).
+- `sweep()` borra originales y miniaturas más antiguos que `max_age_s`. Si el
+  total aún supera `max_bytes`, borra los menos usados (mtime, que se
+  renueva cuando se vuelve a subir el mismo contenido) hasta bajar al 90%.
+  `start_sweeper()` lo ejecuta periódicamente en un hilo. Un lock de fichero
+  hace que, con varios workers, solo uno borre a la vez.
+- `stats()` devuelve el uso de disco y los ficheros/bytes desalojados.
+
+`downscale_upload()` es la guarda de /predict y /predict.json: si una subida
+supera `max_side` px la reduce antes de guardarla y clasificarla (en JPEG con
+draft mode, que decodifica ya a 1/2, 1/4 o 1/8). index.html ya reduce las fotos
+en el navegador, así que normalmente no hace nada (solo lee la cabecera).
+
+Solo se gestiona el subárbol `store/`: lo que ya hubiera en static/uploads no se toca.
+"""
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image as PILImage, ImageOps
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin exclusión entre procesos
+    fcntl = None
+
+UPLOAD_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif')
+
+
+def downscale_upload(data, max_side, quality=90):
+    """Devuelve (bytes, tamaño_original) con el lado mayor acotado a `max_side`.
+    Si la imagen ya cabe, o no se puede decodificar, devuelve los mismos bytes y None
+    (los errores de decodificación los informa luego la predicción).
+    """
+    if max_side <= 0:
+        return data, None
+    try:
+        with PILImage.open(io.BytesIO(data)) as im:
+            if max(im.size) <= max_side:
+                return data, None
+            original_size = im.size
+            im.draft('RGB', (max_side, max_side))
+            # Aplicar la orientación EXIF: el JPEG re-codificado ya no la lleva
+            im = ImageOps.exif_transpose(im).convert('RGB')
+            im.thumbnail((max_side, max_side), PILImage.BILINEAR)
+            out = io.BytesIO()
+            im.save(out, 'JPEG', quality=quality)
+    except Exception:
+        return data, None
+    return out.getvalue(), original_size
+
+
+class StoredUpload:
+    """Resultado de `UploadStore.put()`: clave y rutas (relativas a static/) del original y la miniatura."""
+
+    def __init__(self, key, original, thumbnail):
+        self.key = key
+        self.original = original
+        self.thumbnail = thumbnail
+
+
+class UploadStore:
+    def __init__(self, root='static/uploads/store', static_root='static', max_bytes=500 * 1024 * 1024,
+                 max_age_s=72 * 3600, thumb_size=256, thumb_quality=80):
+        self.root = root
+        self.static_root = static_root
+        self.max_bytes = int(max_bytes)
+        self.max_age_s = float(max_age_s)
+        self.thumb_size = int(thumb_size)
+        self.thumb_quality = int(thumb_quality)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-writer')
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._usage = {'files': 0, 'bytes': 0, 'originals': 0, 'thumbnails': 0}
+        self._written = {'files': 0, 'bytes': 0, 'deduplicated': 0}
+        self._evicted = {'files': 0, 'bytes': 0, 'by_age': 0, 'by_size': 0}
+        self._last_sweep = None
+        self._pending_writes = 0
+        os.makedirs(root, exist_ok=True)
+
+    # ---------- rutas ----------
+    def _paths(self, key, ext):
+        original = os.path.join(self.root, 'orig', key[:2], key + ext)
+        thumbnail = os.path.join(self.root, 'thumb', key[:2], key + '.jpg')
+        return original, thumbnail
+
+    def _static_relative(self, path):
+        return os.path.relpath(path, self.static_root).replace(os.sep, '/')
+
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+    def _make_thumbnail(self, data, path):
+        """Miniatura JPEG; devuelve False si los datos no son una imagen decodificable."""
+        try:
+            with PILImage.open(io.BytesIO(data)) as im:
+                im.draft('RGB', (self.thumb_size, self.thumb_size))  # JPEG: decodificar ya reducida
+                im = ImageOps.exif_transpose(im).convert('RGB')
+                im.thumbnail((self.thumb_size, self.thumb_size))
+                out = io.BytesIO()
+                im.save(out, 'JPEG', quality=self.thumb_quality, optimize=True)
+        except Exception as e:
+            logging.warning('No se pudo generar la miniatura de %s: %s', path, e)
+            return False
+        self._write_atomic(path, out.getvalue())
+        with self._lock:
+            self._written['files'] += 1
+            self._written['bytes'] += out.tell()
+        return True
+
+    def _write_original(self, data, path):
+        try:
+            self._write_atomic(path, data)
+            with self._lock:
+                self._written['files'] += 1
+                self._written['bytes'] += len(data)
+        except OSError as e:
+            logging.warning('No se pudo guardar la subida %s: %s', path, e)
+        finally:
+            with self._lock:
+                self._pending_writes -= 1
+
+    # ---------- API ----------
+    def put(self, data, filename='', thumbnail=True):
+        """Guarda una subida. La miniatura se genera en este hilo (es pequeña y la página la
+        pide enseguida); el original se escribe en segundo plano.
+        Devuelve StoredUpload con rutas relativas a static/ (thumbnail None si no se pudo generar).
+        """
+        key = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(filename or '')[1].lower()
+        ext = ext if ext in UPLOAD_EXTENSIONS else '.bin'
+        original, thumb = self._paths(key, ext)
+
+        if os.path.exists(original):
+            # Mismo contenido ya guardado: solo renovar su antigüedad para la retención
+            with contextlib.suppress(OSError):
+                os.utime(original)
+                os.utime(thumb)
+            with self._lock:
+                self._written['deduplicated'] += 1
+        else:
+            with self._lock:
+                self._pending_writes += 1
+            self._writer.submit(self._write_original, data, original)
+        has_thumb = False
+        if thumbnail:
+            has_thumb = os.path.exists(thumb) or self._make_thumbnail(data, thumb)
+        return StoredUpload(key, self._static_relative(original), self._static_relative(thumb) if has_thumb else None)
+
+    # ---------- retención ----------
+    @contextlib.contextmanager
+    def _sweep_lock(self):
+        """True si este proceso puede borrar (lock no bloqueante entre workers)."""
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.root, '.sweep.lock'), 'w') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _scan(self):
+        """{clave: [(ruta, tamaño, mtime), ...]} de todos los ficheros del almacén."""
+        entries = {}
+        for sub in ('orig', 'thumb'):
+            base = os.path.join(self.root, sub)
+            if not os.path.isdir(base):
+                continue
+            for bucket in os.scandir(base):
+                if not bucket.is_dir():
+                    continue
+                for f in os.scandir(bucket.path):
+                    if f.name.endswith('.tmp'):
+                        continue
+                    try:
+                        st = f.stat()
+                    except OSError:
+                        continue
+                    entries.setdefault(f.name.split('.', 1)[0], []).append((f.path, st.st_size, st.st_mtime))
+        return entries
+
+    def sweep(self):
+        """Aplica la retención por antigüedad y tamaño. Devuelve estadísticas de la pasada."""
+        started = time.perf_counter()
+        with self._sweep_lock() as can_delete:
+            entries = self._scan()
+            evicted = {'files': 0, 'bytes': 0, 'by_age': 0, 'by_size': 0}
+
+            def evict(key, reason):
+                for path, size, _ in entries.pop(key):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    evicted['files'] += 1
+                    evicted['bytes'] += size
+                evicted[reason] += 1
+
+            if can_delete:
+                now = time.time()
+                if self.max_age_s > 0:
+                    for key in [k for k, files in entries.items()
+                                if now - max(m for _, _, m in files) > self.max_age_s]:
+                        evict(key, 'by_age')
+                total = sum(size for files in entries.values() for _, size, _ in files)
+                if self.max_bytes > 0 and total > self.max_bytes:
+                    target = self.max_bytes * 0.9
+                    for key in sorted(entries, key=lambda k: max(m for _, _, m in entries[k])):
+                        if total <= target:
+                            break
+                        total -= sum(size for _, size, _ in entries[key])
+                        evict(key, 'by_size')
+
+        files = [f for group in entries.values() for f in group]
+        usage = {
+            'files': len(files),
+            'bytes': sum(size for _, size, _ in files),
+            'originals': sum(1 for path, _, _ in files if os.sep + 'orig' + os.sep in path),
+            'thumbnails': sum(1 for path, _, _ in files if os.sep + 'thumb' + os.sep in path),
+        }
+        with self._lock:
+            self._usage = usage
+            for k, v in evicted.items():
+                self._evicted[k] += v
+            self._last_sweep = {'at': time.time(), 'seconds': round(time.perf_counter() - started, 4),
+                                'deleted': can_delete, **evicted}
+        if evicted['files']:
+            logging.info('Retención de subidas: %d ficheros (%.1f MB) desalojados [PID=%d]',
+                         evicted['files'], evicted['bytes'] / 1e6, os.getpid())
+        return dict(usage, evicted=evicted)
+
+    def start_sweeper(self, interval):
+        """Hilo de retención periódico (uno por proceso; interval <= 0 lo desactiva)."""
+        if interval <= 0:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logging.warning('Retención de subidas fallida: %s', e)
+                time.sleep(interval)
+
+        # Se llama desde before_request con varios hilos: comprobar y arrancar bajo el lock
+        with self._lock:
+            if self._sweeper_pid == os.getpid() and self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._sweeper_pid = os.getpid()
+            self._sweeper = threading.Thread(target=loop, name='upload-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'root': self.root,
+                'max_bytes': self.max_bytes,
+                'max_age_s': self.max_age_s,
+                'usage': dict(self._usage),
+                'written_since_start': dict(self._written),
+                'evicted_since_start': dict(self._evicted),
+                'last_sweep': dict(self._last_sweep) if self._last_sweep else None,
+                'pending_writes': self._pending_writes,
+            }
@@ -0,0 +1,138 @@
+"""
+user_store.py
+Capa de acceso a users.db (SQLite) para login, registro y administración.
+
+- Una conexión por hilo (y por proceso, seguro tras el fork de gunicorn) que
+  se reutiliza entre peticiones; sqlite3 mantiene en cada conexión la caché de
+  sentencias preparadas, así que las consultas de los helpers no se recompilan.
+- Journal WAL: las lecturas (login) no se bloquean mientras otro hilo o
+  worker escribe (registro/borrado).
+- PRAGMAs ajustados (synchronous=NORMAL, busy_timeout, caché y temp_store en
+  memoria) y reintentos con espera si la base sigue bloqueada.
+
+Los helpers propagan las excepciones de sqlite3 (IntegrityError si el usuario
+ya existe, Error en otros casos) para que las rutas decidan el mensaje.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL
+    )
+'''
+
+
+class UserStore:
+    """Acceso a la tabla `users` con conexiones reutilizadas por hilo."""
+
+    def __init__(self, db_path, journal_mode='WAL', busy_timeout_ms=5000, cache_size_kib=2048,
+                 write_retries=3):
+        self.db_path = str(db_path)
+        self.journal_mode = journal_mode.upper()
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.cache_size_kib = int(cache_size_kib)
+        self.write_retries = max(0, int(write_retries))
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._stats_lock = threading.Lock()
+        self.connections_opened = 0
+        self.busy_retries = 0
+
+    # ---------- conexiones ----------
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000.0,
+                               isolation_level=None, cached_statements=64)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {self.busy_timeout_ms}')
+        conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        # En WAL, NORMAL es seguro frente a cortes del proceso y evita un fsync por commit
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{self.cache_size_kib}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA foreign_keys = ON')
+        with self._stats_lock:
+            self.connections_opened += 1
+        return conn
+
+    def connection(self):
+        """Conexión de este hilo (se abre en el primer uso)."""
+        if self._pid != os.getpid():
+            # Proceso hijo tras fork: no reutilizar conexiones del padre
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def close(self):
+        """Cierra la conexión del hilo actual (p.ej. al terminar un hilo de fondo)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def _read(self, sql, params=(), one=False):
+        cur = self.connection().execute(sql, params)
+        return cur.fetchone() if one else cur.fetchall()
+
+    def _write(self, sql, params=()):
+        """Ejecuta una escritura (autocommit). Reintenta si la base sigue bloqueada tras busy_timeout."""
+        for attempt in range(self.write_retries + 1):
+            try:
+                return self.connection().execute(sql, params).rowcount
+            except sqlite3.OperationalError as e:
+                retryable = 'locked' in str(e) or 'busy' in str(e)
+                if not retryable or attempt == self.write_retries:
+                    raise
+                with self._stats_lock:
+                    self.busy_retries += 1
+                logging.warning('users.db bloqueada; reintento %d de escritura [PID=%d]', attempt + 1, os.getpid())
+                time.sleep(0.05 * (attempt + 1))
+
+    # ---------- esquema ----------
+    def init_schema(self):
+        self._write(_SCHEMA)
+
+    # ---------- consultas ----------
+    def get_password_hash(self, username):
+        """Hash almacenado del usuario, o None si no existe."""
+        row = self._read('SELECT password FROM users WHERE username = ?', (username,), one=True)
+        return row['password'] if row else None
+
+    def create_user(self, username, password_hash):
+        """Inserta un usuario. Lanza sqlite3.IntegrityError si ya existe."""
+        self._write('INSERT INTO users (username, password) VALUES (?, ?)', (username, password_hash))
+
+    def update_password_hash(self, username, password_hash, expected_hash):
+        """Sustituye el hash solo si sigue siendo `expected_hash` (el usuario no cambió de
+        contraseña ni se borró y recreó mientras se recalculaba). Devuelve las filas actualizadas (0 o 1).
+        """
+        return self._write('UPDATE users SET password = ? WHERE username = ? AND password = ?',
+                           (password_hash, username, expected_hash))
+
+    def list_users(self):
+        return self._read('SELECT id, username FROM users ORDER BY username')
+
+    def get_username(self, user_id):
+        row = self._read('SELECT username FROM users WHERE id = ?', (user_id,), one=True)
+        return row['username'] if row else None
+
+    def delete_user(self, user_id):
+        return self._write('DELETE FROM users WHERE id = ?', (user_id,))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'db_path': self.db_path,
+                'journal_mode': self.journal_mode,
+                'busy_timeout_ms': self.busy_timeout_ms,
+                'connections_opened': self.connections_opened,
+                'busy_retries': self.busy_retries,
+            }